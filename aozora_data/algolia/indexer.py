@@ -1,36 +1,207 @@
 import logging
 import os
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import batched
+from typing import Protocol
 
-from algoliasearch.search.client import SearchClientSync
+from algoliasearch.search.client import SearchClient, SearchClientSync
 
 logger = logging.getLogger(__name__)
 
 BATCH_SIZE = 500
+# Batch requests sent at once by AlgoliaIndexer
+MAX_IN_FLIGHT = 4
+
+# Batch actions: records are replaced whole, partially updated (never creating a record
+# from a few attributes) or deleted
+ACTION_SAVE = "addObject"
+ACTION_UPDATE = "partialUpdateObjectNoCreate"
+ACTION_DELETE = "deleteObject"
+
+# A full reindex builds the new records in "<index><REINDEX_SUFFIX>" before moving it over
+REINDEX_SUFFIX = "_reindex"
+# What a full reindex keeps from the live index
+REINDEX_SCOPE = ["settings", "synonyms", "rules"]
+
+
+class Indexer(Protocol):
+    """What the importer needs from an Algolia indexer."""
+
+    def index_books(self, records: list[dict]) -> None:
+        """Upload book records."""
+        ...
+
+    def index_persons(self, records: list[dict]) -> None:
+        """Upload person records."""
+        ...
+
+    def update_books(self, records: list[dict]) -> None:
+        """Update the given attributes of existing book records."""
+        ...
+
+    def update_persons(self, records: list[dict]) -> None:
+        """Update the given attributes of existing person records."""
+        ...
+
+    def delete_books(self, object_ids: list[str]) -> None:
+        """Remove books."""
+        ...
+
+    def delete_persons(self, object_ids: list[str]) -> None:
+        """Remove persons."""
+        ...
+
+    def wait(self) -> None:
+        """Block until every operation sent so far is applied."""
+        ...
+
+
+def _requests(action: str, bodies: list[dict]) -> dict:
+    return {"requests": [{"action": action, "body": body} for body in bodies]}
 
 
 class AlgoliaIndexer:
-    """Indexes books and persons into Algolia after a Firestore import run."""
+    """Indexes books and persons into Algolia after a Firestore import run.
 
-    def __init__(self) -> None:
-        """Initialise Algolia client from environment variables."""
-        app_id = os.environ["ALGOLIA_APP_ID"]
-        admin_key = os.environ["ALGOLIA_ADMIN_KEY"]
-        self._client = SearchClientSync(app_id, admin_key)
+    Records are sent as ``BATCH_SIZE`` batch requests on a thread pool, ``max_in_flight``
+    at a time; ``wait`` blocks until Algolia has applied every one of them.
+    """
+
+    def __init__(
+        self, client: SearchClientSync | None = None, max_in_flight: int = MAX_IN_FLIGHT
+    ) -> None:
+        """Initialise Algolia client from environment variables, unless ``client`` is given."""
+        if client is None:
+            app_id = os.environ["ALGOLIA_APP_ID"]
+            admin_key = os.environ["ALGOLIA_ADMIN_KEY"]
+            client = SearchClientSync(app_id, admin_key)
+        self._client = client
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._pending: list[tuple[str, Future]] = []
+
+    def _send(self, index_name: str, action: str, bodies: Iterable[dict]) -> None:
+        for chunk in batched(bodies, BATCH_SIZE, strict=False):
+            future = self._pool.submit(
+                self._client.batch,
+                index_name=index_name,
+                batch_write_params=_requests(action, list(chunk)),
+            )
+            self._pending.append((index_name, future))
 
     def index_books(self, records: list[dict]) -> None:
         """Upload book records to the Algolia 'books' index."""
-        if not records:
-            return
-        logger.info(f"Indexing {len(records)} book(s) to Algolia...")
-        for i in range(0, len(records), BATCH_SIZE):
-            self._client.save_objects(index_name="books", objects=records[i : i + BATCH_SIZE])
-        logger.info("Book indexing done.")
+        if records:
+            logger.info(f"Indexing {len(records)} book(s) to Algolia...")
+            self._send("books", ACTION_SAVE, records)
 
     def index_persons(self, records: list[dict]) -> None:
         """Upload person records to the Algolia 'persons' index."""
-        if not records:
-            return
-        logger.info(f"Indexing {len(records)} person(s) to Algolia...")
-        for i in range(0, len(records), BATCH_SIZE):
-            self._client.save_objects(index_name="persons", objects=records[i : i + BATCH_SIZE])
-        logger.info("Person indexing done.")
+        if records:
+            logger.info(f"Indexing {len(records)} person(s) to Algolia...")
+            self._send("persons", ACTION_SAVE, records)
+
+    def update_books(self, records: list[dict]) -> None:
+        """Update the given attributes of book records in the Algolia 'books' index."""
+        if records:
+            logger.info(f"Updating {len(records)} book(s) in Algolia...")
+            self._send("books", ACTION_UPDATE, records)
+
+    def update_persons(self, records: list[dict]) -> None:
+        """Update the given attributes of person records in the Algolia 'persons' index."""
+        if records:
+            logger.info(f"Updating {len(records)} person(s) in Algolia...")
+            self._send("persons", ACTION_UPDATE, records)
+
+    def delete_books(self, object_ids: list[str]) -> None:
+        """Remove books from the Algolia 'books' index."""
+        if object_ids:
+            logger.info(f"Deleting {len(object_ids)} book(s) from Algolia...")
+            self._send("books", ACTION_DELETE, [{"objectID": i} for i in object_ids])
+
+    def delete_persons(self, object_ids: list[str]) -> None:
+        """Remove persons from the Algolia 'persons' index."""
+        if object_ids:
+            logger.info(f"Deleting {len(object_ids)} person(s) from Algolia...")
+            self._send("persons", ACTION_DELETE, [{"objectID": i} for i in object_ids])
+
+    def wait(self) -> None:
+        """Block until Algolia has applied every request sent so far; raises the first error."""
+        pending, self._pending = self._pending, []
+        for index_name, future in pending:
+            response = future.result()
+            self._client.wait_for_task(index_name=index_name, task_id=response.task_id)
+        if pending:
+            logger.info(f"Algolia indexing done ({len(pending)} request(s)).")
+
+    def _operation(self, index_name: str, operation: str, destination: str, **params: list) -> None:
+        response = self._client.operation_index(
+            index_name=index_name,
+            operation_index_params={"operation": operation, "destination": destination, **params},
+        )
+        self._client.wait_for_task(index_name=index_name, task_id=response.task_id)
+
+    def reindex(self, index_name: str, records: Iterable[dict]) -> None:
+        """Replace every record of an index, without the index ever being partly rebuilt.
+
+        The live index's settings, synonyms and rules are copied to a temporary index,
+        ``records`` are sent to it in parallel batches, and once Algolia has applied them
+        all the temporary index is moved over the live one, which swaps it atomically.
+        Searches see the old records until then. On failure the temporary index is
+        deleted and the live one left untouched.
+        """
+        self.wait()
+        tmp_index = f"{index_name}{REINDEX_SUFFIX}"
+        if self._client.index_exists(index_name=index_name):
+            self._operation(index_name, "copy", tmp_index, scope=REINDEX_SCOPE)
+        try:
+            logger.info(f"Reindexing {index_name} through {tmp_index}...")
+            self._send(tmp_index, ACTION_SAVE, records)
+            count = len(self._pending)
+            self.wait()
+            self._operation(tmp_index, "move", index_name)
+        except Exception:
+            self._pending = []
+            self._client.delete_index(index_name=tmp_index)
+            raise
+        logger.info(f"Reindexed {index_name} ({count} request(s)).")
+
+
+class AsyncAlgoliaIndexer:
+    """Asyncio counterpart of ``AlgoliaIndexer``; each call sends one batch request.
+
+    The caller splits the records into ``BATCH_SIZE`` chunks, bounds how many are in
+    flight, and waits for the task IDs returned.
+    """
+
+    def __init__(self) -> None:
+        """Initialise the async Algolia client from environment variables."""
+        app_id = os.environ["ALGOLIA_APP_ID"]
+        admin_key = os.environ["ALGOLIA_ADMIN_KEY"]
+        self._client = SearchClient(app_id, admin_key)
+
+    async def _batch(self, index_name: str, action: str, bodies: list[dict]) -> int:
+        response = await self._client.batch(
+            index_name=index_name, batch_write_params=_requests(action, bodies)
+        )
+        return response.task_id
+
+    async def save(self, index_name: str, records: list[dict]) -> int:
+        """Upload records to an index; returns the task ID."""
+        return await self._batch(index_name, ACTION_SAVE, records)
+
+    async def update(self, index_name: str, records: list[dict]) -> int:
+        """Update the given attributes of records; returns the task ID."""
+        return await self._batch(index_name, ACTION_UPDATE, records)
+
+    async def delete(self, index_name: str, object_ids: list[str]) -> int:
+        """Remove records from an index; returns the task ID."""
+        return await self._batch(index_name, ACTION_DELETE, [{"objectID": i} for i in object_ids])
+
+    async def wait_for_task(self, index_name: str, task_id: int) -> None:
+        """Block until Algolia has applied a task."""
+        await self._client.wait_for_task(index_name=index_name, task_id=task_id)
+
+    async def close(self) -> None:
+        """Close the client's HTTP session."""
+        await self._client.close()
@@ -0,0 +1,92 @@
+import argparse
+import logging
+from pathlib import Path
+
+from aozora_data.algolia.indexer import AlgoliaIndexer
+from aozora_data.catalog import Catalog
+from aozora_data.db.base import Storage
+from aozora_data.importer.csv_importer import ALGOLIA_FINGERPRINTS, algolia_records
+from aozora_data.importer.fingerprints import FingerprintStore
+from aozora_data.importer.main import BACKEND, BACKEND_PATH, BACKENDS, open_storage
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+INDEXES = ("books", "persons")
+
+
+def reindex_catalog(
+    catalog: Catalog,
+    indexer: AlgoliaIndexer,
+    indexes: tuple[str, ...] = INDEXES,
+    db: Storage | None = None,
+) -> None:
+    """Rebuild the given Algolia indexes from every book and person of ``catalog``.
+
+    With ``db``, the fingerprints of what each index holds, which the importer keeps
+    there to send only changes, are rewritten from its new records once it is live.
+    """
+    books, persons = algolia_records(catalog, catalog.book_ids(), catalog.person_rows)
+    records = {"books": books, "persons": persons}
+    for index_name in indexes:
+        indexer.reindex(index_name, records[index_name].values())
+        if db is not None:
+            reset_fingerprints(db, index_name, records[index_name])
+
+
+def reset_fingerprints(db: Storage, index_name: str, records: dict[str, dict]) -> None:
+    """Make the stored fingerprints of an index those of ``records``, and only those."""
+    fingerprints = FingerprintStore(db)
+    collection = ALGOLIA_FINGERPRINTS[index_name]
+    for object_id in fingerprints.ids(collection) - records.keys():
+        fingerprints.remove(collection, object_id)
+    for object_id, record in records.items():
+        fingerprints.changed_fields(collection, object_id, record)
+    fingerprints.save()
+    db.commit()
+    logger.info(f"Reset the fingerprints of {index_name} to {len(records)} record(s).")
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Rebuild the Algolia indexes from a catalog file."""
+    parser = argparse.ArgumentParser(
+        description="Rebuild the Algolia indexes from the catalog, swapping each in at once."
+    )
+    parser.add_argument(
+        "catalog",
+        help="Path to the Aozora catalog (list_person_all_extended_utf8.zip or .csv). "
+        "Use the catalog of the last import, whose records the importer assumes Algolia has.",
+    )
+    parser.add_argument(
+        "--index", choices=INDEXES, action="append", help="Index to rebuild (default: all)."
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=BACKEND,
+        help=f"Storage whose Algolia fingerprints are reset (default: {BACKEND}).",
+    )
+    parser.add_argument(
+        "--path", default=BACKEND_PATH, help="Database file (sqlite) or directory (jsonl)."
+    )
+    args = parser.parse_args(argv)
+
+    catalog_path = Path(args.catalog)
+    if not catalog_path.exists():
+        logger.error(f"Catalog not found: {catalog_path}")
+        return
+    try:
+        indexer = AlgoliaIndexer()
+    except KeyError:
+        logger.error("ALGOLIA_APP_ID and ALGOLIA_ADMIN_KEY must be set.")
+        return
+    db = open_storage(args.backend, args.path)
+    try:
+        reindex_catalog(Catalog.load(catalog_path), indexer, tuple(args.index or INDEXES), db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
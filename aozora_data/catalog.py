@@ -0,0 +1,350 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import struct
+import sys
+import tempfile
+import zipfile
+from array import array
+from collections.abc import Buffer, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, TextIO
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CATALOG_ENCODING = "utf-8-sig"
+CATALOG_HEADER_PREFIX = "作品ID"
+
+# Column names of the catalog, in order. The catalog has one row per (book, contributor)
+# pair, so a book with several contributors appears on several rows.
+FIELD_NAMES = (
+    "book_id",
+    "title",
+    "title_yomi",
+    "title_sort",
+    "subtitle",
+    "subtitle_yomi",
+    "original_title",
+    "first_appearance",
+    "ndc_code",
+    "font_kana_type",
+    "copyright",
+    "release_date",
+    "last_modified",
+    "card_url",
+    "person_id",
+    "last_name",
+    "first_name",
+    "last_name_yomi",
+    "first_name_yomi",
+    "last_name_sort",
+    "first_name_sort",
+    "last_name_roman",
+    "first_name_roman",
+    "role",
+    "date_of_birth",
+    "date_of_death",
+    "author_copyright",
+    "base_book_1",
+    "base_book_1_publisher",
+    "base_book_1_1st_edition",
+    "base_book_1_edition_input",
+    "base_book_1_edition_proofing",
+    "base_book_1_parent",
+    "base_book_1_parent_publisher",
+    "base_book_1_parent_1st_edition",
+    "base_book_2",
+    "base_book_2_publisher",
+    "base_book_2_1st_edition",
+    "base_book_2_edition_input",
+    "base_book_2_edition_proofing",
+    "base_book_2_parent",
+    "base_book_2_parent_publisher",
+    "base_book_2_parent_1st_edition",
+    "input",
+    "proofing",
+    "text_url",
+    "text_last_modified",
+    "text_encoding",
+    "text_charset",
+    "text_updated",
+    "html_url",
+    "html_last_modified",
+    "html_encoding",
+    "html_charset",
+    "html_updated",
+)
+FIELD_INDEX = {name: i for i, name in enumerate(FIELD_NAMES)}
+
+# Value of the copyright flags for works / persons that are not under copyright
+NO_COPYRIGHT = "なし"
+
+# Contributor roles: AUTHOR = 0, TRANSLATOR = 1, EDITOR = 2, REVISOR = 3, OTHER = 4
+ROLE_IDS = {"著者": 0, "翻訳者": 1, "編者": 2, "校訂者": 3, "その他": 4}
+ROLE_OTHER = 4
+
+# Bumped whenever the layout of the cache file changes, so stale cache files are re-parsed
+CACHE_VERSION = 2
+CACHE_SUFFIX = ".cache"
+CACHE_MAGIC = b"AOZCAT\0\0"
+# Magic, version, the source's size and mtime_ns, then the number of rows and strings.
+# Little-endian uint32 arrays follow: the end offset of every string, the strings as
+# one UTF-8 blob, then one array per column of FIELD_NAMES.
+CACHE_HEADER = struct.Struct("<8sIQqII")
+
+
+class _UnzipTimer(io.RawIOBase):
+    """Reads a zip member, timing its decompression as the ``unzip`` phase."""
+
+    def __init__(self, member: IO[bytes]) -> None:
+        self.member = member
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Buffer) -> int:
+        with metrics.phase("unzip"):
+            return self.member.readinto(buffer)  # type: ignore[attr-defined]
+
+    def close(self) -> None:
+        self.member.close()
+        super().close()
+
+
+def timed_unzip(member: IO[bytes]) -> io.BufferedReader:
+    """Wrap a zip member so that reading it times the decompression as ``unzip``."""
+    return io.BufferedReader(_UnzipTimer(member))
+
+
+@contextmanager
+def open_catalog(path: str | Path) -> Iterator[TextIO]:
+    """Open the catalog CSV, or the first member of the catalog zip, as a text stream.
+
+    Zip members are decompressed as they are read, so the catalog is never held in
+    memory as a whole.
+    """
+    path = Path(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z, z.open(z.namelist()[0]) as member:
+            yield io.TextIOWrapper(timed_unzip(member), encoding=CATALOG_ENCODING, newline="")
+    else:
+        with open(path, encoding=CATALOG_ENCODING, newline="") as f:
+            yield f
+
+
+def is_catalog(path: str | Path) -> bool:
+    """Return True if ``path`` looks like the catalog (zip, or CSV with its header row)."""
+    with open_catalog(path) as f:
+        return f.readline().startswith(CATALOG_HEADER_PREFIX)
+
+
+def iter_rows(stream: TextIO) -> Iterator[list[str]]:
+    """Yield catalog rows as lists of strings ordered like ``FIELD_NAMES``, header skipped."""
+    reader = csv.reader(stream)
+    next(reader, None)
+    for row in reader:
+        if len(row) >= len(FIELD_NAMES):
+            yield row
+
+
+class Catalog:
+    """The whole catalog parsed once into columns.
+
+    Every distinct string is stored once in ``strings``; each field is an ``array`` of
+    indexes into it, one per row. ``book_rows`` / ``person_rows`` map IDs to their row
+    numbers (in catalog order), and ``edges`` lists (book_id, person_id, role) of every
+    row. A parsed catalog can be cached next to its source and reloaded without parsing.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty catalog; use ``parse`` or ``load`` to fill one."""
+        self.strings: list[str] = []
+        self.columns: list[array] = [array("I") for _ in FIELD_NAMES]
+        self.book_rows: dict[str, list[int]] = {}
+        self.person_rows: dict[str, list[int]] = {}
+        self.edges: tuple[array, array, array] = (array("I"), array("I"), array("B"))
+
+    @classmethod
+    def parse(cls, stream: TextIO) -> "Catalog":
+        """Parse a catalog CSV stream (header row included)."""
+        catalog = cls()
+        codes: dict[str, int] = {}
+        strings = catalog.strings
+        columns = catalog.columns
+        for row in iter_rows(stream):
+            for column, value in zip(columns, row, strict=False):
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(strings)
+                    strings.append(value)
+                column.append(code)
+        catalog._build_indexes()
+        return catalog
+
+    def _build_indexes(self) -> None:
+        book_col = self.columns[FIELD_INDEX["book_id"]]
+        person_col = self.columns[FIELD_INDEX["person_id"]]
+        role_col = self.columns[FIELD_INDEX["role"]]
+        edge_books, edge_persons, edge_roles = self.edges
+        for i in range(len(self)):
+            book_id = self.strings[book_col[i]]
+            person_id = self.strings[person_col[i]]
+            self.book_rows.setdefault(book_id, []).append(i)
+            self.person_rows.setdefault(person_id, []).append(i)
+            edge_books.append(int(book_id or 0))
+            edge_persons.append(int(person_id or 0))
+            edge_roles.append(ROLE_IDS.get(self.strings[role_col[i]], ROLE_OTHER))
+
+    def _to_cache(self, size: int, mtime_ns: int) -> bytes:
+        blob = bytearray()
+        ends = array("I")
+        for string in self.strings:
+            blob += string.encode("utf-8")
+            ends.append(len(blob))
+        arrays = [ends, *self.columns]
+        if sys.byteorder != "little":
+            arrays = [array("I", a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        header = CACHE_HEADER.pack(
+            CACHE_MAGIC, CACHE_VERSION, size, mtime_ns, len(self), len(self.strings)
+        )
+        return b"".join([header, arrays[0].tobytes(), blob, *(a.tobytes() for a in arrays[1:])])
+
+    @classmethod
+    def _from_cache(cls, data: bytes, size: int, mtime_ns: int) -> "Catalog | None":
+        """Return the catalog in cache file ``data``, or None if it is for another source."""
+        header = CACHE_HEADER.unpack_from(data)
+        if header[:4] != (CACHE_MAGIC, CACHE_VERSION, size, mtime_ns):
+            return None
+        n_rows, n_strings = header[4:]
+        view = memoryview(data)
+        position = CACHE_HEADER.size
+
+        def take(nbytes: int) -> memoryview:
+            nonlocal position
+            if position + nbytes > len(view):
+                raise ValueError("truncated")
+            chunk = view[position : position + nbytes]
+            position += nbytes
+            return chunk
+
+        def uint32s(count: int) -> array:
+            values = array("I")
+            values.frombytes(take(4 * count))
+            if sys.byteorder != "little":
+                values.byteswap()
+            return values
+
+        ends = uint32s(n_strings)
+        blob = bytes(take(ends[-1] if ends else 0))
+        catalog = cls()
+        start = 0
+        for end in ends:
+            catalog.strings.append(blob[start:end].decode("utf-8"))
+            start = end
+        catalog.columns = [uint32s(n_rows) for _ in FIELD_NAMES]
+        if position != len(view):
+            raise ValueError("unexpected trailing data")
+        catalog._build_indexes()
+        return catalog
+
+    @classmethod
+    def load(cls, path: str | Path, use_cache: bool = True) -> "Catalog":
+        """Load the catalog zip or CSV at ``path``, through its cache file if up to date.
+
+        The cache (``<path>.cache``, laid out as described at ``CACHE_HEADER``) holds the
+        strings and columns, is keyed by the source's size and modification time, and is
+        rewritten whenever the source is re-parsed.
+        """
+        path = Path(path)
+        cache = path.with_name(path.name + CACHE_SUFFIX)
+        stat = path.stat()
+        if use_cache and cache.exists():
+            try:
+                catalog = cls._from_cache(cache.read_bytes(), stat.st_size, stat.st_mtime_ns)
+                if catalog is not None:
+                    return catalog
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Ignoring unreadable catalog cache {cache}: {e}")
+
+        with open_catalog(path) as f:
+            catalog = cls.parse(f)
+        logger.info(f"Parsed {len(catalog)} catalog rows ({len(catalog.book_rows)} books)")
+        if use_cache:
+            catalog._write_cache(cache, stat.st_size, stat.st_mtime_ns)
+        return catalog
+
+    def _write_cache(self, cache: Path, size: int, mtime_ns: int) -> None:
+        """Replace the cache file atomically; a cache that cannot be written is skipped.
+
+        The temporary file has a unique name, so processes loading the same catalog at
+        once never write into each other's file.
+        """
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=cache.parent, prefix=f"{cache.name}.", suffix=".tmp", delete=False
+            ) as tmp:
+                tmp_path = Path(tmp.name)
+                tmp.write(self._to_cache(size, mtime_ns))
+            os.replace(tmp_path, cache)
+        except OSError as e:
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+            logger.warning(f"Not caching the catalog in {cache}: {e}")
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def digest(self) -> str:
+        """Return a hash of the catalog's content."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update("\0".join(self.strings).encode("utf-8"))
+        for column in self.columns:
+            h.update(column.tobytes())
+        return h.hexdigest()
+
+    def value(self, row: int, field: str) -> str:
+        """Return one field of a row as the string found in the CSV."""
+        return self.strings[self.columns[FIELD_INDEX[field]][row]]
+
+    def row(self, row: int) -> dict[str, str]:
+        """Return a row as a dict keyed by ``FIELD_NAMES``."""
+        strings = self.strings
+        return {name: strings[col[row]] for name, col in zip(FIELD_NAMES, self.columns, strict=True)}
+
+    def book_ids(self) -> Iterator[str]:
+        """Yield book IDs in the order they first appear in the catalog."""
+        return iter(self.book_rows)
+
+    def rows_for_book(self, book_id: str) -> list[int]:
+        """Return the rows of a book, one per contributor."""
+        return self.book_rows.get(book_id, [])
+
+    def rows_for_person(self, person_id: str) -> list[int]:
+        """Return the rows of a person, one per contributed book."""
+        return self.person_rows.get(person_id, [])
+
+    def book(self, book_id: str) -> dict[str, str] | None:
+        """Return the first row of a book, or None if it is not in the catalog."""
+        rows = self.book_rows.get(book_id)
+        return self.row(rows[0]) if rows else None
+
+    def is_copyright_free(self, book_id: str) -> bool:
+        """Return True if the work is not under copyright."""
+        rows = self.book_rows.get(book_id)
+        return rows is not None and self.value(rows[0], "copyright") == NO_COPYRIGHT
+
+    def copyright_free_book_ids(self) -> set[str]:
+        """Return the IDs of all works that are not under copyright."""
+        return {book_id for book_id in self.book_rows if self.is_copyright_free(book_id)}
+
+    def contributors(self) -> Iterator[tuple[int, int, int]]:
+        """Yield (book_id, person_id, role) for every row."""
+        return zip(*self.edges, strict=True)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any
+
+from google.cloud import firestore  # type: ignore
+
+from ..metrics import metrics
+from .firestore import (
+    DEFAULT_MAX_IN_FLIGHT,
+    FINGERPRINT_SHARDS,
+    MAX_RETRIES,
+    RETRY_BACKOFF,
+    RETRYABLE_ERRORS,
+    SNAPSHOT_COLLECTION,
+    SNAPSHOT_HEAD,
+    FirestoreWrites,
+    snapshot_parts,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAozoraFirestore(FirestoreWrites):
+    """Firestore backend on ``firestore.AsyncClient`` for the asyncio importer.
+
+    Writes are buffered into batches exactly as in ``AozoraFirestore``; full batches are
+    queued and committed as tasks by ``drain``, at most ``max_in_flight`` at a time, while
+    the caller goes on mapping documents. Reads are coroutines. Fingerprints must be
+    fetched with ``prefetch_fingerprints`` before ``load_fingerprints`` is used.
+    """
+
+    def __init__(
+        self,
+        project_id: str | None = None,
+        client: firestore.AsyncClient | None = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_retries: int = MAX_RETRIES,
+    ) -> None:
+        """Initialize the async Firestore client.
+
+        ``client`` replaces the Firestore client, e.g. with an emulator client.
+        """
+        super().__init__(
+            client if client is not None else firestore.AsyncClient(project=project_id),
+            max_retries,
+        )
+        self._ready: list[tuple[Any, int]] = []
+        self._pending: list[asyncio.Task] = []
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._fingerprints: dict[str, dict[str, str]] = {}
+
+    def _state_ref(self) -> firestore.AsyncDocumentReference:
+        return self.db.collection("config").document("import_state")
+
+    def _async_snapshot_ref(self, doc_id: str) -> firestore.AsyncDocumentReference:
+        return self.db.collection(SNAPSHOT_COLLECTION).document(doc_id)
+
+    async def get_import_state(self) -> dict[str, Any]:
+        """Get the import state (watermark and catalog validators) from Firestore."""
+        doc = await self._state_ref().get()
+        return (doc.to_dict() or {}) if doc.exists else {}
+
+    async def save_import_state(self, state: dict[str, Any]) -> None:
+        """Merge fields into the import state document."""
+        await self._state_ref().set(state, merge=True)
+
+    async def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored catalog snapshot, or None if there is none."""
+        head = await self._async_snapshot_ref(SNAPSHOT_HEAD).get()
+        if not head.exists:
+            return None
+        names = head.get("parts")
+        refs = [self._async_snapshot_ref(name) for name in names]
+        parts = {doc.id: doc.get("data") async for doc in self.db.get_all(refs)}
+        return b"".join(parts[name] for name in names)
+
+    async def save_catalog_snapshot(self, data: bytes) -> None:
+        """Store a catalog snapshot: the parts, then the head naming them; old parts are dropped."""
+        head = await self._async_snapshot_ref(SNAPSHOT_HEAD).get()
+        old_names = head.get("parts") if head.exists else []
+        parts = snapshot_parts(data)
+        await asyncio.gather(
+            *(self._async_snapshot_ref(name).set({"data": chunk}) for name, chunk in parts.items())
+        )
+        await self._async_snapshot_ref(SNAPSHOT_HEAD).set({"parts": list(parts)})
+        await asyncio.gather(
+            *(self._async_snapshot_ref(name).delete() for name in old_names if name not in parts)
+        )
+
+    async def prefetch_fingerprints(self, collections: tuple[str, ...]) -> None:
+        """Fetch the fingerprints of ``collections`` concurrently."""
+
+        async def fetch(collection: str) -> None:
+            refs = [self._fingerprint_ref(collection, i) for i in range(FINGERPRINT_SHARDS)]
+            hashes: dict[str, str] = {}
+            async for doc in self.db.get_all(refs):
+                if doc.exists:
+                    hashes.update(doc.to_dict().get("hashes", {}))
+            self._fingerprints[collection] = hashes
+
+        await asyncio.gather(*(fetch(c) for c in collections))
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Return the prefetched fingerprints of a collection."""
+        if collection not in self._fingerprints:
+            raise RuntimeError(f"Fingerprints of {collection} were not prefetched")
+        return dict(self._fingerprints[collection])
+
+    def _flush_batch_if_needed(self, force: bool = False) -> None:
+        if self.batch_count >= self.BATCH_LIMIT or (force and self.batch_count > 0):
+            self._ready.append((self.batch, self.batch_count))
+            self.batch = self.db.batch()
+            self.batch_count = 0
+
+    async def _commit_with_retry(self, batch: Any, count: int) -> None:  # noqa: ANN401
+        # A failed commit keeps its writes, so the same batch can simply be committed again
+        attempt = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    await batch.commit()
+                    metrics.observe("commit_seconds", time.perf_counter() - start)
+                    metrics.count("commits")
+                    return
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        metrics.count("commit_failures")
+                        raise
+                    attempt += 1
+                    metrics.count("commit_retries")
+                    logger.warning(f"Retrying commit of {count} operations after {e!r} ({attempt})")
+                    await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
+        finally:
+            self._in_flight.release()
+
+    async def drain(self) -> None:
+        """Start committing the full batches; waits only while too many are in flight."""
+        while self._ready:
+            batch, count = self._ready.pop(0)
+            with metrics.phase("commit"):
+                await self._in_flight.acquire()
+            logger.debug("Committing batch of %d operations...", count)
+            self._pending.append(asyncio.create_task(self._commit_with_retry(batch, count)))
+            # Let the commit send its request before the caller resumes mapping
+            await asyncio.sleep(0)
+
+    async def commit(self) -> None:
+        """Commit remaining writes and wait until every pending write is committed."""
+        self._flush_batch_if_needed(force=True)
+        await self.drain()
+        pending, self._pending = self._pending, []
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+
+    async def close(self) -> None:
+        """Commit pending writes and close the client."""
+        try:
+            await self.commit()
+        finally:
+            self.db.close()
@@ -0,0 +1,209 @@
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from typing import Any, Protocol
+
+logger = logging.getLogger(__name__)
+
+# Given the current import state, returns the fields to merge into it, or None to
+# leave it as it is. May be called more than once, so it must not have side effects.
+StateUpdate = Callable[[dict[str, Any]], dict[str, Any] | None]
+
+
+class WriteBuffer(Protocol):
+    """The synchronous writes of an import: documents and their fingerprints.
+
+    Writes are buffered until their owner commits them. It is all the steps shared by
+    the sync and async importers use, so ``AsyncAozoraFirestore``, whose reads and
+    commits are coroutines, can run them too.
+    """
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Return the fingerprints of all documents of a collection."""
+        ...
+
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        """Merge fingerprint changes; None removes an entry."""
+        ...
+
+    def upsert_book(
+        self, book_id: str, data: dict[str, Any], fields: list[str] | None = None
+    ) -> None:
+        """Upsert a book; with ``fields``, only those fields of ``data`` are written."""
+        ...
+
+    def upsert_person(
+        self, person_id: str, data: dict[str, Any], fields: list[str] | None = None
+    ) -> None:
+        """Upsert a person; with ``fields``, only those fields of ``data`` are written."""
+        ...
+
+    def upsert_contributor(self, contributor_id: str, data: dict[str, Any]) -> None:
+        """Upsert a contributor."""
+        ...
+
+    def upsert_person_works(self, person_id: str, data: dict[str, Any]) -> None:
+        """Replace the aggregate of a person's books."""
+        ...
+
+    def update_book_author(self, book_id: str, data: dict[str, Any]) -> None:
+        """Write author_name and author_id onto an existing book document."""
+        ...
+
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Delete a document."""
+        ...
+
+
+class Storage(WriteBuffer, Protocol):
+    """What the importer needs from a place to store the catalog.
+
+    ``AozoraFirestore`` is the production implementation; ``DocumentStorage`` subclasses
+    store the same documents locally.
+    """
+
+    def get_watermark(self) -> str | None:
+        """Return the last processed date."""
+        ...
+
+    def save_watermark(self, date_str: str) -> None:
+        """Save the last processed date."""
+        ...
+
+    def get_import_state(self) -> dict[str, Any]:
+        """Return the import state (watermark and catalog validators)."""
+        ...
+
+    def save_import_state(self, state: dict[str, Any]) -> None:
+        """Merge fields into the import state."""
+        ...
+
+    def update_import_state(self, update: StateUpdate) -> bool:
+        """Atomically merge ``update(state)`` into the import state.
+
+        Returns False, changing nothing, if ``update`` returns None.
+        """
+        ...
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored catalog snapshot, or None if there is none."""
+        ...
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the stored catalog snapshot."""
+        ...
+
+    def commit(self) -> None:
+        """Make every write so far durable."""
+        ...
+
+    def close(self) -> None:
+        """Commit and release the storage."""
+        ...
+
+
+def _masked(data: dict[str, Any], fields: list[str] | None) -> dict[str, Any]:
+    return data if fields is None else {f: data[f] for f in fields}
+
+
+class DocumentStorage(ABC):
+    """Base of the local backends, with the same write semantics as ``AozoraFirestore``.
+
+    Books and persons are merged into existing documents, contributors replaced, and each
+    document is written at most once per run. Subclasses implement ``_set``, ``delete`` and the state,
+    fingerprint and snapshot methods.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the per-run caches."""
+        self.seen_books: set[str] = set()
+        self.seen_persons: set[str] = set()
+        self.seen_contributors: set[str] = set()
+
+    @abstractmethod
+    def _set(self, collection: str, doc_id: str, data: dict[str, Any], merge: bool) -> None: ...
+
+    @abstractmethod
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Delete a document."""
+
+    @abstractmethod
+    def get_import_state(self) -> dict[str, Any]:
+        """Return the import state (watermark and catalog validators)."""
+
+    @abstractmethod
+    def save_import_state(self, state: dict[str, Any]) -> None:
+        """Merge fields into the import state."""
+
+    def update_import_state(self, update: StateUpdate) -> bool:
+        """Merge ``update(state)`` into the import state; False if it returns None.
+
+        Not atomic across processes; backends shared by concurrent shards override it.
+        """
+        changes = update(self.get_import_state())
+        if changes is None:
+            return False
+        self.save_import_state(changes)
+        return True
+
+    @abstractmethod
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Return the fingerprints of all documents of a collection."""
+
+    @abstractmethod
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        """Merge fingerprint changes; None removes an entry."""
+
+    @abstractmethod
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored catalog snapshot, or None if there is none."""
+
+    @abstractmethod
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the stored catalog snapshot."""
+
+    def get_watermark(self) -> str | None:
+        """Return the last processed date."""
+        return self.get_import_state().get("last_modified")
+
+    def save_watermark(self, date_str: str) -> None:
+        """Save the last processed date."""
+        logger.info(f"Saving watermark: {date_str}")
+        self.save_import_state({"last_modified": date_str})
+
+    def upsert_book(
+        self, book_id: str, data: dict[str, Any], fields: list[str] | None = None
+    ) -> None:
+        """Upsert a book; with ``fields``, only those fields of ``data`` are written."""
+        if book_id not in self.seen_books:
+            self._set("books", book_id, _masked(data, fields), merge=True)
+            self.seen_books.add(book_id)
+
+    def upsert_person(
+        self, person_id: str, data: dict[str, Any], fields: list[str] | None = None
+    ) -> None:
+        """Upsert a person; with ``fields``, only those fields of ``data`` are written."""
+        if person_id not in self.seen_persons:
+            self._set("persons", person_id, _masked(data, fields), merge=True)
+            self.seen_persons.add(person_id)
+
+    def upsert_contributor(self, contributor_id: str, data: dict[str, Any]) -> None:
+        """Upsert a contributor."""
+        if contributor_id not in self.seen_contributors:
+            self._set("contributors", contributor_id, data, merge=False)
+            self.seen_contributors.add(contributor_id)
+
+    def upsert_person_works(self, person_id: str, data: dict[str, Any]) -> None:
+        """Replace the aggregate of a person's books."""
+        self._set("person_works", person_id, data, merge=False)
+
+    def update_book_author(self, book_id: str, data: dict[str, Any]) -> None:
+        """Write author_name and author_id onto an existing book document."""
+        self._set("books", book_id, data, merge=True)
+
+    def commit(self) -> None:  # noqa: B027 - nothing is buffered unless a subclass says so
+        """Make every write so far durable."""
+
+    def close(self) -> None:
+        """Commit and release the storage."""
+        self.commit()
@@ -0,0 +1,119 @@
+import json
+import os
+from pathlib import Path
+from typing import IO, Any
+
+from .base import DocumentStorage
+
+STATE_FILE = "import_state.json"
+FINGERPRINTS_FILE = "fingerprints.json"
+SNAPSHOT_FILE = "catalog_snapshot.json.gz"
+
+
+class JsonlStorage(DocumentStorage):
+    """Appends every write to ``<collection>.jsonl`` files in a directory.
+
+    Each line is ``{"id": ..., "merge": ..., "data": ...}`` or ``{"id": ..., "delete": true}``,
+    so the files are a replayable log of what a run would have written; ``read_documents``
+    folds them into documents.
+    Import state and fingerprints are kept in JSON files next to them, and the catalog
+    snapshot in ``SNAPSHOT_FILE``.
+    """
+
+    def __init__(self, directory: str | Path) -> None:
+        """Open the log directory, creating it if needed."""
+        super().__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._files: dict[str, IO[str]] = {}
+        self._fingerprints: dict[str, dict[str, str]] = self._read_json(FINGERPRINTS_FILE)
+
+    def _read_json(self, name: str) -> dict:
+        path = self.directory / name
+        if not path.exists():
+            return {}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_json(self, name: str, data: dict) -> None:
+        path = self.directory / name
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _append(self, collection: str, record: dict[str, Any]) -> None:
+        if collection not in self._files:
+            path = self.directory / f"{collection}.jsonl"
+            self._files[collection] = open(path, "a", encoding="utf-8")  # noqa: SIM115
+        self._files[collection].write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _set(self, collection: str, doc_id: str, data: dict[str, Any], merge: bool) -> None:
+        self._append(collection, {"id": doc_id, "merge": merge, "data": data})
+
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Log the deletion of a document."""
+        self._append(collection, {"id": doc_id, "delete": True})
+
+    def read_documents(self, collection: str) -> dict[str, dict[str, Any]]:
+        """Replay the log of a collection and return its documents by ID."""
+        path = self.directory / f"{collection}.jsonl"
+        docs: dict[str, dict[str, Any]] = {}
+        if not path.exists():
+            return docs
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("delete"):
+                    docs.pop(record["id"], None)
+                elif record["merge"] and record["id"] in docs:
+                    docs[record["id"]].update(record["data"])
+                else:
+                    docs[record["id"]] = record["data"]
+        return docs
+
+    def get_import_state(self) -> dict[str, Any]:
+        """Return the import state (watermark and catalog validators)."""
+        return self._read_json(STATE_FILE)
+
+    def save_import_state(self, state: dict[str, Any]) -> None:
+        """Merge fields into the import state."""
+        self._write_json(STATE_FILE, self.get_import_state() | state)
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Return the fingerprints of all documents of a collection."""
+        return dict(self._fingerprints.get(collection, {}))
+
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        """Merge fingerprint changes; None removes an entry. Written out by ``commit``."""
+        stored = self._fingerprints.setdefault(collection, {})
+        for doc_id, fp in changes.items():
+            if fp is None:
+                stored.pop(doc_id, None)
+            else:
+                stored[doc_id] = fp
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored catalog snapshot, or None if there is none."""
+        path = self.directory / SNAPSHOT_FILE
+        return path.read_bytes() if path.exists() else None
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the stored catalog snapshot."""
+        path = self.directory / SNAPSHOT_FILE
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def commit(self) -> None:
+        """Flush the logs and write out the fingerprints."""
+        for f in self._files.values():
+            f.flush()
+        self._write_json(FINGERPRINTS_FILE, self._fingerprints)
+
+    def close(self) -> None:
+        """Commit and close the logs."""
+        self.commit()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
@@ -0,0 +1,58 @@
+from typing import Any
+
+from .base import DocumentStorage
+
+
+class MemoryStorage(DocumentStorage):
+    """Keeps everything in dictionaries, for dry runs and for benchmarking the parser."""
+
+    def __init__(self) -> None:
+        """Initialize empty collections."""
+        super().__init__()
+        self.documents: dict[str, dict[str, dict[str, Any]]] = {}
+        self.import_state: dict[str, Any] = {}
+        self.fingerprints: dict[str, dict[str, str]] = {}
+        self.catalog_snapshot: bytes | None = None
+        self.write_count = 0
+
+    def _set(self, collection: str, doc_id: str, data: dict[str, Any], merge: bool) -> None:
+        docs = self.documents.setdefault(collection, {})
+        if merge and doc_id in docs:
+            docs[doc_id].update(data)
+        else:
+            docs[doc_id] = dict(data)
+        self.write_count += 1
+
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Delete a document."""
+        self.documents.get(collection, {}).pop(doc_id, None)
+        self.write_count += 1
+
+    def get_import_state(self) -> dict[str, Any]:
+        """Return the import state (watermark and catalog validators)."""
+        return dict(self.import_state)
+
+    def save_import_state(self, state: dict[str, Any]) -> None:
+        """Merge fields into the import state."""
+        self.import_state.update(state)
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Return the fingerprints of all documents of a collection."""
+        return dict(self.fingerprints.get(collection, {}))
+
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        """Merge fingerprint changes; None removes an entry."""
+        stored = self.fingerprints.setdefault(collection, {})
+        for doc_id, fp in changes.items():
+            if fp is None:
+                stored.pop(doc_id, None)
+            else:
+                stored[doc_id] = fp
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored catalog snapshot, or None if there is none."""
+        return self.catalog_snapshot
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the stored catalog snapshot."""
+        self.catalog_snapshot = data
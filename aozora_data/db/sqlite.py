@@ -0,0 +1,135 @@
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any
+
+from .base import DocumentStorage, StateUpdate
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS import_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+CATALOG_SNAPSHOT = "catalog_snapshot"
+
+
+class SqliteStorage(DocumentStorage):
+    """Stores documents as JSON in a single SQLite file, for staging imports locally.
+
+    Writes accumulate in one transaction that is committed by ``commit``.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """Open (and create if needed) the database at ``path``."""
+        super().__init__()
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def _set(self, collection: str, doc_id: str, data: dict[str, Any], merge: bool) -> None:
+        if merge:
+            existing = self.get_document(collection, doc_id)
+            if existing is not None:
+                data = existing | data
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)",
+            (collection, doc_id, json.dumps(data, ensure_ascii=False)),
+        )
+
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Delete a document."""
+        self.conn.execute(
+            "DELETE FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        )
+
+    def get_document(self, collection: str, doc_id: str) -> dict[str, Any] | None:
+        """Return a stored document, or None."""
+        row = self.conn.execute(
+            "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_import_state(self) -> dict[str, Any]:
+        """Return the import state (watermark and catalog validators)."""
+        rows = self.conn.execute("SELECT key, value FROM import_state")
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_import_state(self, state: dict[str, Any]) -> None:
+        """Merge fields into the import state."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO import_state (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in state.items()],
+        )
+        self.conn.commit()
+
+    def update_import_state(self, update: StateUpdate) -> bool:
+        """Merge ``update(state)`` into the import state in one write transaction."""
+        self.conn.commit()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            changes = update(self.get_import_state())
+        except BaseException:
+            self.conn.rollback()
+            raise
+        if changes is None:
+            self.conn.rollback()
+            return False
+        self.save_import_state(changes)  # Commits
+        return True
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Return the fingerprints of all documents of a collection."""
+        rows = self.conn.execute(
+            "SELECT id, hash FROM fingerprints WHERE collection = ?", (collection,)
+        )
+        return dict(rows)
+
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        """Merge fingerprint changes; None removes an entry."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO fingerprints (collection, id, hash) VALUES (?, ?, ?)",
+            [(collection, doc_id, fp) for doc_id, fp in changes.items() if fp is not None],
+        )
+        self.conn.executemany(
+            "DELETE FROM fingerprints WHERE collection = ? AND id = ?",
+            [(collection, doc_id) for doc_id, fp in changes.items() if fp is None],
+        )
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored catalog snapshot, or None if there is none."""
+        row = self.conn.execute(
+            "SELECT data FROM blobs WHERE name = ?", (CATALOG_SNAPSHOT,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the stored catalog snapshot."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO blobs (name, data) VALUES (?, ?)", (CATALOG_SNAPSHOT, data)
+        )
+        self.conn.commit()
+
+    def commit(self) -> None:
+        """Commit the current transaction."""
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Commit and close the database."""
+        self.commit()
+        self.conn.close()
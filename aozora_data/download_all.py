@@ -1,41 +1,295 @@
 import argparse
 import csv
-import io
+import datetime
+import json
 import logging
+import os
+import random
+import threading
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import IO, NamedTuple
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from aozora_data.catalog import Catalog, is_catalog
+from aozora_data.fetch import (
+    TIMEOUT,
+    SpooledDownload,
+    extract_member,
+    spool_response,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 SJIS_DIR = "sjis"
+STATE_FILE = "download_state.json"  # Per-book freshness metadata, kept inside SJIS_DIR
+STATE_SAVE_EVERY = 100  # Persist the state after this many updates
+DEFAULT_WORKERS = 1
+DEFAULT_PER_HOST = 4  # Be polite to aozora.gr.jp even with many workers
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds; doubled on every attempt
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Connection failures, including a reset or truncation partway through the body
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.Timeout,
+)
+REPORT_INTERVAL = 10.0  # seconds between throughput log lines
 
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not_modified"
+SKIPPED = "skipped"
+FAILED = "failed"
 
-def process_entry(book_id: str, url: str) -> None:
-    """Download and extract SJIS content."""
-    sjis_dir = Path(SJIS_DIR)
-    sjis_dir.mkdir(parents=True, exist_ok=True)
 
-    sjis_path = sjis_dir / f"{book_id}.sjis.txt"
+class Entry(NamedTuple):
+    """A book to download; ``text_last_modified`` is the catalog date of its text file."""
 
-    # Skip if already exists
-    if sjis_path.exists():
-        logger.info(f"Skipping (already exists): {sjis_path}")
-        return
+    book_id: str
+    url: str
+    text_last_modified: str | None = None
+
+
+class DownloadState:
+    """Per-book freshness metadata: URL, ETag, Last-Modified and catalog date.
+
+    Stored as one JSON object keyed by book ID. Writes are atomic so an interrupted run
+    never leaves a truncated file behind.
+    """
+
+    def __init__(self, path: Path, save_every: int = STATE_SAVE_EVERY) -> None:
+        """Load existing state from ``path`` if present."""
+        self.path = path
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.records: dict[str, dict[str, str | None]] = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                self.records = json.load(f)
+
+    def get(self, book_id: str) -> dict[str, str | None] | None:
+        """Return the stored record for a book, if any."""
+        with self._lock:
+            return self.records.get(book_id)
+
+    def update(self, book_id: str, record: dict[str, str | None]) -> None:
+        """Store the record for a book, saving periodically."""
+        with self._lock:
+            self.records[book_id] = record
+            self._dirty += 1
+            if self._dirty < self.save_every:
+                return
+        self.save()
+
+    def save(self) -> None:
+        """Atomically write the state file."""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.records, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = 0
+
+
+class DownloadStats:
+    """Thread-safe download counters with periodic throughput reporting."""
+
+    def __init__(self, total: int, report_interval: float = REPORT_INTERVAL) -> None:
+        """Initialize counters for ``total`` entries."""
+        self.total = total
+        self.report_interval = report_interval
+        self.counts = {DOWNLOADED: 0, NOT_MODIFIED: 0, SKIPPED: 0, FAILED: 0}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def record(self, status: str, nbytes: int = 0) -> None:
+        """Record the outcome of one entry and log throughput if it is time to."""
+        with self._lock:
+            self.counts[status] += 1
+            self.bytes += nbytes
+            now = time.monotonic()
+            if now - self._last_report < self.report_interval:
+                return
+            self._last_report = now
+        self.report()
+
+    def report(self) -> None:
+        """Log progress and throughput so far."""
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        done = sum(self.counts.values())
+        logger.info(
+            f"Progress: {done}/{self.total} "
+            f"(downloaded {self.counts[DOWNLOADED]}, not modified {self.counts[NOT_MODIFIED]}, "
+            f"skipped {self.counts[SKIPPED]}, failed {self.counts[FAILED]}) - "
+            f"{self.counts[DOWNLOADED] / elapsed:.1f} files/s, "
+            f"{self.bytes / elapsed / 1024:.1f} KiB/s"
+        )
 
-    if not url.lower().endswith(".zip"):
-        logger.warning(f"Skipping non-ZIP URL: {url}")
-        return
 
-    try:
-        logger.info(f"Downloading: {url} (BookID: {book_id})")
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+class Downloader:
+    """Download book ZIPs over a shared connection pool with retries and per-host limits."""
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+    def __init__(
+        self,
+        sjis_dir: str = SJIS_DIR,
+        workers: int = DEFAULT_WORKERS,
+        per_host: int = DEFAULT_PER_HOST,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = BACKOFF_BASE,
+        timeout: float = TIMEOUT,
+    ) -> None:
+        """Initialize the pooled session and concurrency limits."""
+        self.sjis_dir = Path(sjis_dir)
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.state = DownloadState(self.sjis_dir / STATE_FILE)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._host_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._host_lock = threading.Lock()
+        self.stats: DownloadStats | None = None
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _sleep_before_retry(self, attempt: int) -> None:
+        # Exponential backoff with full jitter
+        time.sleep(random.uniform(0, min(BACKOFF_MAX, self.backoff * 2**attempt)))
+
+    def fetch(self, url: str, headers: dict[str, str] | None = None) -> SpooledDownload:
+        """GET ``url`` into a spooled body, retrying on ``RETRY_ERRORS`` and 429/5xx.
+
+        Bodies cut short, whether the connection drops (``ChunkedEncodingError``) or
+        fewer bytes than the Content-Length arrive (``IncompleteDownloadError``, a
+        ``ConnectionError``), are retried as well.
+        """
+        attempt = 0
+        while True:
+            try:
+                with (
+                    self._host_slot(url),
+                    self.session.get(
+                        url, headers=headers, timeout=self.timeout, stream=True
+                    ) as response,
+                ):
+                    if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                        response.raise_for_status()
+                        # Read the body while holding the host slot
+                        return spool_response(response)
+                reason = f"HTTP {response.status_code}"
+            except RETRY_ERRORS as e:
+                if attempt >= self.retries:
+                    raise
+                reason = type(e).__name__
+            attempt += 1
+            logger.warning(f"Retrying {url} after {reason} ({attempt}/{self.retries})")
+            self._sleep_before_retry(attempt - 1)
+
+    def _conditional_headers(
+        self, entry: Entry, sjis_path: Path, record: dict[str, str | None] | None
+    ) -> dict[str, str] | None:
+        """Decide how to fetch an entry: None to skip, otherwise the request headers."""
+        if not sjis_path.exists():
+            return {}
+        if record is None or record.get("url") != entry.url:
+            if not entry.text_last_modified:
+                # No metadata and no catalog date: nothing to compare against
+                return None
+            mtime = datetime.date.fromtimestamp(sjis_path.stat().st_mtime).isoformat()
+            if mtime >= entry.text_last_modified:
+                # Downloaded after the catalog's last update; adopt it without refetching
+                self.state.update(
+                    entry.book_id,
+                    {
+                        "url": entry.url,
+                        "etag": None,
+                        "last_modified": None,
+                        "text_last_modified": entry.text_last_modified,
+                    },
+                )
+                return None
+            return {}
+        if entry.text_last_modified and record.get("text_last_modified") == entry.text_last_modified:
+            return None
+        headers = {}
+        if etag := record.get("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := record.get("last_modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def process_entry(self, entry: Entry) -> str:
+        """Download and extract SJIS content if it is missing or stale. Return the outcome."""
+        self.sjis_dir.mkdir(parents=True, exist_ok=True)
+        sjis_path = self.sjis_dir / f"{entry.book_id}.sjis.txt"
+        url = entry.url
+        record = self.state.get(entry.book_id)
+        nbytes = 0
+
+        headers = self._conditional_headers(entry, sjis_path, record)
+        if headers is None:
+            logger.info(f"Skipping (up to date): {sjis_path}")
+            status = SKIPPED
+        elif not url.lower().endswith(".zip"):
+            logger.warning(f"Skipping non-ZIP URL: {url}")
+            status = SKIPPED
+        else:
+            try:
+                logger.info(f"Downloading: {url} (BookID: {entry.book_id})")
+                with self.fetch(url, headers) as download:
+                    nbytes = download.size
+                    if download.status_code == 304:
+                        logger.info(f"Not modified: {url}")
+                        status = NOT_MODIFIED
+                    elif self._extract(download.file, url, sjis_path):
+                        status = DOWNLOADED
+                    else:
+                        status = FAILED
+                if status != FAILED:
+                    self.state.update(
+                        entry.book_id,
+                        {
+                            "url": url,
+                            "etag": download.headers.get("ETag") or (record or {}).get("etag"),
+                            "last_modified": download.headers.get("Last-Modified")
+                            or (record or {}).get("last_modified"),
+                            "text_last_modified": entry.text_last_modified,
+                        },
+                    )
+            except Exception as e:
+                logger.error(f"Failed to process {url}: {e}")
+                status = FAILED
+
+        if self.stats:
+            self.stats.record(status, nbytes)
+        return status
+
+    def _extract(self, body: IO[bytes], url: str, sjis_path: Path) -> bool:
+        with zipfile.ZipFile(body) as z:
             # Find the first .txt file
             text_filename = None
             for name in z.namelist():
@@ -45,34 +299,39 @@ def process_entry(book_id: str, url: str) -> None:
 
             if not text_filename:
                 logger.error(f"No .txt file found in zip: {url}")
-                return
+                return False
 
             logger.info(f"Extracting: {text_filename}")
-            with z.open(text_filename) as f:
-                content_sjis = f.read()
-
-            # Save to SJIS file
-            with open(sjis_path, "wb") as f:
-                f.write(content_sjis)
+            # Streamed to SJIS file through a temporary file, never fully in memory
+            extract_member(z, text_filename, sjis_path)
             logger.info(f"Saved to: {sjis_path}")
+        return True
 
-    except Exception as e:
-        logger.error(f"Failed to process {url}: {e}")
+    def run(self, entries: list[Entry]) -> DownloadStats:
+        """Process all entries with up to ``workers`` concurrent downloads."""
+        self.stats = DownloadStats(len(entries))
+        try:
+            if self.workers == 1:
+                for entry in entries:
+                    self.process_entry(entry)
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    # Consume the iterator so that worker exceptions surface here
+                    list(executor.map(self.process_entry, entries))
+        finally:
+            self.session.close()
+            self.state.save()
+        self.stats.report()
+        return self.stats
 
 
-def main() -> None:
-    """Download Aozora Bunko text files to sjis/ directory."""
-    parser = argparse.ArgumentParser(
-        description="Download Aozora Bunko text files to sjis/ directory."
-    )
-    parser.add_argument("csv_file", help="Path to a CSV file containing 'BookID,URL'.")
-    args = parser.parse_args()
+def process_entry(book_id: str, url: str) -> None:
+    """Download and extract SJIS content."""
+    Downloader().process_entry(Entry(book_id, url))
 
-    csv_file_path = Path(args.csv_file)
-    if not csv_file_path.exists():
-        logger.error(f"CSV file not found: {csv_file_path}")
-        return
 
+def load_csv_entries(csv_file_path: Path) -> list[Entry]:
+    """Load entries from a hand-made 'BookID,URL[,TextLastModified]' CSV."""
     entries = []
     with open(csv_file_path, encoding="utf-8") as f:
         reader = csv.reader(f)
@@ -80,15 +339,125 @@ def main() -> None:
             if len(row) >= 2:
                 book_id = row[0].strip()
                 url = row[1].strip()
+                text_last_modified = row[2].strip() if len(row) >= 3 else ""
                 if book_id and url and url.startswith("http"):
-                    entries.append((book_id, url))
+                    entries.append(Entry(book_id, url, text_last_modified or None))
                 elif book_id and url:
                     logger.warning(f"Skipping invalid row: {row}")
+    return entries
+
+
+def load_catalog_entries(
+    catalog_path: Path,
+    copyright_free: bool = False,
+    since: str | None = None,
+    until: str | None = None,
+    book_ids: set[int] | None = None,
+) -> list[Entry]:
+    """Load the catalog (zip or CSV) and return one entry per book passing the filters.
+
+    The catalog repeats a book on every contributor row; only the first row is used.
+    ``since``/``until`` are inclusive bounds on the text file's last-modified date.
+    """
+    catalog = Catalog.load(catalog_path)
+    entries = []
+    for book_id in catalog.book_ids():
+        first = catalog.rows_for_book(book_id)[0]
+        url = catalog.value(first, "text_url")
+        text_last_modified = catalog.value(first, "text_last_modified") or None
+        if not url.startswith("http"):
+            continue
+        if copyright_free and not catalog.is_copyright_free(book_id):
+            continue
+        if book_ids is not None and int(book_id) not in book_ids:
+            continue
+        if since and (not text_last_modified or text_last_modified < since):
+            continue
+        if until and (not text_last_modified or text_last_modified > until):
+            continue
+        entries.append(Entry(book_id, url, text_last_modified))
+
+    logger.info(f"Selected {len(entries)} of {len(catalog.book_rows)} books from the catalog.")
+    return entries
+
+
+def _parse_ids(value: str) -> set[int]:
+    return {int(v) for v in value.split(",") if v.strip()}
+
+
+def main() -> None:
+    """Download Aozora Bunko text files to sjis/ directory."""
+    parser = argparse.ArgumentParser(
+        description="Download Aozora Bunko text files to sjis/ directory."
+    )
+    parser.add_argument(
+        "csv_file",
+        help="Path to the Aozora catalog (list_person_all_extended_utf8.zip or .csv), "
+        "or to a CSV file containing 'BookID,URL[,TextLastModified]'.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of concurrent downloads (default: {DEFAULT_WORKERS}).",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=DEFAULT_PER_HOST,
+        help=f"Maximum concurrent requests per host (default: {DEFAULT_PER_HOST}).",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help=f"Retries on connection errors, 429 and 5xx (default: {DEFAULT_RETRIES}).",
+    )
+    parser.add_argument(
+        "--sjis-dir", default=SJIS_DIR, help=f"Output directory (default: {SJIS_DIR})."
+    )
+    filters = parser.add_argument_group("catalog filters")
+    filters.add_argument(
+        "--copyright-free",
+        action="store_true",
+        help="Only download works whose copyright flag is 'なし'.",
+    )
+    filters.add_argument(
+        "--since", help="Only download texts last modified on or after this date (YYYY-MM-DD)."
+    )
+    filters.add_argument(
+        "--until", help="Only download texts last modified on or before this date (YYYY-MM-DD)."
+    )
+    filters.add_argument(
+        "--ids", type=_parse_ids, help="Only download these comma-separated book IDs."
+    )
+    args = parser.parse_args()
+
+    csv_file_path = Path(args.csv_file)
+    if not csv_file_path.exists():
+        logger.error(f"CSV file not found: {csv_file_path}")
+        return
+
+    if is_catalog(csv_file_path):
+        entries = load_catalog_entries(
+            csv_file_path,
+            copyright_free=args.copyright_free,
+            since=args.since,
+            until=args.until,
+            book_ids=args.ids,
+        )
+    else:
+        entries = load_csv_entries(csv_file_path)
 
     logger.info(f"Found {len(entries)} entries to process.")
 
-    for book_id, url in entries:
-        process_entry(book_id, url)
+    downloader = Downloader(
+        sjis_dir=args.sjis_dir,
+        workers=args.workers,
+        per_host=args.per_host,
+        retries=args.retries,
+    )
+    downloader.run(entries)
 
 
 if __name__ == "__main__":
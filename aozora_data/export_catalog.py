@@ -0,0 +1,132 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from aozora_data.catalog import Catalog
+from aozora_data.importer.csv_importer import book_data, map_person, person_works
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIR = "catalog_json"
+EXPORT_VERSION = 1
+# Hex digits of the content hash in file names
+HASH_LEN = 12
+# The only mutable file: it names the current index, so it must not be cached for long
+MANIFEST = "manifest.json"
+# File name prefixes, and the index's key for each
+KINDS = {"books": "book", "persons": "person", "authors": "author"}
+
+
+def _encode(value: Any) -> bytes:  # noqa: ANN401
+    encoded = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return encoded.encode("utf-8")
+
+
+def _content_hash(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=HASH_LEN // 2).hexdigest()
+
+
+def shard_name(kind: str, doc_id: str, content_hash: str) -> str:
+    """Return the file name of a record, e.g. ``book-123.0123456789ab.json``."""
+    return f"{KINDS[kind]}-{doc_id}.{content_hash}.json"
+
+
+def _records(catalog: Catalog) -> Iterator[tuple[str, str, Any]]:
+    """Yield (kind, ID, record) for every file of the export."""
+    for book_id in catalog.book_ids():
+        yield "books", book_id, book_data([catalog.row(i) for i in catalog.rows_for_book(book_id)])
+    for person_id, rows in catalog.person_rows.items():
+        yield "persons", person_id, map_person(catalog.row(rows[0]))
+        yield "authors", person_id, person_works(catalog, person_id)
+
+
+def _write_atomic(path: Path, body: bytes) -> None:
+    tmp_path = path.with_name(f"{path.name}.part")
+    tmp_path.write_bytes(body)
+    os.replace(tmp_path, path)
+
+
+def export_catalog(catalog: Catalog, output_dir: Path, prune: bool = False) -> dict[str, Any]:
+    """Write the catalog as immutable, content-hashed JSON files and return the manifest.
+
+    Every book, person and per-author book list (the ``person_works`` document) gets
+    its own file, named after its ID and the hash of its content, so a file never changes
+    once written and unchanged records are not written again. The index maps each ID to
+    its current hash, and is itself content-hashed; ``manifest.json``, written last,
+    names the current index. With ``prune``, files no longer referenced by the index
+    are removed.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index: dict[str, dict[str, str]] = {kind: {} for kind in KINDS}
+    names = set()
+    written = 0
+    for kind, doc_id, record in _records(catalog):
+        body = _encode(record)
+        content_hash = _content_hash(body)
+        index[kind][doc_id] = content_hash
+        name = shard_name(kind, doc_id, content_hash)
+        names.add(name)
+        if not (output_dir / name).exists():
+            _write_atomic(output_dir / name, body)
+            written += 1
+
+    body = _encode(index)
+    index_name = f"index.{_content_hash(body)}.json"
+    names.add(index_name)
+    if not (output_dir / index_name).exists():
+        _write_atomic(output_dir / index_name, body)
+        written += 1
+
+    manifest = {
+        "version": EXPORT_VERSION,
+        "catalog": catalog.digest(),
+        "index": index_name,
+        **{kind: len(ids) for kind, ids in index.items()},
+    }
+    body = _encode(manifest)
+    manifest_path = output_dir / MANIFEST
+    if not manifest_path.exists() or manifest_path.read_bytes() != body:
+        _write_atomic(manifest_path, body)
+    logger.info(f"Exported {len(names)} files to {output_dir} ({written} new)")
+
+    if prune:
+        stale = [p for p in output_dir.glob("*.json") if p.name not in names and p.name != MANIFEST]
+        for path in stale:
+            path.unlink()
+        logger.info(f"Pruned {len(stale)} unreferenced files")
+    return manifest
+
+
+def main() -> None:
+    """Export the catalog as static JSON for CDN serving."""
+    parser = argparse.ArgumentParser(description="Export the catalog as static JSON files.")
+    parser.add_argument(
+        "catalog", help="Path to the Aozora catalog (list_person_all_extended_utf8.zip or .csv)."
+    )
+    parser.add_argument(
+        "--output-dir", default=OUTPUT_DIR, help=f"Output directory (default: {OUTPUT_DIR})."
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Remove files of earlier exports. Only do this once clients can no longer "
+        "hold an earlier manifest, i.e. after its CDN cache lifetime.",
+    )
+    args = parser.parse_args()
+
+    catalog_path = Path(args.catalog)
+    if not catalog_path.exists():
+        logger.error(f"Catalog not found: {catalog_path}")
+        return
+    export_catalog(Catalog.load(catalog_path), Path(args.output_dir), args.prune)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from collections.abc import Mapping
+from pathlib import Path
+from types import TracebackType
+from typing import IO
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+
+TIMEOUT = 30
+SPOOL_THRESHOLD = 8 * 1024 * 1024  # Bodies larger than this spill from memory to disk
+CHUNK_SIZE = 64 * 1024
+
+
+class IncompleteDownloadError(requests.ConnectionError):
+    """The body was shorter or longer than the Content-Length announced by the server.
+
+    Subclasses ``requests.ConnectionError`` so that callers retrying on connection errors
+    retry truncated transfers too.
+    """
+
+
+class SpooledDownload:
+    """A fetched response whose body lives in a spooled temporary file."""
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: CaseInsensitiveDict,
+        file: IO[bytes],
+        size: int,
+        sha256: str,
+    ) -> None:
+        """Wrap a spooled body positioned at its start."""
+        self.status_code = status_code
+        self.headers = headers
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+
+    def close(self) -> None:
+        """Release the spooled body (and its temporary file, if it spilled to disk)."""
+        self.file.close()
+
+    def __enter__(self) -> "SpooledDownload":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+def _check_length(
+    headers: Mapping[str, str], size: int, url: object, response: requests.Response | None = None
+) -> None:
+    # With a Content-Encoding the header counts encoded bytes, not what we received
+    expected = headers.get("Content-Length")
+    encoded = headers.get("Content-Encoding", "identity") != "identity"
+    if expected is not None and not encoded and int(expected) != size:
+        raise IncompleteDownloadError(
+            f"Expected {expected} bytes from {url}, got {size}", response=response
+        )
+
+
+def spool_response(
+    response: requests.Response,
+    threshold: int = SPOOL_THRESHOLD,
+    chunk_size: int = CHUNK_SIZE,
+) -> SpooledDownload:
+    """Stream the body of a ``stream=True`` response into a spooled temporary file.
+
+    The body stays in memory below ``threshold`` bytes and is moved to disk above it.
+    Its length is checked against Content-Length and its SHA-256 computed on the way.
+    """
+    # Ownership passes to the returned SpooledDownload
+    spool = tempfile.SpooledTemporaryFile(max_size=threshold)  # noqa: SIM115
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in response.iter_content(chunk_size):
+            spool.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+        _check_length(response.headers, size, response.url, response)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return SpooledDownload(response.status_code, response.headers, spool, size, digest.hexdigest())
+
+
+def fetch(
+    url: str,
+    session: requests.Session | None = None,
+    headers: dict[str, str] | None = None,
+    timeout: float = TIMEOUT,
+    threshold: int = SPOOL_THRESHOLD,
+) -> SpooledDownload:
+    """GET ``url`` and spool its body. Raises for 4xx/5xx; 304 yields an empty body."""
+    getter = session.get if session else requests.get
+    with getter(url, headers=headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        return spool_response(response, threshold)
+
+
+async def fetch_async(
+    url: str,
+    session: aiohttp.ClientSession,
+    headers: dict[str, str] | None = None,
+    timeout: float = TIMEOUT,
+    threshold: int = SPOOL_THRESHOLD,
+    chunk_size: int = CHUNK_SIZE,
+) -> SpooledDownload:
+    """Asyncio counterpart of ``fetch`` on an aiohttp session.
+
+    ``timeout`` applies to connecting and to every read, as it does for requests.
+    """
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+    async with session.get(url, headers=headers, timeout=client_timeout) as response:
+        response.raise_for_status()
+        spool = tempfile.SpooledTemporaryFile(max_size=threshold)  # noqa: SIM115
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                spool.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            _check_length(response.headers, size, response.url)
+        except BaseException:
+            spool.close()
+            raise
+        status, response_headers = response.status, CaseInsensitiveDict(response.headers)
+
+    spool.seek(0)
+    return SpooledDownload(status, response_headers, spool, size, digest.hexdigest())
+
+
+def extract_member(z: zipfile.ZipFile, name: str, dest: Path, chunk_size: int = CHUNK_SIZE) -> int:
+    """Stream one zip member to ``dest`` and return its size.
+
+    The member is decompressed chunk by chunk into a temporary file next to ``dest``,
+    which is renamed into place once complete.
+    """
+    tmp_path = dest.with_name(f"{dest.name}.part")
+    try:
+        with z.open(name) as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+            size = dst.tell()
+        os.replace(tmp_path, dest)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return size
@@ -2,7 +2,7 @@ import argparse
 import logging
 from pathlib import Path
 
-from aozora_data.text_to_html.converter import TextToHtmlConverter
+from aozora_data.text_to_html.converter import CSS_MODE_LINK, CSS_MODES, TextToHtmlConverter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -20,6 +20,12 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Perform a dry run without actually converting files.",
     )
+    parser.add_argument(
+        "--css-mode",
+        choices=CSS_MODES,
+        default=CSS_MODE_LINK,
+        help="Link the full stylesheet, or inline the CSS subset each document actually uses.",
+    )
     return parser.parse_args()
 
 
@@ -68,7 +74,7 @@ def main() -> None:
             continue
 
         try:
-            converter = TextToHtmlConverter(str(input_path), str(output_path))
+            converter = TextToHtmlConverter(str(input_path), str(output_path), css_mode=args.css_mode)
             converter.convert()
 
             logger.info(f"Converted: {input_path} -> {output_path}")
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Iterable
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+
+from ..algolia.indexer import BATCH_SIZE, AsyncAlgoliaIndexer
+from ..catalog import Catalog
+from ..db.async_firestore import AsyncAozoraFirestore
+from ..fetch import fetch_async
+from ..metrics import metrics
+from .csv_importer import (
+    ALGOLIA_FINGERPRINTS,
+    FINGERPRINTED,
+    affected_persons,
+    algolia_candidates,
+    algolia_changes,
+    algolia_records,
+    book_steps,
+    catalog_validators,
+    checkpoint_key,
+    conditional_headers,
+    delete_removed,
+    left_catalog,
+    parse_catalog_zip,
+    plan_run,
+    write_outputs,
+    write_person_works,
+)
+from .fingerprints import FingerprintStore
+from .sharding import UNSHARDED
+from .snapshot import SnapshotLocation
+
+logger = logging.getLogger(__name__)
+
+# Algolia requests (of up to BATCH_SIZE records) in flight at once
+ALGOLIA_MAX_IN_FLIGHT = 4
+
+
+class AlgoliaUploads:
+    """Algolia requests sent in the background of an import, a bounded number at a time.
+
+    Records unchanged since they were last sent (per ``fingerprints``) are skipped and
+    partly changed ones partially updated, as by ``csv_importer._sync_algolia``. Without
+    ALGOLIA_APP_ID / ALGOLIA_ADMIN_KEY, nothing is sent.
+    """
+
+    def __init__(
+        self,
+        catalog: Catalog,
+        indexer: AsyncAlgoliaIndexer | None,
+        fingerprints: FingerprintStore | None = None,
+    ) -> None:
+        """Send records built from ``catalog`` with ``indexer``."""
+        self.catalog = catalog
+        self.indexer = indexer
+        self.fingerprints = fingerprints
+        self.sent: dict[str, set[str]] = {"books": set(), "persons": set()}
+        self._tasks: list[asyncio.Task] = []
+        self._in_flight = asyncio.Semaphore(ALGOLIA_MAX_IN_FLIGHT)
+
+    async def _send(self, index_name: str, request: Awaitable[int]) -> tuple[str, int]:
+        async with self._in_flight:
+            return index_name, await request
+
+    def _start(self, index_name: str, request: Awaitable[int]) -> None:
+        self._tasks.append(asyncio.create_task(self._send(index_name, request)))
+
+    def save(self, book_ids: Iterable[str], person_ids: Iterable[str]) -> None:
+        """Start uploading the records of the books and persons not sent yet."""
+        if self.indexer is None:
+            return
+        book_ids = set(book_ids) - self.sent["books"]
+        person_ids = set(person_ids) - self.sent["persons"]
+        self.sent["books"] |= book_ids
+        self.sent["persons"] |= person_ids
+        books, persons = algolia_records(self.catalog, book_ids, person_ids)
+        for index_name, records in (("books", books), ("persons", persons)):
+            saves, updates = algolia_changes(index_name, records, self.fingerprints)
+            for i in range(0, len(saves), BATCH_SIZE):
+                chunk = saves[i : i + BATCH_SIZE]
+                self._start(index_name, self.indexer.save(index_name, chunk))
+            for i in range(0, len(updates), BATCH_SIZE):
+                chunk = updates[i : i + BATCH_SIZE]
+                self._start(index_name, self.indexer.update(index_name, chunk))
+
+    def delete(self, book_ids: list[str], person_ids: list[str]) -> None:
+        """Start removing books and persons."""
+        if self.indexer is None:
+            return
+        for index_name, object_ids in (("books", book_ids), ("persons", person_ids)):
+            if self.fingerprints is not None:
+                for object_id in object_ids:
+                    self.fingerprints.remove(ALGOLIA_FINGERPRINTS[index_name], object_id)
+            for i in range(0, len(object_ids), BATCH_SIZE):
+                chunk = object_ids[i : i + BATCH_SIZE]
+                self._start(index_name, self.indexer.delete(index_name, chunk))
+
+    async def wait(self) -> None:
+        """Wait until Algolia has applied every request sent so far; raises the first error."""
+        tasks, self._tasks = self._tasks, []
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        sent: list[tuple[str, int]] = []
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+            sent.append(result)
+        if self.indexer is not None:
+            await asyncio.gather(
+                *(self.indexer.wait_for_task(index_name, task_id) for index_name, task_id in sent)
+            )
+
+
+def _algolia_indexer() -> AsyncAlgoliaIndexer | None:
+    try:
+        return AsyncAlgoliaIndexer()
+    except KeyError:
+        logger.info("ALGOLIA_APP_ID/ALGOLIA_ADMIN_KEY not set — skipping Algolia indexing.")
+        return None
+
+
+async def _save_progress(
+    db: AsyncAozoraFirestore, fingerprints: FingerprintStore, progress: dict[str, Any]
+) -> None:
+    """Async counterpart of ``csv_importer._save_progress``, in the same order."""
+    with metrics.phase("commit"):
+        await db.commit()
+        await db.save_import_state({checkpoint_key(UNSHARDED): progress})
+        fingerprints.save()
+        await db.commit()
+
+
+async def import_catalog_async(
+    catalog: Catalog,
+    db: AsyncAozoraFirestore,
+    limit: int = 0,
+    full: bool = False,
+    snapshot: SnapshotLocation | None = None,
+    report: str | Path | None = None,
+    state: dict[str, Any] | None = None,
+) -> bool:
+    """Asyncio counterpart of ``import_catalog`` (unsharded).
+
+    Documents are mapped on the event loop while full batches are committed in the
+    background. The Algolia records of every checkpointed chunk are uploaded while the
+    next chunk is processed, rather than all at the end. ``state`` is the import state
+    if already read; the fingerprints are fetched along with it unless prefetched.
+    """
+    if state is None:
+        state, _ = await asyncio.gather(
+            db.get_import_state(), db.prefetch_fingerprints(FINGERPRINTED)
+        )
+    run = plan_run(catalog, state, limit, full, snapshot, UNSHARDED)
+    fingerprints = FingerprintStore(db)
+    progress = run.progress
+    indexer = _algolia_indexer()
+    algolia_fingerprints = FingerprintStore(db)
+    uploads = AlgoliaUploads(catalog, indexer, algolia_fingerprints)
+    try:
+        # Documents committed by an interrupted attempt may not have reached Algolia
+        book_ids, uploaded = list(run.rows_by_book), progress["books_done"]
+        uploads.save(*algolia_candidates(catalog, book_ids[:uploaded]))
+        with metrics.phase("process"):
+            for checkpoint in book_steps(run.rows_by_book, db, fingerprints, UNSHARDED, progress):
+                await db.drain()
+                if checkpoint:
+                    await _save_progress(db, fingerprints, progress)
+                    done = progress["books_done"]
+                    uploads.save(*algolia_candidates(catalog, book_ids[uploaded:done]))
+                    uploaded = done
+            write_person_works(catalog, affected_persons(run, UNSHARDED), db, fingerprints)
+            await db.drain()
+
+        if run.diff is not None:
+            delete_removed(run.diff, db, fingerprints)
+        progress.update(max_last_modified=run.max_last_modified, done=True)
+        await _save_progress(db, fingerprints, progress)
+
+        uploads.save(*algolia_candidates(catalog, book_ids[uploaded:]))
+        removed_books, removed_persons = left_catalog(catalog, algolia_fingerprints)
+        if run.diff is not None:
+            removed_books = sorted({*removed_books, *run.diff.books.removed})
+            removed_persons = sorted({*removed_persons, *run.diff.persons.removed})
+        uploads.delete(removed_books, removed_persons)
+        with metrics.phase("algolia"):
+            await uploads.wait()
+        if indexer is not None:
+            algolia_fingerprints.save()
+            await db.commit()
+    finally:
+        if indexer is not None:
+            await indexer.close()
+
+    watermark = state.get("last_modified")
+    completed: dict[str, Any] = {checkpoint_key(UNSHARDED): None}
+    if run.max_last_modified and (not watermark or run.max_last_modified > watermark):
+        logger.info(f"Saving watermark: {run.max_last_modified}")
+        completed["last_modified"] = run.max_last_modified
+    await db.save_import_state(completed)
+    write_outputs(run, snapshot, report)
+    return True
+
+
+async def import_from_csv_url_async(
+    csv_url: str,
+    db: AsyncAozoraFirestore,
+    limit: int = 0,
+    force: bool = False,
+    full: bool = False,
+    snapshot: SnapshotLocation | None = None,
+    report: str | Path | None = None,
+) -> bool:
+    """Asyncio counterpart of ``import_from_csv_url`` (unsharded).
+
+    The catalog is downloaded with aiohttp and parsed in a worker thread while the
+    fingerprints are fetched. The catalog is grouped by person, so no book can be
+    written before it is fully parsed.
+    """
+    state = await db.get_import_state()
+    headers = {} if force else conditional_headers(state)
+    prefetch = asyncio.create_task(db.prefetch_fingerprints(FINGERPRINTED))
+    try:
+        async with aiohttp.ClientSession() as session:
+            with metrics.phase("download"):
+                download = await fetch_async(csv_url, session, headers=headers)
+        metrics.count("download_bytes", download.size)
+        with download:
+            if download.status_code == 304:
+                logger.info("Catalog not modified since the last import (HTTP 304), skipping.")
+                return False
+            if not force and download.sha256 == state.get("catalog_sha256"):
+                logger.info("Catalog content unchanged since the last import, skipping.")
+                return False
+            catalog = await asyncio.to_thread(parse_catalog_zip, download.file)
+        await prefetch
+    finally:
+        prefetch.cancel()
+
+    finished = await import_catalog_async(catalog, db, limit, full, snapshot, report, state)
+    # A limited import has not seen the whole catalog, so it must not mark it as done
+    if finished and not limit:
+        await db.save_import_state(catalog_validators(download))
+    return True
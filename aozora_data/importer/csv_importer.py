@@ -1,71 +1,49 @@
+import io
+import json
 import logging
-from csv import DictReader
-from io import BytesIO
-from typing import TextIO
-
-import requests
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, NamedTuple, TextIO
+from zipfile import ZipFile
+
+from ..catalog import ROLE_IDS, ROLE_OTHER, Catalog, timed_unzip
+from ..db.base import Storage, WriteBuffer
+from ..fetch import SpooledDownload, fetch
+from ..metrics import metrics
+from .fingerprints import FingerprintStore, fingerprint
+from .sharding import UNSHARDED, Shard
+from .snapshot import (
+    CatalogDiff,
+    Snapshot,
+    SnapshotLocation,
+    diff_snapshots,
+    load_snapshot,
+    save_snapshot,
+)
 
-from ..db.firestore import AozoraFirestore
+if TYPE_CHECKING:
+    from ..algolia.indexer import Indexer
 
 logger = logging.getLogger(__name__)
 
-FIELD_NAMES = (
-    "book_id",
-    "title",
-    "title_yomi",
-    "title_sort",
-    "subtitle",
-    "subtitle_yomi",
-    "original_title",
-    "first_appearance",
-    "ndc_code",
-    "font_kana_type",
-    "copyright",
-    "release_date",
-    "last_modified",
-    "card_url",
-    "person_id",
-    "last_name",
-    "first_name",
-    "last_name_yomi",
-    "first_name_yomi",
-    "last_name_sort",
-    "first_name_sort",
-    "last_name_roman",
-    "first_name_roman",
-    "role",
-    "date_of_birth",
-    "date_of_death",
-    "author_copyright",
-    "base_book_1",
-    "base_book_1_publisher",
-    "base_book_1_1st_edition",
-    "base_book_1_edition_input",
-    "base_book_1_edition_proofing",
-    "base_book_1_parent",
-    "base_book_1_parent_publisher",
-    "base_book_1_parent_1st_edition",
-    "base_book_2",
-    "base_book_2_publisher",
-    "base_book_2_1st_edition",
-    "base_book_2_edition_input",
-    "base_book_2_edition_proofing",
-    "base_book_2_parent",
-    "base_book_2_parent_publisher",
-    "base_book_2_parent_1st_edition",
-    "input",
-    "proofing",
-    "text_url",
-    "text_last_modified",
-    "text_encoding",
-    "text_charset",
-    "text_updated",
-    "html_url",
-    "html_last_modified",
-    "html_encoding",
-    "html_charset",
-    "html_updated",
-)
+# Collections written by the importer, in the order of CatalogDiff's fields
+COLLECTIONS = ("books", "persons", "contributors")
+# Per-person aggregate of their books, derived from the other collections
+PERSON_WORKS = "person_works"
+# Fingerprints of the records last sent to each Algolia index
+ALGOLIA_FINGERPRINTS = {"books": "algolia_books", "persons": "algolia_persons"}
+# Collections whose fingerprints the importer reads
+FINGERPRINTED = (*COLLECTIONS, PERSON_WORKS, *ALGOLIA_FINGERPRINTS.values())
+
+# Progress is committed and checkpointed after this many books, which bounds the work
+# redone after a crash
+CHECKPOINT_EVERY = 500
+
+# Import state field naming the run a shard is completing (see ``finish_run``), and how
+# long that claim holds before another task may take the run over
+FINISHING = "finishing"
+FINISH_LEASE_SECONDS = 30 * 60
 
 
 def _parse_date(val: str) -> str | None:
@@ -84,36 +62,13 @@ def _parse_bool(val: str) -> bool:
 
 
 def _parse_role(val: str) -> int:
-    # Map Japanese roles to IDs manually if needed, or just store the string?
-    # Original model.py had Mapping.
-    # AUTHOR = 0, TRANSLATOR = 1, EDITOR = 2, REVISOR = 3, OTHER = 4
-    if val == "著者":
-        return 0
-    if val == "翻訳者":
-        return 1
-    if val == "編者":
-        return 2
-    if val == "校訂者":
-        return 3
-    if val == "その他":
-        return 4
-    return 4
-
-
-def _process_row(
-    row: dict,
-    db: AozoraFirestore,
-    author_map: dict,
-    first_contributor_map: dict,
-    algolia_books: dict,
-    algolia_persons: dict,
-) -> None:
-    """Upsert one CSV row (book, person, contributor) into Firestore and collect Algolia records."""
-    book_id = row["book_id"]
-    person_id = row["person_id"]
+    return ROLE_IDS.get(val, ROLE_OTHER)
+
 
-    book_data = {
-        "book_id": _parse_int(book_id),
+def _map_book(row: dict) -> dict:
+    """Map the book columns of a CSV row to a ``books`` document."""
+    return {
+        "book_id": _parse_int(row["book_id"]),
         "title": row["title"],
         "title_yomi": row["title_yomi"],
         "title_sort": row["title_sort"],
@@ -143,18 +98,12 @@ def _process_row(
         "html_charset": row["html_charset"],
         "html_updated": _parse_int(row["html_updated"]),
     }
-    db.upsert_book(book_id, book_data)
-    algolia_books[book_id] = {
-        "objectID": book_id,
-        "book_id": book_data["book_id"],
-        "title": book_data["title"],
-        "title_yomi": book_data["title_yomi"],
-        "font_kana_type": book_data["font_kana_type"],
-        "copyright": book_data["copyright"],
-    }
 
-    person_data = {
-        "person_id": _parse_int(person_id),
+
+def map_person(row: dict) -> dict:
+    """Map the person columns of a CSV row to a ``persons`` document."""
+    return {
+        "person_id": _parse_int(row["person_id"]),
         "first_name": row["first_name"],
         "last_name": row["last_name"],
         "last_name_yomi": row["last_name_yomi"],
@@ -167,8 +116,47 @@ def _process_row(
         "date_of_death": row["date_of_death"],
         "author_copyright": _parse_bool(row["author_copyright"]),
     }
-    db.upsert_person(person_id, person_data)
-    algolia_persons[person_id] = {
+
+
+def _map_contributor(row: dict) -> tuple[str, dict]:
+    """Map a CSV row to a ``contributors`` document and its ID."""
+    role_id = _parse_role(row["role"])
+    contributor_id = f"{row['book_id']}-{row['person_id']}-{role_id}"
+    return contributor_id, {
+        "id": contributor_id,
+        "book_id": _parse_int(row["book_id"]),
+        "person_id": _parse_int(row["person_id"]),
+        "role": role_id,
+    }
+
+
+def _resolve_author(rows: list[dict]) -> dict:
+    """Return author_name / author_id for a book.
+
+    The first 著者 (role 0) contributor wins; otherwise the first contributor listed.
+    """
+    author_row = next((r for r in rows if _parse_role(r["role"]) == 0), rows[0])
+    return {
+        "author_name": f"{author_row['last_name']} {author_row['first_name']}",
+        "author_id": _parse_int(author_row["person_id"]),
+    }
+
+
+def _algolia_book(book_id: str, book_data: dict) -> dict:
+    return {
+        "objectID": book_id,
+        "book_id": book_data["book_id"],
+        "title": book_data["title"],
+        "title_yomi": book_data["title_yomi"],
+        "font_kana_type": book_data["font_kana_type"],
+        "copyright": book_data["copyright"],
+        "author_name": book_data["author_name"],
+        "author_id": book_data["author_id"],
+    }
+
+
+def _algolia_person(person_id: str, person_data: dict) -> dict:
+    return {
         "objectID": person_id,
         "person_id": person_data["person_id"],
         "last_name": person_data["last_name"],
@@ -177,121 +165,687 @@ def _process_row(
         "first_name_yomi": person_data["first_name_yomi"],
     }
 
-    role_id = _parse_role(row["role"])
-    contributor_id = f"{book_id}-{person_id}-{role_id}"
-    db.upsert_contributor(
-        contributor_id,
-        {
-            "id": contributor_id,
-            "book_id": _parse_int(book_id),
-            "person_id": _parse_int(person_id),
-            "role": role_id,
-        },
-    )
 
-    author_entry = {
-        "author_name": f"{row['last_name']} {row['first_name']}",
-        "author_id": _parse_int(person_id),
+def book_data(rows: list[dict]) -> dict:
+    """Map all CSV rows of a book to its ``books`` document, author fields included."""
+    return _map_book(rows[0]) | _resolve_author(rows)
+
+
+def person_works(catalog: Catalog, person_id: str) -> dict | None:
+    """Build the ``person_works`` document of a person, or None if they are not in the catalog.
+
+    It lists every book the person contributed to, with their role, in the order of the
+    title sort key, as the author pages show them, and counts them per role.
+    """
+    rows = catalog.rows_for_person(person_id)
+    if not rows:
+        return None
+    books = []
+    role_counts: dict[str, int] = {}
+    for i in rows:
+        row = catalog.row(i)
+        role = _parse_role(row["role"])
+        books.append(
+            {
+                "book_id": _parse_int(row["book_id"]),
+                "title": row["title"],
+                "title_yomi": row["title_yomi"],
+                "title_sort": row["title_sort"],
+                "subtitle": row["subtitle"],
+                "font_kana_type": row["font_kana_type"],
+                "copyright": _parse_bool(row["copyright"]),
+                "release_date": _parse_date(row["release_date"]),
+                "role": role,
+            }
+        )
+        # Firestore map keys are strings
+        role_counts[str(role)] = role_counts.get(str(role), 0) + 1
+    books.sort(key=lambda b: (b["title_sort"], b["book_id"], b["role"]))
+    return {
+        "person_id": _parse_int(person_id),
+        "book_count": len({b["book_id"] for b in books}),
+        "role_counts": role_counts,
+        "books": books,
     }
-    if role_id == 0:
-        author_map[book_id] = author_entry
-    if book_id not in first_contributor_map:
-        first_contributor_map[book_id] = author_entry
 
 
-def import_from_csv_url(csv_url: str, db: AozoraFirestore, limit: int = 0) -> None:
-    """Import books, persons, and contributors from a CSV file URL."""
-    resp = requests.get(csv_url)
-    resp.raise_for_status()
-    with BytesIO(resp.content) as b_stream:
-        # Handling zip files in memory
-        from zipfile import ZipFile
+def _count_write(collection: str, data: dict, fields: list[str] | None) -> None:
+    metrics.count(f"writes.{collection}")
+    if fields is not None:
+        metrics.count(f"partial_writes.{collection}")
+    metrics.count(f"fields_written.{collection}", len(data) if fields is None else len(fields))
 
-        with ZipFile(b_stream) as zipfile:
-            # Assuming there is only one file in the zip or we take the first one
-            filename = zipfile.namelist()[0]
-            with zipfile.open(filename) as z_f:
-                # TextIOWrapper to decode
-                import io
 
-                stream = io.TextIOWrapper(z_f, encoding="utf-8-sig")
-                import_from_csv(stream, db, limit)
+def _process_book(
+    book_id: str,
+    rows: list[dict],
+    db: WriteBuffer,
+    fingerprints: FingerprintStore,
+    shard: Shard,
+) -> None:
+    """Upsert one book with its author fields, its persons and contributors.
+
+    ``rows`` are all CSV rows of the book, one per contributor. Only documents owned by
+    ``shard`` whose fingerprint differs from the stored one are written. Of known books
+    and persons, only the changed fields are sent.
+    """
+    owns_book = shard.owns(book_id)
+    with metrics.phase("map"):
+        book = book_data(rows) if owns_book else None
+        persons = [
+            (row["person_id"], map_person(row)) for row in rows if shard.owns(row["person_id"])
+        ]
+        contributors = [_map_contributor(row) for row in rows] if owns_book else []
+
+    if book is not None:
+        fields = fingerprints.changed_fields("books", book_id, book)
+        if fields is None or fields:
+            db.upsert_book(book_id, book, fields)
+            _count_write("books", book, fields)
+        else:
+            metrics.count("unchanged.books")
+
+    for person_id, person in persons:
+        fields = fingerprints.changed_fields("persons", person_id, person)
+        if fields is None or fields:
+            db.upsert_person(person_id, person, fields)
+            _count_write("persons", person, fields)
+        else:
+            metrics.count("unchanged.persons")
+
+    for contributor_id, contributor_data in contributors:
+        if fingerprints.changed("contributors", contributor_id, contributor_data):
+            db.upsert_contributor(contributor_id, contributor_data)
+            metrics.count("writes.contributors")
+        else:
+            metrics.count("unchanged.contributors")
+
+
+def import_from_csv_url(
+    csv_url: str,
+    db: Storage,
+    limit: int = 0,
+    force: bool = False,
+    full: bool = False,
+    snapshot: SnapshotLocation | None = None,
+    report: str | Path | None = None,
+    shard: Shard = UNSHARDED,
+    indexer: "Indexer | None" = None,
+) -> bool:
+    """Import books, persons, and contributors from a CSV file URL.
+
+    The catalog's ETag, Last-Modified and SHA-256 are kept in the import state once the
+    whole run is finished. The catalog is requested conditionally and the import skipped
+    when it is unchanged, unless ``force`` is set. Returns True if an import ran. See
+    ``import_catalog`` for the other arguments.
+    """
+    state = {} if force else db.get_import_state()
+    headers = conditional_headers(state)
+
+    # The zip is spooled (spilling to disk when large) and the CSV decompressed as it is parsed
+    with metrics.phase("download"):
+        download = fetch(csv_url, headers=headers)
+    metrics.count("download_bytes", download.size)
+    with download:
+        if download.status_code == 304:
+            logger.info("Catalog not modified since the last import (HTTP 304), skipping.")
+            return False
+        if download.sha256 == state.get("catalog_sha256"):
+            logger.info("Catalog content unchanged since the last import, skipping.")
+            return False
+
+        catalog = parse_catalog_zip(download.file)
+        finished = import_catalog(catalog, db, limit, full, snapshot, report, shard, indexer)
+
+    # A limited import has not seen the whole catalog, so it must not mark it as done
+    if finished and not limit:
+        db.save_import_state(catalog_validators(download))
+    return True
+
+
+def conditional_headers(state: dict[str, Any]) -> dict[str, str]:
+    """Return the headers requesting the catalog only if it changed since ``state``."""
+    headers = {}
+    if state.get("catalog_etag"):
+        headers["If-None-Match"] = state["catalog_etag"]
+    if state.get("catalog_last_modified"):
+        headers["If-Modified-Since"] = state["catalog_last_modified"]
+    return headers
+
+
+def catalog_validators(download: SpooledDownload) -> dict[str, Any]:
+    """Return the import state fields identifying a downloaded catalog."""
+    return {
+        "catalog_etag": download.headers.get("ETag"),
+        "catalog_last_modified": download.headers.get("Last-Modified"),
+        "catalog_sha256": download.sha256,
+    }
 
 
-def import_from_csv(csv_stream: TextIO, db: AozoraFirestore, limit: int = 0):
-    """Import books, persons, and contributors from a CSV file."""
-    csv_obj = DictReader(csv_stream, fieldnames=FIELD_NAMES)
+def parse_catalog_zip(file: IO[bytes]) -> Catalog:
+    """Parse the CSV in a catalog zip, decompressing it as it is read.
+
+    The decompression is timed as the ``unzip`` phase, the rest as ``parse``.
+    """
+    with metrics.phase("parse"), ZipFile(file) as zipfile:
+        # Assuming there is only one file in the zip or we take the first one
+        filename = zipfile.namelist()[0]
+        with zipfile.open(filename) as z_f:
+            return Catalog.parse(io.TextIOWrapper(timed_unzip(z_f), encoding="utf-8-sig"))
 
-    next(csv_obj)  # skip the first row (header in Japanese usually, but we forced fieldnames)
 
-    # We need to skip the ACTUAL header row of the CSV if fieldnames are provided to DictReader
-    # The Aozora CSV usually has a header row.
-    # 'next(csv_obj)' consumes the first data row if FIELD_NAMES matches the header?
-    # No, DictReader consumes the first row as keys if fieldnames is None.
-    # If fieldnames IS provided, the first row is read as data.
-    # So we must manually skip the header row.
+def import_from_csv(
+    csv_stream: TextIO,
+    db: Storage,
+    limit: int = 0,
+    full: bool = False,
+    snapshot: SnapshotLocation | None = None,
+    report: str | Path | None = None,
+    shard: Shard = UNSHARDED,
+) -> bool:
+    """Import books, persons, and contributors from a CSV file."""
+    with metrics.phase("parse"):
+        catalog = Catalog.parse(csv_stream)
+    return import_catalog(catalog, db, limit, full, snapshot, report, shard)
+
+
+def _snapshot(catalog: Catalog) -> Snapshot:
+    """Fingerprint every document the catalog maps to."""
+    books = []
+    for book_id in catalog.book_ids():
+        rows = [catalog.row(i) for i in catalog.rows_for_book(book_id)]
+        books.append((book_id, fingerprint(book_data(rows))))
+    persons = (
+        (person_id, fingerprint(map_person(catalog.row(rows[0]))))
+        for person_id, rows in catalog.person_rows.items()
+    )
+    contributors = (
+        (catalog.value(i, "book_id"), catalog.value(i, "person_id"), role)
+        for i, (_, _, role) in enumerate(catalog.contributors())
+    )
+    return Snapshot.build(books, persons, contributors)
 
-    # Watermark logic
-    watermark = db.get_watermark()
-    max_last_modified = watermark
 
-    # Maps book_id -> {author_name, author_id} for role-0 contributors
-    author_map: dict[str, dict] = {}
-    # Maps book_id -> {author_name, author_id} for first contributor seen (fallback)
-    first_contributor_map: dict[str, dict] = {}
+def _books_in_diff(catalog: Catalog, diff: CatalogDiff) -> set[str]:
+    """Return the books that have to be processed to apply ``diff``."""
+    book_ids = set(diff.books.added) | set(diff.books.changed)
+    for person_id in diff.persons.added + diff.persons.changed:
+        book_ids.update(catalog.value(i, "book_id") for i in catalog.rows_for_person(person_id))
+    book_ids.update(cid.split("-", 1)[0] for cid in diff.contributors.added)
+    return book_ids
 
-    # Algolia records accumulated during this run
-    algolia_books: dict[str, dict] = {}
-    algolia_persons: dict[str, dict] = {}
 
+def _select_rows(
+    catalog: Catalog, watermark: str | None, limit: int
+) -> tuple[dict[str, list[dict]], str | None]:
+    """Return the rows newer than ``watermark`` grouped by book, up to ``limit`` rows.
+
+    Also returns the latest last_modified among the rows looked at.
+    """
+    # The catalog is grouped by person, so a book's contributor rows are scattered.
+    # Collect them per book so that each book is written once, author fields included.
+    rows_by_book: dict[str, list[dict]] = {}
+    max_last_modified = None
     count = 0
-    for row in csv_obj:
+    for i in range(len(catalog)):
         if limit > 0 and count >= limit:
             break
-
+        row_last_modified = _parse_date(catalog.value(i, "last_modified"))
+        if row_last_modified and (not max_last_modified or row_last_modified > max_last_modified):
+            max_last_modified = row_last_modified
+        if watermark and row_last_modified and row_last_modified <= watermark:
+            continue
+        rows_by_book.setdefault(catalog.value(i, "book_id"), []).append(catalog.row(i))
+        count += 1
+    return rows_by_book, max_last_modified
+
+
+def _diff_snapshot(
+    catalog: Catalog, snapshot: SnapshotLocation | None, limit: int
+) -> tuple[Snapshot | None, CatalogDiff | None]:
+    """Return the catalog's snapshot and its diff against the stored one, if any."""
+    # A limited import sees only part of the catalog, so it neither uses nor updates the snapshot
+    if not snapshot or limit:
+        return None, None
+    new_snapshot = _snapshot(catalog)
+    old_snapshot = load_snapshot(snapshot)
+    if old_snapshot is None:
+        return new_snapshot, None
+    diff = diff_snapshots(old_snapshot, new_snapshot)
+    logger.info(f"Catalog changes since the snapshot: {diff.summary()}")
+    return new_snapshot, diff
+
+
+def _owned_rows(rows_by_book: dict[str, list[dict]], shard: Shard) -> dict[str, list[dict]]:
+    """Keep all rows of the shard's books, and the rows of other books with its persons."""
+    if shard.shard_count == 1:
+        return rows_by_book
+    owned = {}
+    for book_id, rows in rows_by_book.items():
+        if shard.owns(book_id):
+            owned[book_id] = rows
+        elif person_rows := [r for r in rows if shard.owns(r["person_id"])]:
+            owned[book_id] = person_rows
+    return owned
+
+
+def _owner(collection: str, doc_id: str) -> str:
+    """Return the ID whose shard writes a document: its book's for a contributor."""
+    return doc_id.split("-", 1)[0] if collection == "contributors" else doc_id
+
+
+def delete_removed(
+    diff: CatalogDiff, db: WriteBuffer, fingerprints: FingerprintStore, shard: Shard = UNSHARDED
+) -> None:
+    """Delete the documents of ``shard`` removed from the catalog, and forget their fingerprints.
+
+    A contributor belongs to the shard of its book, like the book's other documents.
+    """
+    for collection, removed in zip(COLLECTIONS, diff, strict=True):
+        doc_ids = [doc_id for doc_id in removed.removed if shard.owns(_owner(collection, doc_id))]
+        for doc_id in doc_ids:
+            db.delete(collection, doc_id)
+            fingerprints.remove(collection, doc_id)
+        metrics.count(f"deletes.{collection}", len(doc_ids))
+    person_ids = [person_id for person_id in diff.persons.removed if shard.owns(person_id)]
+    for person_id in person_ids:
+        db.delete(PERSON_WORKS, person_id)
+        fingerprints.remove(PERSON_WORKS, person_id)
+    metrics.count(f"deletes.{PERSON_WORKS}", len(person_ids))
+
+
+def affected_persons(run: "Run", shard: Shard) -> list[str]:
+    """Return the persons of ``shard`` whose ``person_works`` may change in ``run``.
+
+    They are the persons of every book processed, and those who lost a contribution.
+    """
+    person_ids = {row["person_id"] for rows in run.rows_by_book.values() for row in rows}
+    if run.diff is not None:
+        person_ids.update(cid.split("-")[1] for cid in run.diff.contributors.removed)
+        person_ids.difference_update(run.diff.persons.removed)
+    return sorted(p for p in person_ids if shard.owns(p))
+
+
+def write_person_works(
+    catalog: Catalog, person_ids: list[str], db: WriteBuffer, fingerprints: FingerprintStore
+) -> None:
+    """Write the ``person_works`` documents of ``person_ids`` whose content changed."""
+    for person_id in person_ids:
+        with metrics.phase("map"):
+            works = person_works(catalog, person_id)
+        if works is None:
+            continue
+        if fingerprints.changed(PERSON_WORKS, person_id, works):
+            db.upsert_person_works(person_id, works)
+            metrics.count(f"writes.{PERSON_WORKS}")
+        else:
+            metrics.count(f"unchanged.{PERSON_WORKS}")
+
+
+def checkpoint_key(shard: Shard) -> str:
+    """Return the import state field holding the checkpoint of ``shard``."""
+    return f"checkpoint_{shard.shard_index}"
+
+
+def _save_progress(
+    db: Storage,
+    fingerprints: FingerprintStore,
+    shard: Shard,
+    progress: dict[str, Any],
+) -> None:
+    """Commit the documents written so far, then checkpoint them.
+
+    Batches may be committed concurrently and in any order, so the documents must all be
+    committed before anything claims they are done. The checkpoint, the number of books
+    done, is saved before their fingerprints: a crash in between only means those
+    documents are written once more on the next run.
+    """
+    with metrics.phase("commit"):
+        db.commit()
+        db.save_import_state({checkpoint_key(shard): progress})
+        fingerprints.save()
+        db.commit()
+
+
+def book_steps(
+    rows_by_book: dict[str, list[dict]],
+    db: WriteBuffer,
+    fingerprints: FingerprintStore,
+    shard: Shard,
+    progress: dict[str, Any],
+) -> Iterator[bool]:
+    """Process books in order, yielding after each one; True when a checkpoint is due.
+
+    ``progress`` is the shard's checkpoint. If it belongs to the same run, the books it
+    has already committed are skipped. It is brought up to date before a checkpoint is
+    due and once all books are processed.
+    """
+    done = progress["books_done"]
+    if done:
+        logger.info(f"Resuming run {progress['run_id']} after {done} of {len(rows_by_book)} books")
+
+    for n, (book_id, rows) in enumerate(rows_by_book.items(), 1):
+        if n <= done:
+            continue
+        metrics.count("rows.processed", len(rows))
         try:
-            row_last_modified = _parse_date(row["last_modified"])
-            if row_last_modified and (not max_last_modified or row_last_modified > max_last_modified):
-                max_last_modified = row_last_modified
-            if watermark and row_last_modified and row_last_modified <= watermark:
-                continue
-
-            _process_row(row, db, author_map, first_contributor_map, algolia_books, algolia_persons)
-            count += 1
-
+            _process_book(book_id, rows, db, fingerprints, shard)
         except Exception as e:
-            logger.error(f"Error processing row {row}: {e}")
-            # continue or raise? raise for now to debug
+            logger.error(f"Error processing book {book_id} ({len(rows)} rows): {e}")
             raise
+        checkpoint = n % CHECKPOINT_EVERY == 0
+        if checkpoint:
+            progress["books_done"] = n
+        yield checkpoint
 
-    # Commit main batch (books, persons, contributors)
-    db.commit()
+    progress["books_done"] = len(rows_by_book)
+
+
+def _process_books(
+    rows_by_book: dict[str, list[dict]],
+    db: Storage,
+    fingerprints: FingerprintStore,
+    shard: Shard,
+    progress: dict[str, Any],
+) -> None:
+    """Process books in order, checkpointing every ``CHECKPOINT_EVERY`` books."""
+    for checkpoint in book_steps(rows_by_book, db, fingerprints, shard, progress):
+        if checkpoint:
+            _save_progress(db, fingerprints, shard, progress)
+
+
+def algolia_candidates(catalog: Catalog, book_ids: Iterable[str]) -> tuple[list[str], list[str]]:
+    """Return ``book_ids`` and their persons, whose Algolia records importing them may change."""
+    book_ids = sorted(book_ids)
+    person_ids = {
+        catalog.row(i)["person_id"] for book_id in book_ids for i in catalog.rows_for_book(book_id)
+    }
+    return book_ids, sorted(person_ids)
+
+
+def algolia_records(
+    catalog: Catalog, book_ids: Iterable[str], person_ids: Iterable[str]
+) -> tuple[dict[str, dict], dict[str, dict]]:
+    """Build the Algolia records of the given books and persons that are in the catalog."""
+    algolia_books = {}
+    for book_id in sorted(book_ids):
+        rows = [catalog.row(i) for i in catalog.rows_for_book(book_id)]
+        if rows:
+            algolia_books[book_id] = _algolia_book(book_id, book_data(rows))
+    algolia_persons = {}
+    for person_id in sorted(person_ids):
+        row_indexes = catalog.rows_for_person(person_id)
+        if row_indexes:
+            person = map_person(catalog.row(row_indexes[0]))
+            algolia_persons[person_id] = _algolia_person(person_id, person)
+    metrics.count("algolia.books", len(algolia_books))
+    metrics.count("algolia.persons", len(algolia_persons))
+    return algolia_books, algolia_persons
+
+
+def algolia_changes(
+    index_name: str, records: dict[str, dict], fingerprints: FingerprintStore | None
+) -> tuple[list[dict], list[dict]]:
+    """Split records into those to send whole and partial updates, dropping unchanged ones.
+
+    A record is compared with the fingerprint of what was last sent to the index; only
+    its changed attributes are sent if its set of attributes is the same. Without
+    ``fingerprints``, every record is sent whole.
+    """
+    if fingerprints is None:
+        return list(records.values()), []
+    collection = ALGOLIA_FINGERPRINTS[index_name]
+    saves, updates = [], []
+    for object_id, record in records.items():
+        fields = fingerprints.changed_fields(collection, object_id, record)
+        if fields is None:
+            saves.append(record)
+        elif fields:
+            updates.append({"objectID": object_id} | {f: record[f] for f in fields})
+    metrics.count(f"algolia.unchanged.{index_name}", len(records) - len(saves) - len(updates))
+    return saves, updates
+
+
+def left_catalog(catalog: Catalog, fingerprints: FingerprintStore) -> tuple[list[str], list[str]]:
+    """Return the books and persons sent to Algolia earlier that are no longer in the catalog."""
+    return (
+        sorted(fingerprints.ids(ALGOLIA_FINGERPRINTS["books"]) - catalog.book_rows.keys()),
+        sorted(fingerprints.ids(ALGOLIA_FINGERPRINTS["persons"]) - catalog.person_rows.keys()),
+    )
 
-    # Second pass: write author_name / author_id onto book documents
-    for book_id in first_contributor_map:
-        data = author_map.get(book_id) or first_contributor_map[book_id]
-        db.update_book_author(book_id, data)
-        if book_id in algolia_books:
-            algolia_books[book_id].update(data)
 
+def finish_run(
+    catalog: Catalog,
+    db: Storage,
+    run_id: str,
+    count: int,
+    book_ids: Iterable[str] = (),
+    removed_books: list[str] | None = None,
+    removed_persons: list[str] | None = None,
+    indexer: "Indexer | None" = None,
+) -> bool:
+    """Complete a run once all of its ``count`` shards are done.
+
+    Indexes ``book_ids``, the books of the run across all shards, and their persons to
+    Algolia (with ``indexer``, or an ``AlgoliaIndexer`` configured from the environment),
+    skipping records unchanged since they were last sent, and removes the records of
+    books and persons no longer in the catalog; then saves the watermark and clears the
+    checkpoints. Returns False, changing nothing, while shards are pending.
+
+    Shards that end at the same time may all see the run done; the one that claims it
+    first in an import state transaction completes it, the others return False. A
+    claim older than ``FINISH_LEASE_SECONDS`` is taken over, so a run whose finishing
+    task died is completed when the job is retried.
+    """
+    state: dict[str, Any] = {}
+    shards: list[dict[str, Any]] = []
+    pending: list[int] = []
+
+    def claim(current: dict[str, Any]) -> dict[str, Any] | None:
+        nonlocal state, shards, pending
+        state = current
+        shards = [current.get(checkpoint_key(Shard(i, count))) or {} for i in range(count)]
+        pending = [i for i, p in enumerate(shards) if p.get("run_id") != run_id or not p.get("done")]
+        finishing = current.get(FINISHING) or {}
+        now = time.time()
+        if pending or (
+            finishing.get("run_id") == run_id
+            and now - finishing.get("since", 0) < FINISH_LEASE_SECONDS
+        ):
+            return None
+        return {FINISHING: {"run_id": run_id, "since": now}}
+
+    if not db.update_import_state(claim):
+        if pending:
+            logger.info(f"Run {run_id}: waiting for shard(s) {pending} of {count}")
+        else:
+            logger.info(f"Run {run_id}: being completed by another shard")
+        return False
+
+    algolia_books, algolia_persons = algolia_records(catalog, *algolia_candidates(catalog, book_ids))
+    fingerprints = FingerprintStore(db)
+    gone_books, gone_persons = left_catalog(catalog, fingerprints)
+    removed_books = sorted({*(removed_books or []), *gone_books})
+    removed_persons = sorted({*(removed_persons or []), *gone_persons})
+    with metrics.phase("algolia"):
+        _sync_algolia(
+            algolia_books, algolia_persons, removed_books, removed_persons, indexer, fingerprints
+        )
     db.commit()
 
-    # Save new watermark
-    if max_last_modified:
+    watermark = state.get("last_modified")
+    max_last_modified = max(filter(None, (p["max_last_modified"] for p in shards)), default=None)
+    if max_last_modified and (not watermark or max_last_modified > watermark):
         db.save_watermark(max_last_modified)
 
-    _sync_algolia(algolia_books, algolia_persons)
-
+    db.save_import_state(
+        {FINISHING: None, **{checkpoint_key(Shard(i, count)): None for i in range(count)}}
+    )
+    return True
+
+
+class Run(NamedTuple):
+    """What a run imports, as decided by ``plan_run``."""
+
+    run_id: str
+    # Every book of the run; ``rows_by_book`` keeps only the rows of the shard's documents
+    book_ids: list[str]
+    rows_by_book: dict[str, list[dict]]
+    max_last_modified: str | None
+    progress: dict[str, Any]
+    snapshot: Snapshot | None
+    diff: CatalogDiff | None
+
+
+def plan_run(
+    catalog: Catalog,
+    state: dict[str, Any],
+    limit: int,
+    full: bool,
+    snapshot: SnapshotLocation | None,
+    shard: Shard,
+) -> Run:
+    """Select the rows to import given the import ``state``, and resume its checkpoint.
+
+    See ``import_catalog`` for the arguments.
+    """
+    watermark = state.get("last_modified")
+    with metrics.phase("diff"):
+        new_snapshot, diff = _diff_snapshot(catalog, snapshot, limit)
+    if diff is not None:
+        selected = _books_in_diff(catalog, diff)
+        rows_by_book = {
+            book_id: [catalog.row(i) for i in catalog.rows_for_book(book_id)]
+            for book_id in catalog.book_ids()
+            if book_id in selected
+        }
+        _, max_last_modified = _select_rows(catalog, None, 0)
+    else:
+        rows_by_book, max_last_modified = _select_rows(catalog, None if full else watermark, limit)
+    book_ids = list(rows_by_book)
+    rows_by_book = _owned_rows(rows_by_book, shard)
+    selected_rows = sum(len(rows) for rows in rows_by_book.values())
+    metrics.count("rows.total", len(catalog))
+    metrics.count("rows.skipped", len(catalog) - selected_rows)
+
+    # Every shard of a run derives the same ID from what it was asked to import
+    run_id = fingerprint(
+        {
+            "catalog": catalog.digest(),
+            "watermark": watermark,
+            "full": full,
+            "limit": limit,
+            "diff": diff is not None,
+            "shards": shard.shard_count,
+        }
+    )
+    progress = state.get(checkpoint_key(shard)) or {}
+    if progress.get("run_id") != run_id:
+        progress = {"run_id": run_id, "books_done": 0}
+    return Run(run_id, book_ids, rows_by_book, max_last_modified, progress, new_snapshot, diff)
+
+
+def write_outputs(run: Run, snapshot: SnapshotLocation | None, report: str | Path | None) -> None:
+    """Replace the snapshot and write the diff report of a completed run."""
+    if run.snapshot is not None and snapshot:
+        save_snapshot(snapshot, run.snapshot)
+    if run.diff is not None and report:
+        with open(report, "w", encoding="utf-8") as f:
+            json.dump(run.diff.report(), f, ensure_ascii=False, indent=2)
+
+
+def import_catalog(
+    catalog: Catalog,
+    db: Storage,
+    limit: int = 0,
+    full: bool = False,
+    snapshot: SnapshotLocation | None = None,
+    report: str | Path | None = None,
+    shard: Shard = UNSHARDED,
+    indexer: "Indexer | None" = None,
+) -> bool:
+    """Import books, persons, and contributors from a parsed catalog.
+
+    With a ``snapshot`` of the previous run (a file, or the storage that keeps it), the
+    catalog is diffed against it and exactly the added and changed books are processed,
+    and removed documents deleted; the snapshot is then replaced and the diff written to
+    ``report`` if given. Without one,
+    only rows newer than the watermark are processed unless ``full`` is set. Either way,
+    only documents whose content fingerprint changed are written. The ``person_works``
+    aggregate of every person of the processed books is rebuilt from the whole catalog.
+
+    A sharded import writes and deletes only the documents of ``shard``; the last shard
+    to finish completes the run (see ``finish_run``, which uses ``indexer``), and only
+    then replaces the snapshot, so every shard diffs against the same one. Returns True
+    if the run was completed.
+    """
+    run = plan_run(catalog, db.get_import_state(), limit, full, snapshot, shard)
+    fingerprints = FingerprintStore(db)
+    progress = run.progress
+    # Mapping and the batches committed along the way are timed as phases of their own
+    with metrics.phase("process"):
+        _process_books(run.rows_by_book, db, fingerprints, shard, progress)
+        write_person_works(catalog, affected_persons(run, shard), db, fingerprints)
+
+    if run.diff is not None:
+        delete_removed(run.diff, db, fingerprints, shard)
+    progress.update(max_last_modified=run.max_last_modified, done=True)
+    _save_progress(db, fingerprints, shard, progress)
+
+    removed_books = run.diff.books.removed if run.diff is not None else None
+    removed_persons = run.diff.persons.removed if run.diff is not None else None
+    if not finish_run(
+        catalog,
+        db,
+        run.run_id,
+        shard.shard_count,
+        run.book_ids,
+        removed_books,
+        removed_persons,
+        indexer,
+    ):
+        return False
+    write_outputs(run, snapshot, report)
+    return True
+
+
+def _sync_algolia(
+    algolia_books: dict,
+    algolia_persons: dict,
+    removed_books: list[str] | None = None,
+    removed_persons: list[str] | None = None,
+    indexer: "Indexer | None" = None,
+    fingerprints: FingerprintStore | None = None,
+) -> None:
+    """Index changed records to Algolia and drop removed ones. Skipped if env vars are not set.
 
-def _sync_algolia(algolia_books: dict, algolia_persons: dict) -> None:
-    """Index changed records to Algolia. Skipped if env vars are not set."""
-    if not algolia_books and not algolia_persons:
+    With ``fingerprints``, records unchanged since they were last sent are skipped, and
+    records with only some attributes changed are partially updated. Their fingerprints
+    are saved once Algolia has applied every operation.
+    """
+    if not (algolia_books or algolia_persons or removed_books or removed_persons):
         return
-    try:
+    if indexer is None:
         from ..algolia.indexer import AlgoliaIndexer
 
-        indexer = AlgoliaIndexer()
-        indexer.index_books(list(algolia_books.values()))
-        indexer.index_persons(list(algolia_persons.values()))
-    except KeyError:
-        logger.info("ALGOLIA_APP_ID/ALGOLIA_ADMIN_KEY not set — skipping Algolia indexing.")
+        try:
+            indexer = AlgoliaIndexer()
+        except KeyError:
+            logger.info("ALGOLIA_APP_ID/ALGOLIA_ADMIN_KEY not set — skipping Algolia indexing.")
+            return
+    book_saves, book_updates = algolia_changes("books", algolia_books, fingerprints)
+    person_saves, person_updates = algolia_changes("persons", algolia_persons, fingerprints)
+    if fingerprints is not None:
+        for index_name, removed in (("books", removed_books), ("persons", removed_persons)):
+            for object_id in removed or []:
+                fingerprints.remove(ALGOLIA_FINGERPRINTS[index_name], object_id)
+
+    indexer.index_books(book_saves)
+    indexer.update_books(book_updates)
+    indexer.index_persons(person_saves)
+    indexer.update_persons(person_updates)
+    indexer.delete_books(removed_books or [])
+    indexer.delete_persons(removed_persons or [])
+    indexer.wait()
+    if fingerprints is not None:
+        fingerprints.save()
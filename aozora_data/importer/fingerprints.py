@@ -0,0 +1,109 @@
+import hashlib
+import json
+from typing import Any
+
+from ..db.base import WriteBuffer
+
+# Hex digits per field in a field fingerprint
+FIELD_HASH_LEN = 8
+
+
+def _digest(value: Any, size: int) -> str:  # noqa: ANN401
+    payload = json.dumps(
+        value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=size).hexdigest()
+
+
+def fingerprint(data: dict[str, Any]) -> str:
+    """Return a canonical hash of a mapped document (key order does not matter)."""
+    return _digest(data, 8)
+
+
+def field_fingerprint(data: dict[str, Any]) -> str:
+    """Return a fingerprint that also tells which fields changed.
+
+    It is a hash of the field names, then a short hash of every field's value in name order:
+    ``<names>:<field 1><field 2>...``.
+    """
+    names = sorted(data)
+    return _digest(names, 4) + ":" + "".join(_digest(data[n], FIELD_HASH_LEN // 2) for n in names)
+
+
+def _changed_fields(old: str, new: str, names: list[str]) -> list[str] | None:
+    old_names, _, old_hashes = old.partition(":")
+    new_names, _, new_hashes = new.partition(":")
+    if old_names != new_names or len(old_hashes) != len(new_hashes):
+        return None
+    n = FIELD_HASH_LEN
+    return [
+        name
+        for i, name in enumerate(names)
+        if old_hashes[i * n : (i + 1) * n] != new_hashes[i * n : (i + 1) * n]
+    ]
+
+
+class FingerprintStore:
+    """Fingerprints of the documents as last written, used to skip unchanged writes.
+
+    Stored fingerprints are loaded lazily per collection. Changes are buffered and only
+    written by ``save``, which must be called after the documents themselves have been
+    committed, so that a failed commit never leaves a fingerprint claiming otherwise.
+    """
+
+    def __init__(self, backend: WriteBuffer) -> None:
+        """Initialize an empty store on top of ``backend``."""
+        self.backend = backend
+        self._stored: dict[str, dict[str, str]] = {}
+        self._changes: dict[str, dict[str, str | None]] = {}
+
+    def _collection(self, collection: str) -> dict[str, str]:
+        if collection not in self._stored:
+            self._stored[collection] = self.backend.load_fingerprints(collection)
+        return self._stored[collection]
+
+    def changed(self, collection: str, doc_id: str, data: dict[str, Any]) -> bool:
+        """Return True (and remember the new fingerprint) if ``data`` differs from storage."""
+        fp = fingerprint(data)
+        stored = self._collection(collection)
+        if stored.get(doc_id) == fp:
+            return False
+        stored[doc_id] = fp
+        self._changes.setdefault(collection, {})[doc_id] = fp
+        return True
+
+    def changed_fields(self, collection: str, doc_id: str, data: dict[str, Any]) -> list[str] | None:
+        """Return the fields of ``data`` that differ from storage, remembering the new state.
+
+        An empty list means the document is unchanged. None means it must be written
+        whole: it is new, its set of fields changed, or its fingerprint predates field
+        fingerprints.
+        """
+        fp = field_fingerprint(data)
+        stored = self._collection(collection)
+        old = stored.get(doc_id)
+        if old == fp:
+            return []
+        stored[doc_id] = fp
+        self._changes.setdefault(collection, {})[doc_id] = fp
+        return _changed_fields(old, fp, sorted(data)) if old else None
+
+    def remove(self, collection: str, doc_id: str) -> None:
+        """Forget the fingerprint of a deleted document."""
+        self._collection(collection).pop(doc_id, None)
+        self._changes.setdefault(collection, {})[doc_id] = None
+
+    def ids(self, collection: str) -> set[str]:
+        """Return the IDs of every fingerprinted document of a collection."""
+        return set(self._collection(collection))
+
+    def changed_ids(self, collection: str) -> set[str]:
+        """Return the IDs whose fingerprint changed since the last ``save``."""
+        return set(self._changes.get(collection, {}))
+
+    def save(self) -> None:
+        """Write buffered fingerprint changes to the backend."""
+        for collection, changes in self._changes.items():
+            if changes:
+                self.backend.save_fingerprints(collection, changes)
+        self._changes = {}
@@ -1,27 +1,256 @@
+import argparse
+import asyncio
 import contextlib
+import json
+import logging
 import os
+import shutil
 
 import google.auth
 
-from ..db.firestore import AozoraFirestore
-from .csv_importer import import_from_csv_url
+from ..algolia.indexer import AlgoliaIndexer
+from ..catalog import Catalog
+from ..db.async_firestore import AsyncAozoraFirestore
+from ..db.base import Storage
+from ..db.firestore import WRITER_BATCH, AozoraFirestore
+from ..metrics import metrics
+from .async_importer import import_catalog_async, import_from_csv_url_async
+from .csv_importer import import_catalog, import_from_csv_url
+from .plan import WritePlan, apply_plan, load_plan
+from .sharding import Shard, shard_from_env
+from .snapshot import SNAPSHOT_IN_STORAGE, SnapshotBuffer, SnapshotLocation
+
+logger = logging.getLogger(__name__)
 
 CSV_URL = os.environ.get(
     "AOZORA_CSV_URL",
     "https://www.aozora.gr.jp/index_pages/list_person_all_extended_utf8.zip",
 )
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
+# Re-import even if the catalog is unchanged since the last run
+FORCE_IMPORT = os.environ.get("AOZORA_FORCE_IMPORT", "").lower() in ("1", "true", "yes")
+# Process every catalog row instead of only those newer than the watermark
+FULL_IMPORT = os.environ.get("AOZORA_FULL_IMPORT", "").lower() in ("1", "true", "yes")
+# How Firestore writes are sent: batch, parallel or bulk
+FIRESTORE_WRITER = os.environ.get("AOZORA_FIRESTORE_WRITER", WRITER_BATCH)
+# Where the import is stored, and the file (sqlite) or directory (jsonl) for local backends
+BACKEND = os.environ.get("AOZORA_BACKEND", "firestore")
+BACKEND_PATH = os.environ.get("AOZORA_BACKEND_PATH")
+# Snapshot of the previously imported catalog; enables diffing and deletion of removed documents.
+# A file, or "storage" to keep it in the storage backend (for hosts without a lasting disk).
+SNAPSHOT_PATH = os.environ.get("AOZORA_SNAPSHOT")
+# Run the asyncio importer (Firestore backend, unsharded)
+ASYNC_IMPORT = os.environ.get("AOZORA_ASYNC", "").lower() in ("1", "true", "yes")
+# DEBUG logs every document written
+LOG_LEVEL = os.environ.get("AOZORA_LOG_LEVEL", "INFO")
+
+BACKENDS = ("firestore", "memory", "sqlite", "jsonl")
+
+
+def _project_id() -> str | None:
+    project_id = PROJECT_ID
+    if not project_id:
+        with contextlib.suppress(google.auth.exceptions.DefaultCredentialsError):
+            _, project_id = google.auth.default()
+    return project_id
+
+
+def open_storage(backend: str, path: str | None = None) -> Storage:
+    """Create the storage backend named ``backend``."""
+    if backend == "firestore":
+        return AozoraFirestore(project_id=_project_id(), writer=FIRESTORE_WRITER)
+    if backend == "memory":
+        from ..db.memory import MemoryStorage
+
+        return MemoryStorage()
+    if path is None:
+        raise ValueError(f"The {backend} backend needs a path")
+    if backend == "sqlite":
+        from ..db.sqlite import SqliteStorage
+
+        return SqliteStorage(path)
+    if backend == "jsonl":
+        from ..db.jsonl import JsonlStorage
+
+        return JsonlStorage(path)
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+async def _import_async(args: argparse.Namespace) -> None:
+    db = AsyncAozoraFirestore(project_id=_project_id())
+    snapshot: SnapshotLocation | None = args.snapshot
+    # The importer reads and writes the snapshot synchronously, so stage it in memory
+    buffer = None
+    if args.snapshot == SNAPSHOT_IN_STORAGE:
+        snapshot = buffer = SnapshotBuffer(await db.load_catalog_snapshot())
+    try:
+        if args.csv:
+            with metrics.phase("parse"):
+                catalog = await asyncio.to_thread(Catalog.load, args.csv)
+            await import_catalog_async(catalog, db, args.limit, FULL_IMPORT, snapshot, args.report)
+        elif CSV_URL:
+            await import_from_csv_url_async(
+                CSV_URL,
+                db,
+                args.limit,
+                force=FORCE_IMPORT,
+                full=FULL_IMPORT,
+                snapshot=snapshot,
+                report=args.report,
+            )
+        if buffer is not None and buffer.changed and buffer.data is not None:
+            await db.save_catalog_snapshot(buffer.data)
+    finally:
+        with metrics.phase("commit"):
+            await db.close()
+
+
+def _import(args: argparse.Namespace, shard: Shard) -> None:
+    db = open_storage(args.backend, args.path)
+    # A plan records the writes (and Algolia operations) instead of performing them
+    plan = WritePlan(db) if args.plan else None
+    target = plan or db
+    snapshot: SnapshotLocation | None = args.snapshot
+    if args.snapshot == SNAPSHOT_IN_STORAGE:
+        # A plan reads the snapshot from the backend and keeps the new one next to the plan
+        snapshot = target
+    elif plan is not None and args.snapshot:
+        snapshot = f"{args.plan}.snapshot"
+        if os.path.exists(args.snapshot):
+            shutil.copyfile(args.snapshot, snapshot)
+        plan.snapshot = {"path": args.snapshot, "planned": snapshot}
+    try:
+        if args.csv:
+            with metrics.phase("parse"):
+                catalog = Catalog.load(args.csv)
+            import_catalog(
+                catalog, target, args.limit, FULL_IMPORT, snapshot, args.report, shard, plan
+            )
+        elif CSV_URL:
+            import_from_csv_url(
+                CSV_URL,
+                target,
+                args.limit,
+                force=FORCE_IMPORT,
+                full=FULL_IMPORT,
+                snapshot=snapshot,
+                report=args.report,
+                shard=shard,
+                indexer=plan,
+            )
+    finally:
+        with metrics.phase("commit"):
+            target.close()
+            if plan is not None:
+                db.close()
+    if plan is not None:
+        plan.save(args.plan)
+        logger.info(f"Write plan: {json.dumps(plan.summary())}")
+
+
+def _apply_plan(args: argparse.Namespace) -> None:
+    plan = load_plan(args.apply_plan)
+    try:
+        indexer = AlgoliaIndexer()
+    except KeyError:
+        indexer = None
+    db = open_storage(args.backend, args.path)
+    try:
+        with metrics.phase("apply"):
+            apply_plan(plan, db, indexer)
+    finally:
+        with metrics.phase("commit"):
+            db.close()
 
-if not PROJECT_ID:
-    with contextlib.suppress(google.auth.exceptions.DefaultCredentialsError):
-        _, PROJECT_ID = google.auth.default()
 
+def main(argv: list[str] | None = None):
+    """Import data from CSV to Firestore (or a local backend)."""
+    parser = argparse.ArgumentParser(description="Import the Aozora Bunko catalog.")
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=BACKEND,
+        help=f"Where to store the import (default: {BACKEND}).",
+    )
+    parser.add_argument(
+        "--path", default=BACKEND_PATH, help="Database file (sqlite) or directory (jsonl)."
+    )
+    parser.add_argument(
+        "--csv",
+        help="Import a local catalog zip or CSV instead of downloading AOZORA_CSV_URL.",
+    )
+    parser.add_argument("--limit", type=int, default=0, help="Import at most this many rows.")
+    parser.add_argument(
+        "--snapshot",
+        default=SNAPSHOT_PATH,
+        help="Catalog snapshot file to diff against and update, or 'storage' to keep it in "
+        "the storage backend (AOZORA_SNAPSHOT).",
+    )
+    parser.add_argument("--report", help="Write the catalog diff to this JSON file.")
+    parser.add_argument(
+        "--metrics", help="Write the run's metrics summary (JSON) to this file as well."
+    )
+    parser.add_argument(
+        "--plan",
+        help="Write the run's writes, Algolia operations and estimated cost to this JSON "
+        "file instead of performing them.",
+    )
+    parser.add_argument("--apply-plan", help="Perform the writes of a plan made with --plan.")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        default=ASYNC_IMPORT,
+        help="Overlap downloading, writing and Algolia indexing with asyncio (AOZORA_ASYNC).",
+    )
+    parser.add_argument(
+        "--log-level",
+        default=LOG_LEVEL,
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        help=f"Log level; DEBUG logs every document written (default: {LOG_LEVEL}).",
+    )
+    task = shard_from_env()
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=task.shard_index,
+        help="Shard handled by this process (default: CLOUD_RUN_TASK_INDEX or 0).",
+    )
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=task.shard_count,
+        help="Number of shards of the import (default: CLOUD_RUN_TASK_COUNT or 1).",
+    )
+    args = parser.parse_args(argv)
+    if args.backend in ("sqlite", "jsonl") and not args.path:
+        parser.error(f"--path is required for the {args.backend} backend")
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be between 0 and --shard-count - 1")
+    if args.use_async and (args.backend != "firestore" or args.shard_count > 1):
+        parser.error("--async needs the firestore backend and a single shard")
+    if args.plan and (args.apply_plan or args.use_async):
+        parser.error("--plan cannot be combined with --apply-plan or --async")
+    shard = Shard(args.shard_index, args.shard_count)
 
-def main():
-    """Import data from CSV to Firestore."""
-    db = AozoraFirestore(project_id=PROJECT_ID)
-    if CSV_URL:
-        import_from_csv_url(CSV_URL, db)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    metrics.reset()
+    if args.apply_plan:
+        _apply_plan(args)
+    elif args.use_async:
+        asyncio.run(_import_async(args))
+    else:
+        _import(args, shard)
+    summary = {
+        "backend": args.backend,
+        "async": args.use_async,
+        "shard": list(shard),
+        **metrics.summary(),
+    }
+    logger.info(f"Import metrics: {json.dumps(summary)}")
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
 
 
 if __name__ == "__main__":
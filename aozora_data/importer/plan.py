@@ -0,0 +1,382 @@
+import copy
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from ..db.base import StateUpdate, Storage
+from ..db.firestore import BATCH_LIMIT, FINGERPRINT_SHARDS, fingerprint_shard
+from .csv_importer import ALGOLIA_FINGERPRINTS
+from .fingerprints import fingerprint
+from .snapshot import SNAPSHOT_IN_STORAGE
+
+if TYPE_CHECKING:
+    from ..algolia.indexer import Indexer
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+# Firestore list prices in USD per 100,000 operations (Standard edition, multi-region)
+FIRESTORE_USD_PER_100K = {"reads": 0.06, "writes": 0.18, "deletes": 0.02}
+# Algolia bills by plan; set this to the contract's rate to include it in the estimate
+ALGOLIA_USD_PER_1K_OPERATIONS = 0.0
+# Records per Algolia request, as sent by AlgoliaIndexer
+ALGOLIA_BATCH_SIZE = 500
+# Firestore keeps an ascending and a descending single-field index entry per field
+INDEX_ENTRIES_PER_FIELD = 2
+
+# Storage and Indexer methods a plan may replay
+STORAGE_OPERATIONS = (
+    "upsert_book",
+    "upsert_person",
+    "upsert_contributor",
+    "upsert_person_works",
+    "update_book_author",
+    "delete",
+    "save_fingerprints",
+    "save_import_state",
+    "commit",
+)
+ALGOLIA_OPERATIONS = (
+    "index_books",
+    "index_persons",
+    "update_books",
+    "update_persons",
+    "delete_books",
+    "delete_persons",
+)
+# Fingerprints of the records sent to Algolia, replayed only along with the operations
+ALGOLIA_COLLECTIONS = frozenset(ALGOLIA_FINGERPRINTS.values())
+
+
+def _payload_bytes(data: Any) -> int:  # noqa: ANN401
+    encoded = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    return len(encoded.encode("utf-8"))
+
+
+class WritePlan:
+    """A ``Storage`` and Algolia ``Indexer`` that records writes instead of performing them.
+
+    Reads go to ``backend``. Writes are recorded in the order the importer issues them,
+    with their payload sizes, and grouped into batches the way ``AozoraFirestore``
+    commits them. The import state written during the run (checkpoints, watermark) is
+    overlaid on the backend's, so the run sees its own progress. A run with a catalog
+    snapshot writes its new snapshot elsewhere, recorded in ``snapshot`` as the ``path``
+    to replace and the ``planned`` file, which is moved into place when the plan is applied.
+    A snapshot kept in the backend is read from it, and saved next to the plan file.
+    """
+
+    def __init__(self, backend: Storage, batch_limit: int = BATCH_LIMIT) -> None:
+        """Plan writes against the current state of ``backend``."""
+        self.backend = backend
+        self.batch_limit = batch_limit
+        self.base_state = backend.get_import_state()
+        self._state = dict(self.base_state)
+        self.reads = 1
+        self.operations: list[dict[str, Any]] = []
+        self.collections: dict[str, dict[str, int]] = {}
+        self.batches: list[dict[str, Any]] = []
+        self._batch: dict[str, Any] | None = None
+        self.algolia: dict[str, dict[str, int]] = {}
+        self.snapshot: dict[str, str] | None = None
+        self._snapshot_data: bytes | None = None
+
+        # Each document is written at most once per run, as by every backend
+        self.seen_books: set[str] = set()
+        self.seen_persons: set[str] = set()
+        self.seen_contributors: set[str] = set()
+
+    def _stats(self, collection: str) -> dict[str, int]:
+        return self.collections.setdefault(
+            collection,
+            {
+                "known": 0,
+                "writes": 0,
+                "partial_writes": 0,
+                "deletes": 0,
+                "bytes": 0,
+                "index_entries": 0,
+            },
+        )
+
+    def _batched(self, collection: str, size: int) -> None:
+        if self._batch is None:
+            self._batch = {"operations": 0, "bytes": 0, "collections": {}}
+            self.batches.append(self._batch)
+        self._batch["operations"] += 1
+        self._batch["bytes"] += size
+        self._batch["collections"][collection] = self._batch["collections"].get(collection, 0) + 1
+        if self._batch["operations"] >= self.batch_limit:
+            self._batch = None
+
+    def _write(self, collection: str, data: dict[str, Any], partial: bool = False) -> None:
+        size = _payload_bytes(data)
+        stats = self._stats(collection)
+        stats["writes"] += 1
+        stats["partial_writes"] += partial
+        stats["bytes"] += size
+        stats["index_entries"] += INDEX_ENTRIES_PER_FIELD * len(data)
+        self._batched(collection, size)
+
+    def _record(self, op: str, *args: Any) -> None:  # noqa: ANN401
+        # The importer keeps updating some of what it saves, e.g. its checkpoint
+        self.operations.append({"op": op, "args": copy.deepcopy(list(args))})
+
+    def get_import_state(self) -> dict[str, Any]:
+        """Return the import state as the run has left it so far."""
+        self.reads += 1
+        return dict(self._state)
+
+    def save_import_state(self, state: dict[str, Any]) -> None:
+        """Record a merge into the import state document (not batched)."""
+        self._state.update(state)
+        self._record("save_import_state", state)
+        stats = self._stats("config")
+        stats["writes"] += 1
+        stats["bytes"] += _payload_bytes(state)
+
+    def update_import_state(self, update: StateUpdate) -> bool:
+        """Record merging ``update(state)`` into the import state, if it returns changes."""
+        changes = update(self.get_import_state())
+        if changes is None:
+            return False
+        self.save_import_state(changes)
+        return True
+
+    def get_watermark(self) -> str | None:
+        """Return the last processed date."""
+        return self.get_import_state().get("last_modified")
+
+    def save_watermark(self, date_str: str) -> None:
+        """Record saving the last processed date."""
+        self.save_import_state({"last_modified": date_str})
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        """Load the fingerprints of a collection from the backend."""
+        hashes = self.backend.load_fingerprints(collection)
+        self.reads += FINGERPRINT_SHARDS
+        self._stats(collection)["known"] = len(hashes)
+        return hashes
+
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        """Record fingerprint changes, one write per shard document touched."""
+        self._record("save_fingerprints", collection, changes)
+        shards: dict[int, dict[str, str | None]] = {}
+        for doc_id, fp in changes.items():
+            shards.setdefault(fingerprint_shard(doc_id), {})[doc_id] = fp
+        for hashes in shards.values():
+            self._write("import_fingerprints", {"hashes": hashes})
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Load the catalog snapshot from the backend."""
+        self.reads += 1
+        return self.backend.load_catalog_snapshot()
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Keep the new catalog snapshot; ``save`` writes it next to the plan."""
+        self._snapshot_data = data
+
+    def upsert_book(
+        self, book_id: str, data: dict[str, Any], fields: list[str] | None = None
+    ) -> None:
+        """Record a book upsert; with ``fields``, only those fields are written."""
+        if book_id not in self.seen_books:
+            self._record("upsert_book", book_id, data, fields)
+            self._write(
+                "books", data if fields is None else {f: data[f] for f in fields}, bool(fields)
+            )
+            self.seen_books.add(book_id)
+
+    def upsert_person(
+        self, person_id: str, data: dict[str, Any], fields: list[str] | None = None
+    ) -> None:
+        """Record a person upsert; with ``fields``, only those fields are written."""
+        if person_id not in self.seen_persons:
+            self._record("upsert_person", person_id, data, fields)
+            self._write(
+                "persons", data if fields is None else {f: data[f] for f in fields}, bool(fields)
+            )
+            self.seen_persons.add(person_id)
+
+    def upsert_contributor(self, contributor_id: str, data: dict[str, Any]) -> None:
+        """Record a contributor upsert."""
+        if contributor_id not in self.seen_contributors:
+            self._record("upsert_contributor", contributor_id, data)
+            self._write("contributors", data)
+            self.seen_contributors.add(contributor_id)
+
+    def upsert_person_works(self, person_id: str, data: dict[str, Any]) -> None:
+        """Record replacing the aggregate of a person's books."""
+        self._record("upsert_person_works", person_id, data)
+        self._write("person_works", data)
+
+    def update_book_author(self, book_id: str, data: dict[str, Any]) -> None:
+        """Record writing the author fields onto a book."""
+        self._record("update_book_author", book_id, data)
+        self._write("books", data, partial=True)
+
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Record a document deletion."""
+        self._record("delete", collection, doc_id)
+        self._stats(collection)["deletes"] += 1
+        self._batched(collection, 0)
+
+    def commit(self) -> None:
+        """Record a commit, which ends the current batch."""
+        self._record("commit")
+        self._batch = None
+
+    def close(self) -> None:
+        """Record the final commit."""
+        self.commit()
+
+    def _algolia(self, op: str, index_name: str, items: list, key: str) -> None:
+        if not items:
+            return
+        self._record(f"algolia.{op}", items)
+        stats = self.algolia.setdefault(
+            index_name, {"saves": 0, "updates": 0, "deletes": 0, "requests": 0, "bytes": 0}
+        )
+        stats[key] += len(items)
+        stats["requests"] += math.ceil(len(items) / ALGOLIA_BATCH_SIZE)
+        stats["bytes"] += _payload_bytes(items)
+
+    def index_books(self, records: list[dict]) -> None:
+        """Record uploading book records to Algolia."""
+        self._algolia("index_books", "books", records, "saves")
+
+    def index_persons(self, records: list[dict]) -> None:
+        """Record uploading person records to Algolia."""
+        self._algolia("index_persons", "persons", records, "saves")
+
+    def update_books(self, records: list[dict]) -> None:
+        """Record partially updating book records in Algolia."""
+        self._algolia("update_books", "books", records, "updates")
+
+    def update_persons(self, records: list[dict]) -> None:
+        """Record partially updating person records in Algolia."""
+        self._algolia("update_persons", "persons", records, "updates")
+
+    def delete_books(self, object_ids: list[str]) -> None:
+        """Record removing books from Algolia."""
+        self._algolia("delete_books", "books", object_ids, "deletes")
+
+    def delete_persons(self, object_ids: list[str]) -> None:
+        """Record removing persons from Algolia."""
+        self._algolia("delete_persons", "persons", object_ids, "deletes")
+
+    def wait(self) -> None:
+        """Nothing to wait for: a plan sends nothing."""
+
+    def summary(self) -> dict[str, Any]:
+        """Return the totals of the plan and its estimated cost."""
+        writes = sum(s["writes"] for s in self.collections.values())
+        deletes = sum(s["deletes"] for s in self.collections.values())
+        algolia_operations = sum(
+            s["saves"] + s["updates"] + s["deletes"] for s in self.algolia.values()
+        )
+        firestore_usd = (
+            self.reads * FIRESTORE_USD_PER_100K["reads"]
+            + writes * FIRESTORE_USD_PER_100K["writes"]
+            + deletes * FIRESTORE_USD_PER_100K["deletes"]
+        ) / 100_000
+        algolia_usd = algolia_operations * ALGOLIA_USD_PER_1K_OPERATIONS / 1000
+        return {
+            "firestore": {
+                "reads": self.reads,
+                "writes": writes,
+                "deletes": deletes,
+                "batches": len(self.batches),
+                "bytes": sum(s["bytes"] for s in self.collections.values()),
+                "index_entries": sum(s["index_entries"] for s in self.collections.values()),
+            },
+            "algolia": {
+                "operations": algolia_operations,
+                "requests": sum(s["requests"] for s in self.algolia.values()),
+                "bytes": sum(s["bytes"] for s in self.algolia.values()),
+            },
+            "estimated_cost_usd": {
+                "firestore": round(firestore_usd, 6),
+                "algolia": round(algolia_usd, 6),
+            },
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the plan as saved by ``save``."""
+        return {
+            "version": PLAN_VERSION,
+            # The plan only applies to the import state it was made against
+            "state_fingerprint": fingerprint(self.base_state),
+            "summary": self.summary(),
+            "collections": self.collections,
+            "algolia": self.algolia,
+            "batches": self.batches,
+            "snapshot": self.snapshot,
+            "operations": self.operations,
+        }
+
+    def save(self, path: str | Path) -> None:
+        """Write the plan as JSON, and the snapshot planned for the backend to ``<path>.snapshot``."""
+        if self._snapshot_data is not None:
+            planned = f"{path}.snapshot"
+            Path(planned).write_bytes(self._snapshot_data)
+            self.snapshot = {"path": SNAPSHOT_IN_STORAGE, "planned": planned}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1, default=str)
+
+
+def load_plan(path: str | Path) -> dict[str, Any]:
+    """Read a plan written by ``WritePlan.save``."""
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version: {plan.get('version')}")
+    return plan
+
+
+def _install_snapshot(snapshot: dict[str, str], db: Storage) -> None:
+    if snapshot["path"] == SNAPSHOT_IN_STORAGE:
+        db.save_catalog_snapshot(Path(snapshot["planned"]).read_bytes())
+        os.remove(snapshot["planned"])
+    else:
+        os.replace(snapshot["planned"], snapshot["path"])
+
+
+def _replay(op: str, args: list[Any], db: Storage, indexer: "Indexer | None") -> None:
+    if op.startswith("algolia."):
+        name = op.removeprefix("algolia.")
+        if name not in ALGOLIA_OPERATIONS:
+            raise ValueError(f"Unknown plan operation: {op}")
+        if indexer is not None:
+            getattr(indexer, name)(*args)
+    elif op == "save_fingerprints" and indexer is None and args[0] in ALGOLIA_COLLECTIONS:
+        # They would claim Algolia has records that were never sent to it
+        return
+    elif op in STORAGE_OPERATIONS:
+        getattr(db, op)(*args)
+    else:
+        raise ValueError(f"Unknown plan operation: {op}")
+
+
+def apply_plan(plan: dict[str, Any], db: Storage, indexer: "Indexer | None" = None) -> None:
+    """Perform the writes of a plan on ``db``, and its Algolia operations with ``indexer``.
+
+    Refuses a plan made against a different import state: another run has happened
+    since, so the plan may no longer be what an import would do. Without ``indexer``,
+    Algolia operations are skipped, and so are the fingerprints of what they would send,
+    leaving those records for the next run to send. The plan's snapshot is installed last.
+    """
+    if fingerprint(db.get_import_state()) != plan["state_fingerprint"]:
+        raise ValueError("The import state changed since the plan was made; plan again")
+    for operation in plan["operations"]:
+        _replay(operation["op"], operation["args"], db, indexer)
+    if indexer is not None:
+        indexer.wait()
+    elif any(o["op"].startswith("algolia.") for o in plan["operations"]):
+        logger.info("No Algolia indexer — skipping the plan's Algolia operations.")
+    db.commit()
+    if plan.get("snapshot"):
+        _install_snapshot(plan["snapshot"], db)
@@ -0,0 +1,34 @@
+import os
+import zlib
+from typing import NamedTuple
+
+
+def shard_of(key: str, count: int) -> int:
+    """Return the shard ``key`` belongs to; stable across processes and runs."""
+    return zlib.crc32(key.encode("utf-8")) % count
+
+
+class Shard(NamedTuple):
+    """One of ``shard_count`` partitions of an import.
+
+    A book and its contributors belong to the shard of the book ID, a person to the
+    shard of the person ID.
+    """
+
+    shard_index: int = 0
+    shard_count: int = 1
+
+    def owns(self, key: str) -> bool:
+        """Return True if the document with ID ``key`` is written by this shard."""
+        return self.shard_count == 1 or shard_of(key, self.shard_count) == self.shard_index
+
+
+UNSHARDED = Shard()
+
+
+def shard_from_env() -> Shard:
+    """Return the shard of this Cloud Run task (CLOUD_RUN_TASK_INDEX/CLOUD_RUN_TASK_COUNT)."""
+    return Shard(
+        int(os.environ.get("CLOUD_RUN_TASK_INDEX", "0")),
+        int(os.environ.get("CLOUD_RUN_TASK_COUNT", "1")),
+    )
@@ -0,0 +1,222 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, NamedTuple, Protocol
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+# Where --snapshot keeps the snapshot in the storage backend instead of a file
+SNAPSHOT_IN_STORAGE = "storage"
+
+
+class SnapshotStorage(Protocol):
+    """Storage that keeps the encoded snapshot of the last imported catalog."""
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the stored snapshot, or None if there is none."""
+        ...
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the stored snapshot."""
+        ...
+
+
+# A snapshot file, or the storage holding it
+SnapshotLocation = str | Path | SnapshotStorage
+
+
+class SnapshotBuffer:
+    """A ``SnapshotStorage`` in memory, for storage that is only reachable asynchronously.
+
+    ``changed`` tells whether the run saved a new snapshot into it.
+    """
+
+    def __init__(self, data: bytes | None = None) -> None:
+        """Hold ``data``, the snapshot loaded from the real storage."""
+        self.data = data
+        self.changed = False
+
+    def load_catalog_snapshot(self) -> bytes | None:
+        """Return the snapshot held."""
+        return self.data
+
+    def save_catalog_snapshot(self, data: bytes) -> None:
+        """Replace the snapshot held."""
+        self.data = data
+        self.changed = True
+
+
+class Snapshot(NamedTuple):
+    """What a catalog imported to, as lists sorted by key.
+
+    Books and persons are (ID, fingerprint of the mapped document) pairs; contributors
+    are (book_id, person_id, role) keys, which determine the whole document.
+    """
+
+    books: list[tuple[str, str]]
+    persons: list[tuple[str, str]]
+    contributors: list[tuple[str, str, int]]
+
+    @classmethod
+    def build(
+        cls,
+        books: Iterable[tuple[str, str]],
+        persons: Iterable[tuple[str, str]],
+        contributors: Iterable[tuple[str, str, int]],
+    ) -> "Snapshot":
+        """Create a snapshot from unsorted entries; duplicate keys keep their first value."""
+        return cls(_sorted_unique(books), _sorted_unique(persons), sorted(set(contributors)))
+
+
+def _sorted_unique(items: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+    first: dict[str, str] = {}
+    for key, value in items:
+        first.setdefault(key, value)
+    return sorted(first.items())
+
+
+def contributor_id(key: tuple[str, str, int]) -> str:
+    """Return the ``contributors`` document ID of a (book_id, person_id, role) key."""
+    return f"{key[0]}-{key[1]}-{key[2]}"
+
+
+def load_snapshot(location: SnapshotLocation) -> Snapshot | None:
+    """Read a snapshot written by ``save_snapshot``; None if there is none (or it is stale)."""
+    if isinstance(location, str | Path):
+        path = Path(location)
+        encoded = path.read_bytes() if path.exists() else None
+    else:
+        encoded = location.load_catalog_snapshot()
+    if encoded is None:
+        return None
+    data = json.loads(gzip.decompress(encoded))
+    if data.get("version") != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring snapshot of version {data.get('version')}")
+        return None
+    return Snapshot(
+        [(k, v) for k, v in data["books"]],
+        [(k, v) for k, v in data["persons"]],
+        [(b, p, r) for b, p, r in data["contributors"]],
+    )
+
+
+def save_snapshot(location: SnapshotLocation, snapshot: Snapshot) -> None:
+    """Write a snapshot as gzipped JSON, atomically: to a file, or into the storage."""
+    data = {"version": SNAPSHOT_VERSION, **snapshot._asdict()}
+    encoded = gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), mtime=0)
+    if not isinstance(location, str | Path):
+        location.save_catalog_snapshot(encoded)
+        return
+    path = Path(location)
+    # A unique temporary name, so that concurrent writers never share the file
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+        ) as tmp:
+            tmp_path = Path(tmp.name)
+            tmp.write(encoded)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        raise
+
+
+class CollectionDiff(NamedTuple):
+    """IDs added, changed and removed in one collection, in key order."""
+
+    added: list[str]
+    changed: list[str]
+    removed: list[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+class CatalogDiff(NamedTuple):
+    """Changes between two snapshots."""
+
+    books: CollectionDiff
+    persons: CollectionDiff
+    contributors: CollectionDiff
+
+    def report(self) -> dict[str, Any]:
+        """Return the diff as a JSON-serializable change report."""
+        return {
+            name: {
+                "added": diff.added,
+                "changed": diff.changed,
+                "removed": diff.removed,
+            }
+            for name, diff in self._asdict().items()
+        }
+
+    def summary(self) -> str:
+        """Return a one-line summary of the counts."""
+        return ", ".join(
+            f"{name} +{len(d.added)} ~{len(d.changed)} -{len(d.removed)}"
+            for name, d in self._asdict().items()
+        )
+
+
+def _merge_join(old: list[tuple], new: list[tuple]) -> Iterator[tuple[tuple | None, tuple | None]]:
+    """Walk two lists sorted by their first element and yield matching (old, new) pairs.
+
+    Entries present on one side only are paired with None.
+    """
+    i = j = 0
+    while i < len(old) and j < len(new):
+        if old[i][0] == new[j][0]:
+            yield old[i], new[j]
+            i += 1
+            j += 1
+        elif old[i][0] < new[j][0]:
+            yield old[i], None
+            i += 1
+        else:
+            yield None, new[j]
+            j += 1
+    for item in old[i:]:
+        yield item, None
+    for item in new[j:]:
+        yield None, item
+
+
+def _diff_fingerprints(old: list[tuple[str, str]], new: list[tuple[str, str]]) -> CollectionDiff:
+    diff = CollectionDiff([], [], [])
+    for before, after in _merge_join(old, new):
+        if before is None:
+            diff.added.append(after[0])  # type: ignore[index]
+        elif after is None:
+            diff.removed.append(before[0])
+        elif before[1] != after[1]:
+            diff.changed.append(after[0])
+    return diff
+
+
+def _diff_contributors(
+    old: list[tuple[str, str, int]], new: list[tuple[str, str, int]]
+) -> CollectionDiff:
+    # Keys are whole tuples here, so join on (key,) wrappers
+    diff = CollectionDiff([], [], [])
+    for before, after in _merge_join([(k,) for k in old], [(k,) for k in new]):
+        if before is None:
+            diff.added.append(contributor_id(after[0]))  # type: ignore[index]
+        elif after is None:
+            diff.removed.append(contributor_id(before[0]))
+    return diff
+
+
+def diff_snapshots(old: Snapshot, new: Snapshot) -> CatalogDiff:
+    """Compute what changed from ``old`` to ``new`` in one linear pass per collection."""
+    return CatalogDiff(
+        _diff_fingerprints(old.books, new.books),
+        _diff_fingerprints(old.persons, new.persons),
+        _diff_contributors(old.contributors, new.contributors),
+    )
@@ -0,0 +1,137 @@
+import bisect
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observed values per bucket, with count, sum, min and max."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """Create an empty histogram with the given bucket upper bounds."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add one value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the ``q`` quantile (``max`` beyond)."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self) -> dict[str, Any]:
+        """Return the histogram as a JSON-serializable dict."""
+        if not self.count:
+            return {"count": 0}
+        labels = [f"le_{b:g}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6),
+            "max": round(self.max, 6),
+            "mean": round(self.sum / self.count, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {label: n for label, n in zip(labels, self.counts, strict=True) if n},
+        }
+
+
+class Metrics:
+    """Phase timers, counters and histograms of one import run. Thread-safe."""
+
+    def __init__(self) -> None:
+        """Start an empty run."""
+        self._lock = threading.Lock()
+        # Per thread, the open phases as [name, start of the time not yet added] pairs
+        self._open = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything recorded so far and restart the run clock."""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.phases: dict[str, float] = {}
+            self.counters: Counter[str] = Counter()
+            self.histograms: dict[str, Histogram] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the wall time spent in the block to phase ``name``.
+
+        A phase entered within another one suspends it, so the phases of a thread never
+        overlap: a commit made while processing counts as ``commit`` only.
+        """
+        stack: list[list[Any]] | None = getattr(self._open, "stack", None)
+        if stack is None:
+            stack = self._open.stack = []
+        now = time.perf_counter()
+        if stack:
+            outer, outer_start = stack[-1]
+            self._add_time(outer, outer_start, now)
+        frame: list[Any] = [name, now]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            self._add_time(name, frame[1], now)
+            if stack:
+                stack[-1][1] = now
+
+    def _add_time(self, name: str, start: float, end: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + end - start
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increment counter ``name``."""
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name: str, value: float) -> None:
+        """Add a value to histogram ``name``."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def summary(self) -> dict[str, Any]:
+        """Return everything recorded as a JSON-serializable dict."""
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            # Rows are mapped to documents, then written
+            process = self.phases.get("map", 0.0) + self.phases.get("process", 0.0)
+            rows = self.counters.get("rows.processed", 0)
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "phases_seconds": {k: round(v, 3) for k, v in self.phases.items()},
+                "counters": dict(sorted(self.counters.items())),
+                "rows_per_second": round(rows / process, 1) if process else None,
+                "histograms": {k: h.summary() for k, h in self.histograms.items()},
+            }
+
+
+# Metrics of the current run, shared by the importer and the storage backends
+metrics = Metrics()
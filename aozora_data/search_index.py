@@ -0,0 +1,257 @@
+import argparse
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from aozora_data.catalog import Catalog
+from aozora_data.importer.csv_importer import algolia_records
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+OUTPUT_FILE = "search_index.bin"
+MAGIC = b"AOZSRCH1"
+# Magic, then the byte length of the text and the number of suffixes, keys and records
+HEADER = struct.Struct("<8sIIII")
+DEFAULT_LIMIT = 20
+
+# Record fields searched, per Algolia index. Each tuple is joined into one key.
+SEARCH_FIELDS = {
+    "books": (("title",), ("title_yomi",), ("author_name",)),
+    "persons": (("last_name", "first_name"), ("last_name_yomi", "first_name_yomi")),
+}
+
+# Katakana to hiragana, and separators dropped, after NFKC has unified widths
+_KANA = {c: c - 0x60 for c in range(0x30A1, 0x30F7)} | {0x30FD: 0x309D, 0x30FE: 0x309E}
+_NORMALIZE = _KANA | {ord(c): None for c in " \t\r\n\0・"}
+
+
+def normalize(text: str) -> str:
+    """Normalize text for matching: NFKC, lowercase, katakana as hiragana, no spaces or ・."""
+    return unicodedata.normalize("NFKC", text).lower().translate(_NORMALIZE)
+
+
+class Hit(NamedTuple):
+    """A search result: the Algolia index a record belongs to, and the record."""
+
+    index_name: str
+    record: dict[str, Any]
+
+
+def _keys(index_name: str, record: dict[str, Any]) -> list[str]:
+    keys = []
+    for fields in SEARCH_FIELDS[index_name]:
+        key = normalize("".join(str(record.get(f) or "") for f in fields))
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _aligned(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def build_index(books: Iterable[dict], persons: Iterable[dict]) -> bytes:
+    """Build the search index of Algolia book and person records, as bytes.
+
+    Every searched field is normalized into a key, and the keys concatenated, each ended
+    by a NUL, into one UTF-8 text. The suffix array lists the offset of every character
+    of the text in the order of the rest of its key; the prefix array does the same for
+    key starts only. A query is looked up in either with two binary searches.
+
+    Layout (4-byte aligned, native byte order): header, text, suffix array, prefix array,
+    key start offsets (plus the end of the text), the record of each key, then the
+    records as JSON with their offsets.
+    """
+    text = bytearray()
+    key_starts = array("I")
+    key_records = array("I")
+    encoded_records: list[bytes] = []
+    suffixes: list[tuple[bytes, int]] = []
+    sources = (("books", books), ("persons", persons))
+    for index_name, index_records in sources:
+        for record in index_records:
+            for key in _keys(index_name, record):
+                start = len(text)
+                encoded = key.encode("utf-8")
+                key_starts.append(start)
+                key_records.append(len(encoded_records))
+                text += encoded + b"\0"
+                offset = 0
+                for char in key:
+                    suffixes.append((encoded[offset:], start + offset))
+                    offset += len(char.encode("utf-8"))
+            encoded_record = json.dumps([index_name, record], ensure_ascii=False).encode("utf-8")
+            encoded_records.append(encoded_record)
+    key_starts_end = array("I", key_starts)
+    key_starts_end.append(len(text))
+
+    suffixes.sort()
+    suffix_array = array("I", (offset for _, offset in suffixes))
+    starts = set(key_starts)
+    prefix_array = array("I", (offset for _, offset in suffixes if offset in starts))
+    record_offsets = array("I", [0])
+    for encoded_record in encoded_records:
+        record_offsets.append(record_offsets[-1] + len(encoded_record))
+
+    header = HEADER.pack(MAGIC, len(text), len(suffix_array), len(key_starts), len(encoded_records))
+    return b"".join(
+        [
+            header,
+            _aligned(bytes(text)),
+            suffix_array.tobytes(),
+            prefix_array.tobytes(),
+            key_starts_end.tobytes(),
+            key_records.tobytes(),
+            record_offsets.tobytes(),
+            b"".join(encoded_records),
+        ]
+    )
+
+
+def write_index(path: str | Path, books: Iterable[dict], persons: Iterable[dict]) -> None:
+    """Build the search index and write it to ``path`` atomically."""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_bytes(build_index(books, persons))
+    os.replace(tmp_path, path)
+
+
+class SearchIndex:
+    """A search index written by ``build_index``, read in place from bytes or a mapped file.
+
+    Queries are normalized like the keys; they return records whose searched fields
+    contain the query (or start with it, with ``prefix``). Matches at the start of a
+    field rank first, then shorter fields, then records in build order.
+    """
+
+    def __init__(self, data: bytes | mmap.mmap) -> None:
+        """Read the index in ``data`` without copying it."""
+        if sys.byteorder != "little":
+            raise RuntimeError("Search index files are little-endian")
+        magic, text_len, n_suffixes, n_keys, n_records = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a search index file")
+        self._data = data
+        self._view = memoryview(data)
+        self._text = HEADER.size
+        position = HEADER.size + text_len + (-text_len % 4)
+
+        def section(count: int) -> memoryview:
+            nonlocal position
+            view = self._view[position : position + 4 * count].cast("I")
+            position += 4 * count
+            return view
+
+        self._suffixes = section(n_suffixes)
+        self._prefixes = section(n_keys)
+        self._key_starts = section(n_keys + 1)
+        self._key_records = section(n_keys)
+        self._record_offsets = section(n_records + 1)
+        self._records = position
+
+    @classmethod
+    def open(cls, path: str | Path) -> "SearchIndex":
+        """Map an index file into memory; pages are read as queries touch them."""
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __enter__(self) -> "SearchIndex":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._record_offsets) - 1
+
+    def close(self) -> None:
+        """Release the index, and unmap its file."""
+        for view in (
+            self._suffixes,
+            self._prefixes,
+            self._key_starts,
+            self._key_records,
+            self._record_offsets,
+            self._view,
+        ):
+            view.release()
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def _range(self, offsets: Sequence[int], query: bytes) -> Sequence[int]:
+        start, end = self._text, self._text + len(query)
+        data = self._data
+
+        def key(offset: int) -> bytes:
+            return data[start + offset : end + offset]
+
+        lo = bisect_left(offsets, query, key=key)
+        hi = bisect_right(offsets, query, lo=lo, key=key)
+        return offsets[lo:hi]
+
+    def record(self, n: int) -> Hit:
+        """Return the ``n``-th record of the index."""
+        base = self._records
+        start, end = self._record_offsets[n], self._record_offsets[n + 1]
+        index_name, record = json.loads(self._data[base + start : base + end])
+        return Hit(index_name, record)
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT, prefix: bool = False) -> list[Hit]:
+        """Return up to ``limit`` records matching ``query``, best first."""
+        encoded = normalize(query).encode("utf-8")
+        if not encoded:
+            return []
+        key_starts = self._key_starts
+        ranks: dict[int, tuple[int, int, int]] = {}
+        for offset in self._range(self._prefixes if prefix else self._suffixes, encoded):
+            key = bisect_right(key_starts, offset) - 1
+            n = self._key_records[key]
+            rank = (offset != key_starts[key], key_starts[key + 1] - key_starts[key], n)
+            if n not in ranks or rank < ranks[n]:
+                ranks[n] = rank
+        return [self.record(n) for n in heapq.nsmallest(limit, ranks, key=ranks.__getitem__)]
+
+
+def main() -> None:
+    """Build the local search index from a catalog, or query one."""
+    parser = argparse.ArgumentParser(description="Build or query the local search index.")
+    parser.add_argument(
+        "catalog",
+        nargs="?",
+        help="Path to the Aozora catalog (list_person_all_extended_utf8.zip or .csv) to index.",
+    )
+    parser.add_argument("--output", default=OUTPUT_FILE, help=f"Index file (default: {OUTPUT_FILE}).")
+    parser.add_argument("--query", help="Search the index file and print the hits as JSON.")
+    parser.add_argument("--prefix", action="store_true", help="Match field starts only.")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="Maximum number of hits.")
+    args = parser.parse_args()
+
+    if args.catalog:
+        catalog_path = Path(args.catalog)
+        if not catalog_path.exists():
+            logger.error(f"Catalog not found: {catalog_path}")
+            return
+        catalog = Catalog.load(catalog_path)
+        books, persons = algolia_records(catalog, catalog.book_ids(), catalog.person_rows)
+        write_index(args.output, books.values(), persons.values())
+        logger.info(f"Indexed {len(books)} books and {len(persons)} persons in {args.output}")
+    if args.query:
+        with SearchIndex.open(args.output) as index:
+            for hit in index.search(args.query, args.limit, args.prefix):
+                print(json.dumps(hit._asdict(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import argparse
 import sys
 
-from .converter import TextToHtmlConverter
+from .converter import CSS_MODE_LINK, CSS_MODES, TextToHtmlConverter
 
 
 def main():
@@ -9,11 +9,17 @@ def main():
     parser = argparse.ArgumentParser(description="Convert Aozora Bunko text to HTML5.")
     parser.add_argument("input", help="Path to input text file (UTF-8)")
     parser.add_argument("output", help="Path to output HTML file")
+    parser.add_argument(
+        "--css-mode",
+        choices=CSS_MODES,
+        default=CSS_MODE_LINK,
+        help="Link the full stylesheet, or inline the CSS subset the document actually uses",
+    )
 
     args = parser.parse_args()
 
     try:
-        converter = TextToHtmlConverter(args.input, args.output)
+        converter = TextToHtmlConverter(args.input, args.output, css_mode=args.css_mode)
         converter.convert()
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -1,9 +1,23 @@
 # ruff: noqa: RUF001, RUF003
 import html
+import io
 import json
 import re
 from typing import Any, TextIO
 
+from .css import STYLESHEET, critical_css
+
+STYLESHEET_HREF = "./css/aozora.css"
+
+# How the stylesheet is referenced from <head>:
+#   link        - plain <link rel="stylesheet"> (default)
+#   inline      - inline the critical subset and load the full stylesheet without blocking
+#   inline-only - inline the critical subset and skip the full stylesheet
+CSS_MODE_LINK = "link"
+CSS_MODE_INLINE = "inline"
+CSS_MODE_INLINE_ONLY = "inline-only"
+CSS_MODES = (CSS_MODE_LINK, CSS_MODE_INLINE, CSS_MODE_INLINE_ONLY)
+
 
 class CharStream:
     """Character stream for parsing Aozora Bunko text."""
@@ -59,10 +73,22 @@ class CharStream:
 class TextToHtmlConverter:
     """Convert Aozora Bunko text to HTML5."""
 
-    def __init__(self, input_path: str, output_path: str) -> None:
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        css_mode: str = CSS_MODE_LINK,
+        stylesheet: str = STYLESHEET,
+    ) -> None:
         """Initialize the converter."""
+        if css_mode not in CSS_MODES:
+            raise ValueError(f"Unknown css_mode: {css_mode}")
         self.input_path = input_path
         self.output_path = output_path
+        self.css_mode = css_mode
+        self.stylesheet = stylesheet
+        # CSS classes emitted into the document, used to prune the stylesheet
+        self.used_classes: set[str] = set()
         self.metadata: dict[str, str] = {}
         self.stream: CharStream | None = None
         self.buffer: list[dict[str, Any]] = []  # List of {'text': str, 'safe': bool}
@@ -78,9 +104,36 @@ class TextToHtmlConverter:
         ):
             self.stream = CharStream(f_in)
             self._parse_header()
-            self._write_html_header(f_out)
-            self._parse_and_write_body(f_out)
-            self._write_footer(f_out)
+            if self.css_mode == CSS_MODE_LINK:
+                self._write_html_header(f_out)
+                self._parse_and_write_body(f_out)
+                self._write_footer(f_out)
+            else:
+                # The body has to be rendered first so that <head> knows which classes it uses
+                body = io.StringIO()
+                self._parse_and_write_body(body)
+                self._write_footer(body)
+                self._write_html_header(f_out)
+                f_out.write(body.getvalue())
+
+    def _cls(self, name: str) -> str:
+        """Record a CSS class as used and return it."""
+        self.used_classes.add(name)
+        return name
+
+    def _stylesheet_tags(self) -> str:
+        link = f'<link rel="stylesheet" href="{STYLESHEET_HREF}" />'
+        if self.css_mode == CSS_MODE_LINK:
+            return link
+        style = f"<style>\n{critical_css(self.used_classes, self.stylesheet)}\n</style>"
+        if self.css_mode == CSS_MODE_INLINE_ONLY:
+            return style
+        return (
+            f"{style}\n"
+            f'<link rel="preload" href="{STYLESHEET_HREF}" as="style"'
+            " onload=\"this.onload=null;this.rel='stylesheet'\" />\n"
+            f"<noscript>{link}</noscript>"
+        )
 
     def _parse_header(self) -> None:
         if not self.stream:
@@ -175,12 +228,17 @@ class TextToHtmlConverter:
         t = self.metadata.get("title", "")
         a = self.metadata.get("author", "")
         ft = f"{t} ({a})" if a else t
+        for cls in ["aozora-work", "metadata", "title", "main_text"]:
+            self._cls(cls)
+        for k in ["original_title", "subtitle", "author", "editor", "translator"]:
+            if self.metadata.get(k):
+                self._cls(k)
         f.write(f"""<!DOCTYPE html>
 <html lang="ja-JP">
 <head>
 <meta charset="UTF-8" />
 <meta name="viewport" content="width=device-width, initial-scale=1.0" />
-<link rel="stylesheet" href="./css/aozora.css" />
+{self._stylesheet_tags()}
 <title>{html.escape(ft)}</title>
 <link rel="schema.dcterms" href="http://purl.org/dc/terms/" />
 <meta name="dcterms.title" content="{html.escape(t)}" />
@@ -263,7 +321,9 @@ class TextToHtmlConverter:
             if self.stream.peek() == "＃":
                 self.stream.read()  # Sharp
                 note = self.stream.read_until("］")
-                self._append(f'<aside class="notes">［＃{html.escape(note)}］</aside>', raw=True)
+                self._append(
+                    f'<aside class="{self._cls("notes")}">［＃{html.escape(note)}］</aside>', raw=True
+                )
             else:
                 self._append("※［")
         else:
@@ -279,7 +339,8 @@ class TextToHtmlConverter:
         full_text = "".join([x["text"] for x in self.buffer])
         if full_text.strip().startswith("底本："):
             f.write(
-                '</p>\n</section>\n</div>\n<footer>\n<div class="bibliographical_information">\n<hr>\n<br>\n'  # noqa: E501
+                "</p>\n</section>\n</div>\n<footer>\n"
+                f'<div class="{self._cls("bibliographical_information")}">\n<hr>\n<br>\n'
             )
             self.in_footer = True
             # Note: We don't start a new p here as we are in footer div
@@ -298,7 +359,7 @@ class TextToHtmlConverter:
             # Extract depth for jisage? "ここから１字下げ"
             if m := re.search(r"([０-９]+)字下げ", cmd):
                 cls = f"jisage_{self._kanji_num(m.group(1))}"
-            f.write(f'<div class="{cls}">\n<p>')
+            f.write(f'<div class="{self._cls(cls)}">\n<p>')
             self.indent_stack.append(cls)
         elif cmd.endswith("終わり") and cmd != "文頭":
             self._flush(f)
@@ -315,11 +376,14 @@ class TextToHtmlConverter:
             elif "中" in cmd:
                 tag = "h4"
             # Close previous p, close previous section, start new section, start new p (after heading)
-            f.write(f'</p>\n</section>\n<section>\n<{tag} class="midashi">{cmd}</{tag}>\n<p>')
+            f.write(
+                "</p>\n</section>\n<section>\n"
+                f'<{tag} class="{self._cls("midashi")}">{cmd}</{tag}>\n<p>'
+            )
         elif "改ページ" in cmd:
             self._flush(f)
             # Close p, break, start new p
-            f.write('</p>\n<hr>\n<div class="page_break"></div>\n<p>')
+            f.write(f'</p>\n<hr>\n<div class="{self._cls("page_break")}"></div>\n<p>')
         else:
             pass
 
@@ -0,0 +1,106 @@
+import re
+from functools import lru_cache
+from importlib.resources import files
+
+# Shipped as package data, so it is there in an installed wheel too
+STYLESHEET = "aozora.css"
+
+# At-rules whose body holds nested rules rather than declarations
+_GROUPING_AT_RULES = ("@layer", "@container", "@media", "@supports")
+
+_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CLASS_RE = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _squash(text: str) -> str:
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _parse(text: str) -> list[tuple[str, str | list | None]]:
+    """Parse CSS into (prelude, body) nodes.
+
+    ``body`` is None for statements such as ``@layer a, b;``, a list of nodes for
+    grouping at-rules and the raw declaration text for ordinary rules.
+    """
+    nodes: list[tuple[str, str | list | None]] = []
+    pos = 0
+    while pos < len(text):
+        brace = text.find("{", pos)
+        semi = text.find(";", pos)
+        if brace == -1 and semi == -1:
+            break
+        if semi != -1 and (brace == -1 or semi < brace):
+            prelude = _squash(text[pos:semi])
+            if prelude:
+                nodes.append((prelude, None))
+            pos = semi + 1
+            continue
+
+        prelude = _squash(text[pos:brace])
+        depth = 1
+        end = brace + 1
+        while end < len(text) and depth:
+            if text[end] == "{":
+                depth += 1
+            elif text[end] == "}":
+                depth -= 1
+            end += 1
+        body = text[brace + 1 : end - 1]
+        if prelude.startswith(_GROUPING_AT_RULES):
+            nodes.append((prelude, _parse(body)))
+        else:
+            nodes.append((prelude, _squash(body)))
+        pos = end
+    return nodes
+
+
+def _prune(nodes: list, used_classes: frozenset[str]) -> list[str]:
+    out: list[str] = []
+    for prelude, body in nodes:
+        if body is None:
+            out.append(f"{prelude};")
+        elif isinstance(body, list):
+            children = _prune(body, used_classes)
+            if children:
+                out.append(f"{prelude}{{{''.join(children)}}}")
+        else:
+            selectors = [
+                s.strip()
+                for s in prelude.split(",")
+                if all(c in used_classes for c in _CLASS_RE.findall(s))
+            ]
+            if selectors:
+                out.append(f"{','.join(selectors)}{{{body}}}")
+    return out
+
+
+@lru_cache(maxsize=1)
+def _load_stylesheet(name: str) -> list:
+    text = (files(__package__) / name).read_text(encoding="utf-8")
+    return _parse(_COMMENT_RE.sub("", text))
+
+
+def prune_css(css_text: str, used_classes: set[str]) -> str:
+    """Return the subset of ``css_text`` whose selectors only reference ``used_classes``.
+
+    Selectors without class references (element selectors, ``:root`` etc.) are kept;
+    grouping at-rules that end up empty are dropped.
+    """
+    nodes = _parse(_COMMENT_RE.sub("", css_text))
+    return "\n".join(_prune(nodes, frozenset(used_classes)))
+
+
+@lru_cache(maxsize=256)
+def _critical_css(stylesheet: str, used_classes: frozenset[str]) -> str:
+    return "\n".join(_prune(_load_stylesheet(stylesheet), used_classes))
+
+
+def critical_css(used_classes: set[str], stylesheet: str = STYLESHEET) -> str:
+    """Return the pruned stylesheet for a document that emitted ``used_classes``.
+
+    ``stylesheet`` names a stylesheet shipped in this package. The parsed stylesheet
+    and the pruned output are cached, so bulk conversions only pay for parsing once
+    and share results between works using the same classes.
+    """
+    return _critical_css(stylesheet, frozenset(used_classes))
@@ -1,9 +1,10 @@
-import csv
 import hashlib
+import json
 import logging
 import mimetypes
 import os
 import re
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
@@ -11,6 +12,8 @@ import boto3
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
+from aozora_data.catalog import Catalog
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -27,9 +30,16 @@ R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME")
 UPLOAD_CONFIGS = [
     ("utf-8", "*.utf8.txt", "text/plain; charset=utf-8", True, ""),
     ("utf-8_html", "*.utf8.html", "text/html; charset=utf-8", True, ""),
-    ("css", "aozora.css", "text/css; charset=utf-8", False, "css/"),
+    ("aozora_data/text_to_html", "aozora.css", "text/css; charset=utf-8", False, "css/"),
+    # Content-hashed catalog files from export-catalog; manifest.json is uploaded separately
+    ("catalog_json", "*.*.json", "application/json; charset=utf-8", False, "catalog/"),
 ]
+# Names the current catalog index, so it goes up only once all the files it refers to have
+CATALOG_MANIFEST = Path("catalog_json/manifest.json")
+CATALOG_MANIFEST_KEY = "catalog/manifest.json"
 MAX_WORKERS = 10  # Number of parallel uploads
+# MD5s of local files from earlier runs, by path, with the size, mtime and inode they had
+MD5_CACHE = Path(".upload_md5_cache.json")
 
 
 def get_r2_client():
@@ -52,11 +62,66 @@ def get_r2_client():
 
 def calculate_md5(file_path: Path) -> str:
     """Calculate the MD5 checksum of a file."""
-    hash_md5 = hashlib.md5()
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        # Reads into one reusable large buffer, with the GIL released while hashing
+        return hashlib.file_digest(f, "md5").hexdigest()
+
+
+class Md5Cache:
+    """MD5s of local files, kept between runs so unchanged files are not read again.
+
+    An entry is reused while the file's size, mtime (in nanoseconds) and inode are the
+    ones it was hashed with; any other file is hashed and its entry replaced. Entries of
+    files that no longer exist are dropped on save; those of files a partial upload did
+    not look at are kept. ``md5`` may be called from several threads.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Load the cache at ``path``; a missing or unreadable cache starts empty."""
+        self.path = path
+        self._entries: dict[str, list] = {}
+        self._seen: set[str] = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        if path.exists():
+            try:
+                self._entries = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable MD5 cache {path}: {e}")
+
+    def md5(self, file_path: Path) -> str:
+        """Return the MD5 of a file, hashing it only if it changed since it was cached."""
+        st = os.stat(file_path)
+        signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+        key = str(file_path)
+        with self._lock:
+            self._seen.add(key)
+            entry = self._entries.get(key)
+            if entry is not None and entry[:3] == signature:
+                self.hits += 1
+                return entry[3]
+        md5 = calculate_md5(file_path)
+        with self._lock:
+            self._entries[key] = [*signature, md5]
+            self._dirty = True
+        return md5
+
+    def save(self) -> None:
+        """Write the cache atomically, without the files since removed, if it changed."""
+        with self._lock:
+            entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if key in self._seen or os.path.exists(key)
+            }
+            if not self._dirty and len(entries) == len(self._entries):
+                return
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            tmp_path.write_text(json.dumps(entries, separators=(",", ":")))
+            os.replace(tmp_path, self.path)
+            self._entries = entries
+            self._dirty = False
 
 
 def upload_file(
@@ -67,30 +132,8 @@ def upload_file(
     content_type: str | None = None,
     dry_run: bool = False,
 ):
-    """Upload a single file to R2."""
+    """Upload a single file to R2 (unchanged files are filtered out by select_changed_files)."""
     try:
-        # Calculate local MD5
-        local_md5 = calculate_md5(file_path)
-
-        # Check if file exists and matches MD5
-        try:
-            # client is explicitly typed as object to avoid ANN401, but at runtime it's a boto3 client
-            response = client.head_object(Bucket=bucket_name, Key=target_key)  # type: ignore
-            remote_etag = response.get("ETag", "").strip('"')
-
-            if local_md5 == remote_etag:
-                if dry_run:
-                    logger.info(f"[DRY RUN] Would skip {target_key} (unchanged)")
-                else:
-                    logger.info(f"Skipped: {target_key} (unchanged)")
-                return True
-        except ClientError as e:
-            # If 404, object doesn't exist, proceed to upload
-            error_code = e.response.get("Error", {}).get("Code")
-            if error_code != "404" and error_code != "NotFound":
-                logger.warning(f"Could not check existence of {target_key}: {e}")
-                # Proceed to upload if unrelated error
-
         if dry_run:
             logger.info(f"[DRY RUN] Would upload {file_path.name} to {target_key} in {bucket_name}")
             return True
@@ -115,30 +158,55 @@ def upload_file(
         return False
 
 
+def list_remote_etags(client: object, bucket_name: str) -> dict[str, str]:
+    """Return the ETag of every object in the bucket by key, listing up to 1000 per request."""
+    # client is explicitly typed as object to avoid ANN401
+    paginator = client.get_paginator("list_objects_v2")  # type: ignore
+    etags = {}
+    requests = 0
+    for page in paginator.paginate(Bucket=bucket_name):
+        requests += 1
+        for obj in page.get("Contents", []):
+            etags[obj["Key"]] = obj["ETag"].strip('"')
+    logger.info(f"Listed {len(etags)} objects in {bucket_name} ({requests} requests)")
+    return etags
+
+
+def select_changed_files(
+    files_to_upload: list[dict],
+    remote_etags: dict[str, str],
+    md5_cache: Md5Cache,
+    max_workers: int,
+) -> list[dict]:
+    """Return the files that are not in the bucket, or whose MD5 differs from their ETag."""
+
+    def is_changed(item: dict) -> bool:
+        remote_etag = remote_etags.get(item["key"])
+        return remote_etag is None or md5_cache.md5(item["path"]) != remote_etag
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        changed = [
+            item
+            for item, is_new in zip(
+                files_to_upload, executor.map(is_changed, files_to_upload), strict=True
+            )
+            if is_new
+        ]
+    logger.info(
+        f"{len(changed)} of {len(files_to_upload)} files are new or changed "
+        f"(skipping {len(files_to_upload) - len(changed)} unchanged, "
+        f"{md5_cache.hits} MD5s from cache)"
+    )
+    return changed
+
+
 def load_allowed_work_ids(csv_path: Path) -> set[str]:
     """Load work IDs that have no copyright (flag is 'なし')."""
-    allowed_ids = set()
     if not csv_path.exists():
         logger.error(f"CSV file not found: {csv_path}")
         return set()
 
-    with open(csv_path, encoding="utf-8") as f:
-        reader = csv.reader(f)
-        try:
-            next(reader)  # Skip header
-        except StopIteration:
-            return set()
-
-        for row in reader:
-            if len(row) <= 10:
-                continue
-
-            work_id = row[0]
-            copyright_flag = row[10]
-
-            if copyright_flag == "なし":
-                allowed_ids.add(work_id)
-
+    allowed_ids = Catalog.load(csv_path).copyright_free_book_ids()
     logger.info(f"Loaded {len(allowed_ids)} copyright-free work IDs")
     return allowed_ids
 
@@ -251,8 +319,8 @@ def run_concurrent_uploads(
     bucket_name: str,
     max_workers: int,
     dry_run: bool,
-):
-    """Upload files concurrently.
+) -> int:
+    """Upload files concurrently and return the number of failures.
 
     files_to_upload: List of dicts with 'path', 'key', 'content_type'
     """
@@ -281,6 +349,33 @@ def run_concurrent_uploads(
 
     logger.info("Upload processing complete.")
     logger.info(f"Success: {success_count}, Failures: {failure_count}")
+    return failure_count
+
+
+def upload_catalog_manifest(
+    client: object,
+    bucket_name: str,
+    remote_etags: dict[str, str],
+    complete: bool,
+    dry_run: bool,
+):
+    """Upload the catalog manifest if it changed, once every file its index refers to is."""
+    if not CATALOG_MANIFEST.exists():
+        return
+    if not complete:
+        logger.warning("Not all catalog files are uploaded; keeping the current manifest.")
+        return
+    if calculate_md5(CATALOG_MANIFEST) == remote_etags.get(CATALOG_MANIFEST_KEY):
+        logger.info(f"Skipped: {CATALOG_MANIFEST_KEY} (unchanged)")
+        return
+    upload_file(
+        client,
+        CATALOG_MANIFEST,
+        bucket_name,
+        CATALOG_MANIFEST_KEY,
+        "application/json; charset=utf-8",
+        dry_run,
+    )
 
 
 def parse_args():
@@ -302,6 +397,9 @@ def parse_args():
     )
     parser.add_argument("--html-only", action="store_true", help="Only upload HTML files")
     parser.add_argument("--css-only", action="store_true", help="Only upload CSS files")
+    parser.add_argument(
+        "--catalog-only", action="store_true", help="Only upload the exported catalog JSON"
+    )
     return parser.parse_args()
 
 
@@ -350,7 +448,9 @@ def main():
     if args.html_only:
         upload_configs = [c for c in UPLOAD_CONFIGS if c[0] == "utf-8_html"]
     elif args.css_only:
-        upload_configs = [c for c in UPLOAD_CONFIGS if c[0] == "css"]
+        upload_configs = [c for c in UPLOAD_CONFIGS if c[4] == "css/"]
+    elif args.catalog_only:
+        upload_configs = [c for c in UPLOAD_CONFIGS if c[0] == "catalog_json"]
 
     if not upload_configs:
         logger.warning("No configuration found/enabled.")
@@ -358,12 +458,25 @@ def main():
 
     all_files_to_upload = collect_files_to_upload(upload_configs, allowed_ids)
 
+    # One listing of the bucket decides every upload, instead of a HEAD request per file
+    remote_etags = list_remote_etags(client, R2_BUCKET_NAME)
+    md5_cache = Md5Cache(MD5_CACHE)
+    changed_files = select_changed_files(all_files_to_upload, remote_etags, md5_cache, MAX_WORKERS)
+    md5_cache.save()
+
+    limited = bool(args.limit) and len(changed_files) > args.limit
     if args.limit:
-        all_files_to_upload = all_files_to_upload[: args.limit]
+        changed_files = changed_files[: args.limit]
         logger.info(f"Limiting to {args.limit} files")
 
     # Run uploads
-    run_concurrent_uploads(client, all_files_to_upload, R2_BUCKET_NAME, MAX_WORKERS, args.dry_run)
+    failures = run_concurrent_uploads(
+        client, changed_files, R2_BUCKET_NAME, MAX_WORKERS, args.dry_run
+    )
+
+    if any(c[0] == "catalog_json" for c in upload_configs):
+        complete = not failures and not limited
+        upload_catalog_manifest(client, R2_BUCKET_NAME, remote_etags, complete, args.dry_run)
 
 
 if __name__ == "__main__":
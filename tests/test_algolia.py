@@ -0,0 +1,151 @@
+import threading
+import time
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from algoliasearch.search.client import SearchClientSync
+
+from aozora_data.algolia import indexer as algolia_indexer
+from aozora_data.algolia.indexer import REINDEX_SUFFIX, AlgoliaIndexer
+from aozora_data.algolia.reindex import reindex_catalog
+from aozora_data.catalog import Catalog
+from aozora_data.db.memory import MemoryStorage
+from aozora_data.importer.csv_importer import algolia_changes, algolia_records
+from aozora_data.importer.fingerprints import FingerprintStore
+
+
+class StubClient:
+    """Just enough of SearchClientSync, with indexes kept in memory."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.indexes: dict[str, dict] = {}
+        self.requests: list[tuple[str, str, int]] = []
+        self.waited: list[tuple[str, int]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_index: str | None = None
+
+    def _task(self) -> SimpleNamespace:
+        self.requests.append(("", "", 0))
+        return SimpleNamespace(task_id=len(self.requests))
+
+    def _index(self, index_name: str) -> dict:
+        return self.indexes.setdefault(index_name, {"objects": {}, "settings": {}})
+
+    def batch(self, index_name: str, batch_write_params: dict) -> SimpleNamespace:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        requests = batch_write_params["requests"]
+        with self.lock:
+            self.in_flight -= 1
+            if index_name == self.fail_index:
+                raise RuntimeError("batch failed")
+            objects = self._index(index_name)["objects"]
+            for request in requests:
+                body = request["body"]
+                if request["action"] == "deleteObject":
+                    objects.pop(body["objectID"], None)
+                else:
+                    objects[body["objectID"]] = body
+            self.requests.append((index_name, requests[0]["action"], len(requests)))
+            return SimpleNamespace(task_id=len(self.requests))
+
+    def wait_for_task(self, index_name: str, task_id: int) -> None:
+        self.waited.append((index_name, task_id))
+
+    def index_exists(self, index_name: str) -> bool:
+        return index_name in self.indexes
+
+    def operation_index(self, index_name: str, operation_index_params: dict) -> SimpleNamespace:
+        source = self.indexes[index_name]
+        destination = operation_index_params["destination"]
+        if operation_index_params["operation"] == "copy":
+            assert operation_index_params["scope"] == ["settings", "synonyms", "rules"]
+            self.indexes[destination] = {"objects": {}, "settings": dict(source["settings"])}
+        else:
+            self.indexes[destination] = self.indexes.pop(index_name)
+        return self._task()
+
+    def delete_index(self, index_name: str) -> None:
+        self.indexes.pop(index_name, None)
+
+
+def test_requests_are_chunked_and_concurrent(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(algolia_indexer, "BATCH_SIZE", 2)
+    client = StubClient()
+    indexer = AlgoliaIndexer(client=cast(SearchClientSync, client), max_in_flight=2)
+
+    indexer.index_books([{"objectID": str(i)} for i in range(7)])
+    indexer.update_persons([{"objectID": "1", "last_name": "x"}])
+    indexer.delete_books(["8", "9"])
+    indexer.wait()
+
+    assert sorted(client.requests) == [
+        ("books", "addObject", 1),
+        ("books", "addObject", 2),
+        ("books", "addObject", 2),
+        ("books", "addObject", 2),
+        ("books", "deleteObject", 2),
+        ("persons", "partialUpdateObjectNoCreate", 1),
+    ]
+    assert client.max_in_flight == 2
+    assert sorted(task_id for _, task_id in client.waited) == [1, 2, 3, 4, 5, 6]
+
+    indexer.wait()  # Nothing left to wait for
+    assert len(client.waited) == 6
+
+
+def test_reindex_swaps_in_a_new_index(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(algolia_indexer, "BATCH_SIZE", 3)
+    client = StubClient()
+    client.indexes["books"] = {
+        "objects": {"99999": {"objectID": "99999"}},
+        "settings": {"searchableAttributes": ["title"]},
+    }
+    with open("tests/data/test.csv") as fp:
+        catalog = Catalog.parse(fp)
+
+    reindex_catalog(catalog, AlgoliaIndexer(client=cast(SearchClientSync, client), max_in_flight=2))
+
+    assert set(client.indexes) == {"books", "persons"}
+    assert sorted(client.indexes["books"]["objects"]) == ["10000", "10001", "10002", "10003"]
+    assert client.indexes["books"]["settings"] == {"searchableAttributes": ["title"]}
+    assert len(client.indexes["persons"]["objects"]) == 4
+    # Records only ever went to the temporary indexes
+    assert {index_name for index_name, _, n in client.requests if n} == {
+        f"books{REINDEX_SUFFIX}",
+        f"persons{REINDEX_SUFFIX}",
+    }
+
+
+def test_reindex_resets_fingerprints():
+    with open("tests/data/test.csv") as fp:
+        catalog = Catalog.parse(fp)
+    db = MemoryStorage()
+    # A record Algolia no longer has, and one that differs from what it has
+    db.save_fingerprints("algolia_books", {"99999": "gone", "10000": "stale"})
+
+    reindex_catalog(
+        catalog, AlgoliaIndexer(client=cast(SearchClientSync, StubClient())), ("books",), db
+    )
+
+    assert sorted(db.load_fingerprints("algolia_books")) == ["10000", "10001", "10002", "10003"]
+    assert db.load_fingerprints("algolia_persons") == {}
+    books, _ = algolia_records(catalog, catalog.book_ids(), [])
+    assert algolia_changes("books", books, FingerprintStore(db)) == ([], [])
+
+
+def test_failed_reindex_keeps_the_live_index():
+    client = StubClient()
+    live = {"objects": {"99999": {"objectID": "99999"}}, "settings": {}}
+    client.indexes["books"] = live
+    client.fail_index = f"books{REINDEX_SUFFIX}"
+
+    with pytest.raises(RuntimeError):
+        AlgoliaIndexer(client=cast(SearchClientSync, client)).reindex("books", [{"objectID": "1"}])
+
+    assert client.indexes == {"books": live}
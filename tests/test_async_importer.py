@@ -0,0 +1,194 @@
+import asyncio
+from collections.abc import AsyncIterator
+from typing import cast
+
+import pytest
+from google.cloud import firestore
+
+from aozora_data.catalog import Catalog
+from aozora_data.db.async_firestore import AsyncAozoraFirestore
+from aozora_data.db.memory import MemoryStorage
+from aozora_data.importer import async_importer, csv_importer
+from aozora_data.importer.async_importer import ALGOLIA_MAX_IN_FLIGHT, import_catalog_async
+from aozora_data.importer.csv_importer import import_catalog
+
+
+def _merge(target: dict, data: dict) -> None:
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class FakeSnapshot:
+    def __init__(self, data: dict | None) -> None:
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> dict | None:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeRef:
+    def __init__(self, client: "FakeAsyncClient", collection: str, doc_id: str) -> None:
+        self.client = client
+        self.key = (collection, doc_id)
+
+    async def get(self) -> FakeSnapshot:
+        return FakeSnapshot(self.client.documents.get(self.key))
+
+    async def set(self, data: dict, merge: bool | list = False) -> None:
+        self.client.apply(self, data, merge)
+
+
+class FakeCollection:
+    def __init__(self, client: "FakeAsyncClient", name: str) -> None:
+        self.client = client
+        self.name = name
+
+    def document(self, doc_id: str) -> FakeRef:
+        return FakeRef(self.client, self.name, doc_id)
+
+
+class FakeAsyncBatch:
+    def __init__(self, client: "FakeAsyncClient") -> None:
+        self.client = client
+        self.ops: list[tuple[FakeRef, dict | None, bool | list]] = []
+
+    def set(self, ref: FakeRef, data: dict, merge: bool | list = False) -> None:
+        self.ops.append((ref, data, merge))
+
+    def delete(self, ref: FakeRef) -> None:
+        self.ops.append((ref, None, False))
+
+    async def commit(self) -> None:
+        self.client.in_flight += 1
+        self.client.max_in_flight = max(self.client.max_in_flight, self.client.in_flight)
+        await asyncio.sleep(0.001)
+        self.client.in_flight -= 1
+        for ref, data, merge in self.ops:
+            self.client.apply(ref, data, merge)
+        self.client.commits += 1
+
+
+class FakeAsyncClient:
+    def __init__(self) -> None:
+        self.documents: dict[tuple[str, str], dict] = {}
+        self.commits = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+
+    def apply(self, ref: FakeRef, data: dict | None, merge: bool | list) -> None:
+        if data is None:
+            self.documents.pop(ref.key, None)
+        elif merge:
+            _merge(self.documents.setdefault(ref.key, {}), data)
+        else:
+            self.documents[ref.key] = dict(data)
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def batch(self) -> FakeAsyncBatch:
+        return FakeAsyncBatch(self)
+
+    async def get_all(self, refs: list[FakeRef]) -> AsyncIterator[FakeSnapshot]:
+        for ref in refs:
+            yield await ref.get()
+
+    def close(self) -> None:
+        self.closed = True
+
+    def collection_documents(self, collection: str) -> dict[str, dict]:
+        return {doc_id: data for (c, doc_id), data in self.documents.items() if c == collection}
+
+
+class FakeIndexer:
+    def __init__(self) -> None:
+        self.saved: dict[str, list[str]] = {"books": [], "persons": []}
+        self.updated: dict[str, list[dict]] = {"books": [], "persons": []}
+        self.deleted: dict[str, list[str]] = {"books": [], "persons": []}
+        self.tasks = 0
+        self.waited: list[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def save(self, index_name: str, records: list[dict]) -> int:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        self.saved[index_name] += [r["objectID"] for r in records]
+        self.tasks += 1
+        return self.tasks
+
+    async def update(self, index_name: str, records: list[dict]) -> int:
+        self.updated[index_name] += records
+        self.tasks += 1
+        return self.tasks
+
+    async def delete(self, index_name: str, object_ids: list[str]) -> int:
+        self.deleted[index_name] += object_ids
+        self.tasks += 1
+        return self.tasks
+
+    async def wait_for_task(self, index_name: str, task_id: int) -> None:
+        self.waited.append(task_id)
+
+    async def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def catalog() -> Catalog:
+    with open("tests/data/test.csv") as fp:
+        return Catalog.parse(fp)
+
+
+def _import(client: FakeAsyncClient, catalog: Catalog, full: bool = False) -> None:
+    async def run() -> None:
+        db = AsyncAozoraFirestore(client=cast(firestore.AsyncClient, client), max_in_flight=2)
+        db.BATCH_LIMIT = 2
+        try:
+            await import_catalog_async(catalog, db, full=full)
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_async_import_matches_sync(catalog: Catalog):
+    client = FakeAsyncClient()
+    _import(client, catalog)
+
+    expected = MemoryStorage()
+    import_catalog(catalog, expected)
+    for collection in ("books", "persons", "contributors"):
+        assert client.collection_documents(collection) == expected.documents[collection]
+    state = client.documents["config", "import_state"]
+    assert state["last_modified"] == expected.get_watermark()
+    assert state["checkpoint_0"] is None
+    assert 1 <= client.max_in_flight <= 2
+    assert client.closed
+
+    # Nothing changed: only the import state is written
+    commits = client.commits
+    _import(client, catalog, full=True)
+    assert client.commits == commits
+
+
+def test_async_import_uploads_to_algolia(catalog: Catalog, monkeypatch: pytest.MonkeyPatch):
+    indexer = FakeIndexer()
+    monkeypatch.setattr(async_importer, "_algolia_indexer", lambda: indexer)
+    monkeypatch.setattr(async_importer, "BATCH_SIZE", 1)
+    monkeypatch.setattr(csv_importer, "CHECKPOINT_EVERY", 1)  # Upload as each book is committed
+    _import(FakeAsyncClient(), catalog)
+
+    assert sorted(indexer.saved["books"]) == ["10000", "10001", "10002", "10003"]
+    assert sorted(indexer.saved["persons"]) == ["20000", "20001", "20002", "20003"]
+    assert indexer.max_in_flight <= ALGOLIA_MAX_IN_FLIGHT
+    assert sorted(indexer.waited) == list(range(1, indexer.tasks + 1))
@@ -0,0 +1,79 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from aozora_data.catalog import CACHE_SUFFIX, Catalog
+
+
+def test_parse():
+    with open("tests/data/test.csv", encoding="utf-8-sig") as f:
+        catalog = Catalog.parse(f)
+
+    assert len(catalog) == 4
+    assert list(catalog.book_ids()) == ["10003", "10001", "10000", "10002"]
+    assert catalog.rows_for_book("10001") == [1]
+    assert catalog.rows_for_person("20003") == [0]
+    assert catalog.rows_for_book("99999") == []
+    assert catalog.value(1, "title") == "title_01"
+    assert catalog.book("10001")["person_id"] == "20001"
+    assert catalog.book("99999") is None
+    assert (10001, 20001, 1) in set(catalog.contributors())
+    assert catalog.copyright_free_book_ids() == set()
+
+
+def test_strings_are_shared(tmp_path: Path):
+    path = tmp_path / "catalog.csv"
+    with open("tests/data/test.csv", encoding="utf-8") as f:
+        header, row = f.readline(), f.readline()
+    path.write_text(header + row * 3, encoding="utf-8")
+
+    catalog = Catalog.load(path, use_cache=False)
+    assert len(catalog) == 3
+    assert len(catalog.strings) == len(set(row.rstrip("\n").split(",")))
+    assert catalog.rows_for_book("10003") == [0, 1, 2]
+
+
+def test_load_uses_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    path = tmp_path / "catalog.csv"
+    path.write_bytes(Path("tests/data/test.csv").read_bytes())
+
+    catalog = Catalog.load(path)
+    cache = tmp_path / f"catalog.csv{CACHE_SUFFIX}"
+    assert cache.exists()
+    with monkeypatch.context() as m:
+        m.setattr(Catalog, "parse", None)
+        cached = Catalog.load(path)
+    assert cached.strings == catalog.strings
+    assert cached.columns == catalog.columns
+    assert cached.book_rows == catalog.book_rows
+    assert cached.digest() == catalog.digest()
+
+    # A damaged cache is ignored and rewritten
+    cache.write_bytes(cache.read_bytes()[:-10])
+    assert Catalog.load(path).digest() == catalog.digest()
+    assert Catalog.load(path).digest() == catalog.digest()
+
+    # A changed source invalidates the cache
+    with open("tests/data/test.csv", encoding="utf-8") as f:
+        header = f.readline()
+    path.write_text(header, encoding="utf-8")
+    os.utime(path, ns=(0, 0))
+    assert len(Catalog.load(path)) == 0
+
+
+def test_load_from_unwritable_directory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    path = tmp_path / "catalog.csv"
+    path.write_bytes(Path("tests/data/test.csv").read_bytes())
+    tmp_path.chmod(0o555)
+    if os.access(tmp_path, os.W_OK):  # Permissions do not bind root
+        monkeypatch.setattr(os, "replace", _read_only_replace)
+    try:
+        assert len(Catalog.load(path)) == 4
+    finally:
+        tmp_path.chmod(0o755)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["catalog.csv"]
+
+
+def _read_only_replace(src: str, dst: str) -> None:
+    raise PermissionError(13, "Read-only file system", dst)
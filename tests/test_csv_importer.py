@@ -1,8 +1,17 @@
+import io
+import json
+from pathlib import Path
+from unittest.mock import ANY
+
 import pytest
 from requests_mock import Mocker
 
+from aozora_data.catalog import Catalog
+from aozora_data.db.base import StateUpdate
 from aozora_data.db.firestore import AozoraFirestore
-from aozora_data.importer.csv_importer import import_from_csv, import_from_csv_url
+from aozora_data.importer import csv_importer
+from aozora_data.importer.csv_importer import import_catalog, import_from_csv, import_from_csv_url
+from aozora_data.importer.fingerprints import FingerprintStore
 
 
 class FakeFirestore(AozoraFirestore):
@@ -12,41 +21,118 @@ class FakeFirestore(AozoraFirestore):
         self.batch_count = 0
         self.BATCH_LIMIT = 450
 
-        self.watermark: str | None = None
+        self.import_state: dict = {}
 
         # Memory checks for test assertions
         self.stored_books: dict[str, dict] = {}
         self.stored_persons: dict[str, dict] = {}
         self.stored_contributors: dict[str, dict] = {}  # Map ID -> Data
+        self.stored_person_works: dict[str, dict] = {}
+        self.fingerprints: dict[str, dict[str, str]] = {}
+        self.writes: list[tuple[str, str]] = []  # (collection, doc ID) per write
+        self.field_masks: list[list[str] | None] = []  # Per book / person write
 
     def get_watermark(self) -> str | None:
-        return self.watermark
+        return self.import_state.get("last_modified")
 
     def save_watermark(self, date_str: str) -> None:
-        self.watermark = date_str
+        self.import_state["last_modified"] = date_str
+
+    def get_import_state(self) -> dict:
+        return dict(self.import_state)
+
+    def save_import_state(self, state: dict) -> None:
+        self.import_state.update(state)
+
+    def update_import_state(self, update: StateUpdate) -> bool:
+        changes = update(dict(self.import_state))
+        if changes is None:
+            return False
+        self.import_state.update(changes)
+        return True
+
+    def load_fingerprints(self, collection: str) -> dict[str, str]:
+        return dict(self.fingerprints.get(collection, {}))
+
+    def save_fingerprints(self, collection: str, changes: dict[str, str | None]) -> None:
+        stored = self.fingerprints.setdefault(collection, {})
+        for doc_id, fp in changes.items():
+            if fp is None:
+                stored.pop(doc_id, None)
+            else:
+                stored[doc_id] = fp
 
     def _flush_batch_if_needed(self, force: bool = False) -> None:
         pass
 
-    def upsert_book(self, book_id: str, data: dict):
-        self.stored_books[book_id] = data
+    def upsert_book(self, book_id: str, data: dict, fields: list[str] | None = None):
+        self.writes.append(("books", book_id))
+        self.field_masks.append(fields)
+        if fields is None:
+            self.stored_books[book_id] = data
+        else:
+            self.stored_books[book_id].update({f: data[f] for f in fields})
 
-    def upsert_person(self, person_id: str, data: dict):
-        self.stored_persons[person_id] = data
+    def upsert_person(self, person_id: str, data: dict, fields: list[str] | None = None):
+        self.writes.append(("persons", person_id))
+        self.field_masks.append(fields)
+        if fields is None:
+            self.stored_persons[person_id] = data
+        else:
+            self.stored_persons[person_id].update({f: data[f] for f in fields})
 
     def upsert_contributor(self, contributor_id: str, data: dict):
+        self.writes.append(("contributors", contributor_id))
         self.stored_contributors[contributor_id] = data
 
+    def upsert_person_works(self, person_id: str, data: dict):
+        self.writes.append(("person_works", person_id))
+        self.stored_person_works[person_id] = data
+
     def update_book_author(self, book_id: str, data: dict):
+        self.writes.append(("book_authors", book_id))
         if book_id in self.stored_books:
             self.stored_books[book_id].update(data)
         else:
             self.stored_books[book_id] = data
 
+    def delete(self, collection: str, doc_id: str) -> None:
+        self.writes.append((collection, doc_id))
+        getattr(self, f"stored_{collection}").pop(doc_id, None)
+
     def commit(self):
         pass
 
 
+class RecordingIndexer:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, list]] = []
+
+    def index_books(self, records: list[dict]) -> None:
+        self.calls.append(("index_books", records))
+
+    def index_persons(self, records: list[dict]) -> None:
+        self.calls.append(("index_persons", records))
+
+    def update_books(self, records: list[dict]) -> None:
+        self.calls.append(("update_books", records))
+
+    def update_persons(self, records: list[dict]) -> None:
+        self.calls.append(("update_persons", records))
+
+    def delete_books(self, object_ids: list[str]) -> None:
+        self.calls.append(("delete_books", object_ids))
+
+    def delete_persons(self, object_ids: list[str]) -> None:
+        self.calls.append(("delete_persons", object_ids))
+
+    def wait(self) -> None:
+        pass
+
+    def sent(self) -> dict[str, list]:
+        return {op: items for op, items in self.calls if items}
+
+
 @pytest.fixture()
 def db():
     return FakeFirestore()
@@ -135,3 +221,213 @@ def test_import_from_csv_url_with_limit(db: FakeFirestore, requests_mock: Mocker
         import_from_csv_url(csv_url, db, limit=2)
 
         assert len(db.stored_books) == 2
+
+
+def test_import_from_csv_url_not_modified(db: FakeFirestore, requests_mock: Mocker):
+    csv_url = "http://test.csv.zip"
+    with open("tests/data/test.csv.zip", "rb") as fp:
+        body = fp.read()
+    requests_mock.get(csv_url, content=body, headers={"ETag": '"v1"'})
+    requests_mock.get(csv_url, request_headers={"If-None-Match": '"v1"'}, status_code=304)
+
+    assert import_from_csv_url(csv_url, db)
+    assert db.import_state["catalog_etag"] == '"v1"'
+
+    db.stored_books.clear()
+    assert not import_from_csv_url(csv_url, db)
+    assert db.stored_books == {}
+    assert requests_mock.request_history[-1].headers["If-None-Match"] == '"v1"'
+
+    assert import_from_csv_url(csv_url, db, force=True)
+    assert "If-None-Match" not in requests_mock.request_history[-1].headers
+
+
+def test_import_from_csv_url_same_content(db: FakeFirestore, requests_mock: Mocker):
+    csv_url = "http://test.csv.zip"
+    with open("tests/data/test.csv.zip", "rb") as fp:
+        requests_mock.get(csv_url, content=fp.read())
+
+    assert import_from_csv_url(csv_url, db)
+    db.stored_books.clear()
+
+    assert not import_from_csv_url(csv_url, db)
+    assert db.stored_books == {}
+
+
+def test_import_from_csv_url_with_limit_keeps_catalog_state(db: FakeFirestore, requests_mock: Mocker):
+    csv_url = "http://test.csv.zip"
+    with open("tests/data/test.csv.zip", "rb") as fp:
+        requests_mock.get(csv_url, content=fp.read())
+
+    import_from_csv_url(csv_url, db, limit=2)
+
+    assert "catalog_sha256" not in db.import_state
+
+
+def test_full_import_writes_only_changes(db: FakeFirestore, tmp_path: Path):
+    with open("tests/data/test.csv") as fp:
+        import_from_csv(fp, db, full=True)
+    assert len(db.writes) == 4 * 4  # book, person, contributor and person works per row
+
+    db.writes.clear()
+    with open("tests/data/test.csv") as fp:
+        import_from_csv(fp, db, full=True)
+    assert db.writes == []
+
+    # A person edit that does not bump the book's last_modified
+    changed_csv = tmp_path / "changed.csv"
+    with open("tests/data/test.csv") as fp:
+        changed_csv.write_text(fp.read().replace("first_name_roman_01", "first_name_roman_X"))
+
+    with open(changed_csv) as fp:
+        import_from_csv(fp, db)
+    assert db.writes == []  # Hidden behind the watermark
+
+    with open(changed_csv) as fp:
+        import_from_csv(fp, db, full=True)
+    assert db.writes == [("persons", "20001")]
+    assert db.field_masks[-1] == ["first_name_roman"]
+    assert db.stored_persons["20001"]["first_name_roman"] == "first_name_roman_X"
+
+
+def test_book_written_once_with_scattered_contributors(db: FakeFirestore, tmp_path: Path):
+    # Add a 著者 row for book 10001 after the other books, as the person-grouped catalog does
+    with open("tests/data/test.csv") as fp:
+        lines = fp.read().splitlines()
+    extra = lines[2].replace(",20001,", ",20009,").replace(",翻訳者,", ",著者,")
+    extra = extra.replace("last_name_01", "last_name_09").replace("first_name_01,", "first_name_09,")
+    csv_path = tmp_path / "scattered.csv"
+    csv_path.write_text("\n".join([*lines, extra]) + "\n")
+
+    with open(csv_path) as fp:
+        import_from_csv(fp, db)
+
+    assert db.writes.count(("books", "10001")) == 1
+    assert ("book_authors", "10001") not in db.writes
+    assert db.stored_books["10001"]["author_id"] == 20009
+    assert db.stored_books["10001"]["author_name"] == "last_name_09 first_name_09"
+    assert {"10001-20001-1", "10001-20009-0"} <= set(db.stored_contributors)
+
+
+def test_person_works(db: FakeFirestore, tmp_path: Path):
+    # Person 20001, the translator of 10001, is also the author of 10003
+    with open("tests/data/test.csv") as fp:
+        lines = fp.read().splitlines()
+    csv_path = tmp_path / "person_works.csv"
+    csv_path.write_text("\n".join([*lines, lines[1].replace(",20003,", ",20001,")]) + "\n")
+
+    with open(csv_path) as fp:
+        import_from_csv(fp, db)
+
+    works = db.stored_person_works["20001"]
+    assert [(b["book_id"], b["role"]) for b in works["books"]] == [(10001, 1), (10003, 0)]
+    assert works["book_count"] == 2
+    assert works["role_counts"] == {"0": 1, "1": 1}
+    assert db.stored_person_works["20003"]["book_count"] == 1
+
+
+def test_import_with_snapshot_diff(db: FakeFirestore, tmp_path: Path):
+    snapshot = tmp_path / "snapshot.json.gz"
+    report = tmp_path / "report.json"
+    with open("tests/data/test.csv") as fp:
+        lines = fp.read().splitlines()
+
+    with open("tests/data/test.csv") as fp:
+        import_from_csv(fp, db, snapshot=snapshot, report=report)
+    assert snapshot.exists()
+    assert not report.exists()  # Nothing to diff against on the first run
+
+    # Book 10002 is withdrawn and book 10003 retitled, without touching last_modified
+    changed = [line.replace("title_03,", "title_03b,") for line in lines if "10002" not in line]
+    csv_path = tmp_path / "changed.csv"
+    csv_path.write_text("\n".join(changed) + "\n")
+    db.writes.clear()
+
+    with open(csv_path) as fp:
+        import_from_csv(fp, db, snapshot=snapshot, report=report)
+
+    assert sorted(db.writes) == [
+        ("books", "10002"),
+        ("books", "10003"),
+        ("contributors", "10002-20002-3"),
+        ("person_works", "20002"),
+        ("person_works", "20003"),
+        ("persons", "20002"),
+    ]
+    assert "20002" not in db.stored_person_works
+    assert db.stored_person_works["20003"]["books"][0]["title"] == "title_03b"
+    assert "10002" not in db.stored_books
+    assert db.stored_books["10003"]["title"] == "title_03b"
+    assert "10002" not in db.fingerprints["books"]
+
+    changes = json.loads(report.read_text())
+    assert changes["books"] == {"added": [], "changed": ["10003"], "removed": ["10002"]}
+    assert changes["contributors"]["removed"] == ["10002-20002-3"]
+
+
+def test_resume_after_crash(db: FakeFirestore, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(csv_importer, "CHECKPOINT_EVERY", 1)
+
+    class CrashError(Exception):
+        pass
+
+    upsert_book = db.upsert_book
+
+    def crashing_upsert_book(book_id: str, data: dict, fields: list[str] | None = None) -> None:
+        if len(db.stored_books) == 2:
+            raise CrashError
+        upsert_book(book_id, data, fields)
+
+    monkeypatch.setattr(db, "upsert_book", crashing_upsert_book)
+    with open("tests/data/test.csv") as fp, pytest.raises(CrashError):
+        import_from_csv(fp, db)
+    # A position in the run, however many documents it has written
+    assert db.import_state["checkpoint_0"] == {"run_id": ANY, "books_done": 2}
+    assert db.get_watermark() is None
+
+    monkeypatch.setattr(db, "upsert_book", upsert_book)
+    db.writes.clear()
+    with open("tests/data/test.csv") as fp:
+        import_from_csv(fp, db)
+
+    assert sorted(book_id for kind, book_id in db.writes if kind == "books") == ["10000", "10002"]
+    assert len(db.stored_books) == 4
+    assert db.import_state["checkpoint_0"] is None
+    assert db.get_watermark() is not None
+
+
+def test_changed_fields():
+    store = FingerprintStore(FakeFirestore())
+    book = {"title": "a", "subtitle": "b", "author": "c"}
+
+    assert store.changed_fields("books", "1", book) is None
+    assert store.changed_fields("books", "1", book) == []
+    assert store.changed_fields("books", "1", {**book, "subtitle": "x"}) == ["subtitle"]
+    # A new set of fields is written whole
+    assert store.changed_fields("books", "1", {"title": "a"}) is None
+
+
+def test_algolia_sync_sends_only_changes(db: FakeFirestore, tmp_path: Path):
+    with open("tests/data/test.csv") as fp:
+        lines = fp.read().splitlines()
+    indexer = RecordingIndexer()
+    import_catalog(Catalog.parse(io.StringIO("\n".join(lines))), db, indexer=indexer)
+    assert len(indexer.sent()["index_books"]) == 4
+    assert len(indexer.sent()["index_persons"]) == 4
+
+    # Book 10003 is retitled, a person field Algolia does not index changes, and book 10002
+    # with its only person leaves the catalog (no snapshot, so only Algolia notices)
+    changed = [
+        line.replace("title_03,", "title_03b,").replace("first_name_roman_01", "x")
+        for line in lines
+        if "10002" not in line
+    ]
+    indexer = RecordingIndexer()
+    import_catalog(Catalog.parse(io.StringIO("\n".join(changed))), db, full=True, indexer=indexer)
+
+    assert indexer.sent() == {
+        "update_books": [{"objectID": "10003", "title": "title_03b"}],
+        "delete_books": ["10002"],
+        "delete_persons": ["20002"],
+    }
+    assert "10002" not in db.fingerprints["algolia_books"]
@@ -0,0 +1,292 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+import zipfile
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from aozora_data.catalog import FIELD_NAMES, is_catalog
+from aozora_data.download_all import (
+    DOWNLOADED,
+    FAILED,
+    NOT_MODIFIED,
+    SKIPPED,
+    Downloader,
+    DownloadState,
+    Entry,
+    load_catalog_entries,
+)
+
+
+def make_zip(text: bytes, name: str = "book.txt") -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr(name, text)
+    return buf.getvalue()
+
+
+class BookServer(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), BookHandler)
+        self.files: dict[str, bytes] = {}
+        self.failures: dict[str, int] = {}  # path -> number of 503s before success
+        self.resets: dict[str, int] = {}  # path -> number of bodies cut short before success
+        self.requests: list[str] = []
+        self.delay = 0.0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class BookHandler(BaseHTTPRequestHandler):
+    server: BookServer
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            if server.failures.get(self.path, 0) > 0:
+                server.failures[self.path] -= 1
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = server.files.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if server.resets.get(self.path, 0) > 0:
+                server.resets[self.path] -= 1
+                # Drop the connection halfway through a chunked body
+                self.send_response(200)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                half = body[: len(body) // 2]
+                self.wfile.write(f"{len(half):x}\r\n".encode() + half + b"\r\n")
+                self.close_connection = True
+                return
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture()
+def server() -> Iterator[BookServer]:
+    srv = BookServer()
+    thread = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_download_and_extract(server: BookServer, tmp_path: Path):
+    server.files["/1.zip"] = make_zip(b"\x90\xc2\x8b\xf3")
+    downloader = Downloader(sjis_dir=str(tmp_path))
+
+    stats = downloader.run([Entry("1", f"{server.base_url}/1.zip")])
+
+    assert (tmp_path / "1.sjis.txt").read_bytes() == b"\x90\xc2\x8b\xf3"
+    assert stats.counts[DOWNLOADED] == 1
+
+
+def test_skip_existing_and_non_zip(server: BookServer, tmp_path: Path):
+    (tmp_path / "1.sjis.txt").write_bytes(b"old")
+    downloader = Downloader(sjis_dir=str(tmp_path))
+
+    assert downloader.process_entry(Entry("1", f"{server.base_url}/1.zip")) == SKIPPED
+    assert downloader.process_entry(Entry("2", f"{server.base_url}/2.html")) == SKIPPED
+    assert server.requests == []
+
+
+def test_retry_on_503(server: BookServer, tmp_path: Path):
+    server.files["/1.zip"] = make_zip(b"text")
+    server.failures["/1.zip"] = 2
+    downloader = Downloader(sjis_dir=str(tmp_path), retries=3, backoff=0.001)
+
+    assert downloader.process_entry(Entry("1", f"{server.base_url}/1.zip")) == DOWNLOADED
+    assert server.requests == ["/1.zip"] * 3
+
+
+def test_retry_on_connection_reset_mid_body(server: BookServer, tmp_path: Path):
+    server.files["/1.zip"] = make_zip(b"text")
+    server.resets["/1.zip"] = 2
+    downloader = Downloader(sjis_dir=str(tmp_path), retries=3, backoff=0.001)
+
+    assert downloader.process_entry(Entry("1", f"{server.base_url}/1.zip")) == DOWNLOADED
+    assert (tmp_path / "1.sjis.txt").read_bytes() == b"text"
+    assert server.requests == ["/1.zip"] * 3
+
+
+def test_give_up_after_retries(server: BookServer, tmp_path: Path):
+    server.files["/1.zip"] = make_zip(b"text")
+    server.failures["/1.zip"] = 5
+    downloader = Downloader(sjis_dir=str(tmp_path), retries=1, backoff=0.001)
+
+    assert downloader.process_entry(Entry("1", f"{server.base_url}/1.zip")) == FAILED
+    assert len(server.requests) == 2
+    assert not (tmp_path / "1.sjis.txt").exists()
+
+
+def test_no_retry_on_404(server: BookServer, tmp_path: Path):
+    downloader = Downloader(sjis_dir=str(tmp_path), retries=3, backoff=0.001)
+
+    assert downloader.process_entry(Entry("1", f"{server.base_url}/missing.zip")) == FAILED
+    assert len(server.requests) == 1
+
+
+def test_concurrent_with_per_host_limit(server: BookServer, tmp_path: Path):
+    entries = []
+    for i in range(12):
+        server.files[f"/{i}.zip"] = make_zip(f"text {i}".encode())
+        entries.append(Entry(str(i), f"{server.base_url}/{i}.zip"))
+    server.delay = 0.05
+    downloader = Downloader(sjis_dir=str(tmp_path), workers=6, per_host=2)
+
+    stats = downloader.run(entries)
+
+    assert stats.counts[DOWNLOADED] == 12
+    assert server.max_active <= 2
+    assert (tmp_path / "11.sjis.txt").read_bytes() == b"text 11"
+
+
+def test_conditional_get_not_modified(server: BookServer, tmp_path: Path):
+    url = f"{server.base_url}/1.zip"
+    server.files["/1.zip"] = make_zip(b"text")
+    Downloader(sjis_dir=str(tmp_path)).run([Entry("1", url, "2024-01-01")])
+
+    record = DownloadState(tmp_path / "download_state.json").get("1")
+    assert record is not None
+    assert record["etag"] == f'"{hashlib.md5(server.files["/1.zip"]).hexdigest()}"'
+    assert record["text_last_modified"] == "2024-01-01"
+
+    # Same catalog date: skipped without any request
+    server.requests.clear()
+    downloader = Downloader(sjis_dir=str(tmp_path))
+    assert downloader.process_entry(Entry("1", url, "2024-01-01")) == SKIPPED
+    assert server.requests == []
+
+    # Catalog date moved but content didn't: 304
+    assert downloader.process_entry(Entry("1", url, "2024-02-01")) == NOT_MODIFIED
+    assert server.requests == ["/1.zip"]
+    assert downloader.state.records["1"]["text_last_modified"] == "2024-02-01"
+
+
+def test_conditional_get_refreshes_changed_text(server: BookServer, tmp_path: Path):
+    url = f"{server.base_url}/1.zip"
+    server.files["/1.zip"] = make_zip(b"old text")
+    Downloader(sjis_dir=str(tmp_path)).run([Entry("1", url)])
+
+    server.files["/1.zip"] = make_zip(b"new text")
+    stats = Downloader(sjis_dir=str(tmp_path)).run([Entry("1", url)])
+
+    assert stats.counts[DOWNLOADED] == 1
+    assert (tmp_path / "1.sjis.txt").read_bytes() == b"new text"
+
+
+def test_existing_file_without_metadata(server: BookServer, tmp_path: Path):
+    url = f"{server.base_url}/1.zip"
+    server.files["/1.zip"] = make_zip(b"new text")
+    sjis_path = tmp_path / "1.sjis.txt"
+    sjis_path.write_bytes(b"old text")
+    os.utime(sjis_path, (0, 946684800))  # 2000-01-01
+    downloader = Downloader(sjis_dir=str(tmp_path))
+
+    # Written after the catalog date: adopted without a request
+    assert downloader.process_entry(Entry("1", url, "1999-01-01")) == SKIPPED
+    assert server.requests == []
+
+    # Older than the catalog date: downloaded again
+    downloader.state.records.clear()
+    assert downloader.process_entry(Entry("1", url, "2020-01-01")) == DOWNLOADED
+    assert sjis_path.read_bytes() == b"new text"
+
+
+def write_catalog(path: Path, rows: list[dict[str, str]]) -> None:
+    with open("tests/data/test.csv", encoding="utf-8") as f:
+        header = f.readline()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(header)
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([row.get(name, "") for name in FIELD_NAMES])
+
+
+def test_load_catalog_entries(tmp_path: Path):
+    catalog = tmp_path / "catalog.csv"
+    write_catalog(
+        catalog,
+        [
+            {
+                "book_id": "000001",
+                "person_id": "1",
+                "copyright": "なし",
+                "text_url": "https://example.com/1.zip",
+                "text_last_modified": "2024-01-01",
+            },
+            {
+                "book_id": "000002",
+                "person_id": "1",
+                "copyright": "あり",
+                "text_url": "https://example.com/2.zip",
+                "text_last_modified": "2024-06-01",
+            },
+            {
+                "book_id": "000001",
+                "person_id": "2",
+                "copyright": "なし",
+                "text_url": "https://example.com/1.zip",
+                "text_last_modified": "2024-01-01",
+            },
+            {"book_id": "000003", "person_id": "3", "copyright": "なし", "text_url": ""},
+        ],
+    )
+
+    assert load_catalog_entries(catalog) == [
+        Entry("000001", "https://example.com/1.zip", "2024-01-01"),
+        Entry("000002", "https://example.com/2.zip", "2024-06-01"),
+    ]
+    assert [e.book_id for e in load_catalog_entries(catalog, copyright_free=True)] == ["000001"]
+    assert [e.book_id for e in load_catalog_entries(catalog, since="2024-02-01")] == ["000002"]
+    assert [e.book_id for e in load_catalog_entries(catalog, until="2024-02-01")] == ["000001"]
+    assert [e.book_id for e in load_catalog_entries(catalog, book_ids={2})] == ["000002"]
+
+
+def test_load_catalog_entries_from_zip(tmp_path: Path):
+    path = tmp_path / "test.csv.zip"
+    path.write_bytes(Path("tests/data/test.csv.zip").read_bytes())
+    assert is_catalog(path)
+    entries = load_catalog_entries(path)
+
+    assert [e.book_id for e in entries] == ["10003", "10001", "10000", "10002"]
+    assert entries[0] == Entry("10003", "https://example.com/03.txt", "2020-03-04")
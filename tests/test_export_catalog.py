@@ -0,0 +1,52 @@
+import json
+from pathlib import Path
+
+from aozora_data.catalog import Catalog
+from aozora_data.export_catalog import MANIFEST, export_catalog, shard_name
+
+
+def _catalog(path: Path | str) -> Catalog:
+    with open(path) as fp:
+        return Catalog.parse(fp)
+
+
+def _read(output_dir: Path, name: str) -> dict:
+    return json.loads((output_dir / name).read_text())
+
+
+def test_export(tmp_path: Path):
+    output_dir = tmp_path / "catalog_json"
+    manifest = export_catalog(_catalog("tests/data/test.csv"), output_dir)
+
+    assert manifest["books"] == manifest["persons"] == manifest["authors"] == 4
+    assert _read(output_dir, MANIFEST) == manifest
+    index = _read(output_dir, manifest["index"])
+    book = _read(output_dir, shard_name("books", "10001", index["books"]["10001"]))
+    assert book["book_id"] == 10001
+    assert book["author_id"] == 20001
+    person = _read(output_dir, shard_name("persons", "20001", index["persons"]["20001"]))
+    assert person["person_id"] == 20001
+    works = _read(output_dir, shard_name("authors", "20001", index["authors"]["20001"]))
+    assert [b["book_id"] for b in works["books"]] == [10001]
+    assert works["books"][0]["role"] == 1  # 翻訳者
+
+
+def test_export_is_incremental(tmp_path: Path):
+    output_dir = tmp_path / "catalog_json"
+    first = export_catalog(_catalog("tests/data/test.csv"), output_dir)
+    files = {p.name: p.stat().st_mtime_ns for p in output_dir.iterdir()}
+
+    assert export_catalog(_catalog("tests/data/test.csv"), output_dir) == first
+    assert {p.name: p.stat().st_mtime_ns for p in output_dir.iterdir()} == files
+
+    changed_csv = tmp_path / "changed.csv"
+    changed_csv.write_text(
+        Path("tests/data/test.csv").read_text().replace("first_name_roman_01", "first_name_roman_X")
+    )
+    second = export_catalog(_catalog(changed_csv), output_dir, prune=True)
+    new_files = {p.name for p in output_dir.iterdir()} - set(files)
+    # The person and the new index; the person's books are unchanged
+    assert len(new_files) == 2
+    assert second["index"] in new_files
+    assert not (output_dir / first["index"]).exists()
+    assert len(list(output_dir.iterdir())) == len(files)
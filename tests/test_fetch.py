@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import io
+import zipfile
+from pathlib import Path
+
+import aiohttp
+import pytest
+from aiohttp import web
+from requests_mock import Mocker
+
+from aozora_data.fetch import IncompleteDownloadError, extract_member, fetch, fetch_async
+
+
+def test_fetch_spools_body(requests_mock: Mocker):
+    body = b"x" * 10000
+    requests_mock.get("http://example.com/a.zip", content=body, headers={"ETag": '"abc"'})
+
+    with fetch("http://example.com/a.zip", threshold=1024) as download:
+        assert download.status_code == 200
+        assert download.headers["ETag"] == '"abc"'
+        assert download.size == len(body)
+        assert download.sha256 == hashlib.sha256(body).hexdigest()
+        assert download.file.read() == body
+
+
+def test_fetch_length_mismatch(requests_mock: Mocker):
+    requests_mock.get("http://example.com/a.zip", content=b"short", headers={"Content-Length": "100"})
+
+    with pytest.raises(IncompleteDownloadError):
+        fetch("http://example.com/a.zip")
+
+
+def test_fetch_async_spools_body():
+    body = b"x" * 10000
+
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(body=body, headers={"ETag": '"abc"'})
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/a.zip", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                url = f"http://127.0.0.1:{port}/a.zip"
+                with await fetch_async(url, session, threshold=1024, chunk_size=1000) as download:
+                    assert download.status_code == 200
+                    assert download.headers["ETag"] == '"abc"'
+                    assert download.size == len(body)
+                    assert download.sha256 == hashlib.sha256(body).hexdigest()
+                    assert download.file.read() == body
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_extract_member(tmp_path: Path):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("book.txt", b"abc" * 1000)
+    dest = tmp_path / "book.sjis.txt"
+
+    with zipfile.ZipFile(buf) as z:
+        assert extract_member(z, "book.txt", dest, chunk_size=16) == 3000
+
+    assert dest.read_bytes() == b"abc" * 1000
+    assert not (tmp_path / "book.sjis.txt.part").exists()
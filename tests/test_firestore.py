@@ -0,0 +1,225 @@
+import threading
+import time
+from collections.abc import Callable
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from google.api_core import exceptions as gexc
+from google.cloud import firestore
+
+from aozora_data.db import firestore as firestore_module
+from aozora_data.db.firestore import WRITER_BULK, WRITER_PARALLEL, AozoraFirestore
+
+
+class FakeBatch:
+    def __init__(self, client: "FakeClient") -> None:
+        self.client = client
+        self.writes: list[tuple[str, dict, bool]] = []
+
+    def set(self, ref: str, data: dict, merge: bool = False) -> None:
+        self.writes.append((ref, data, merge))
+
+    def commit(self) -> None:
+        self.client.begin()
+        try:
+            time.sleep(0.01)
+            if self.client.failures > 0:
+                self.client.failures -= 1
+                raise gexc.ServiceUnavailable("try again")
+            self.client.committed.extend(self.writes)
+        finally:
+            self.client.end()
+
+
+class FakeDocument(str):
+    """A document reference that compares equal to its path, and reads and writes directly."""
+
+    client: "FakeClient"
+
+    @property
+    def id(self) -> str:
+        return self.rsplit("/", 1)[1]
+
+    def get(self) -> SimpleNamespace:
+        data = self.client.docs.get(self)
+        return SimpleNamespace(id=self.id, exists=data is not None, get=(data or {}).get)
+
+    def set(self, data: dict) -> None:
+        self.client.docs[self] = data
+
+    def delete(self) -> None:
+        self.client.docs.pop(self, None)
+
+
+class FakeCollection:
+    def __init__(self, client: "FakeClient", name: str) -> None:
+        self.client = client
+        self.name = name
+
+    def document(self, doc_id: str) -> FakeDocument:
+        ref = FakeDocument(f"{self.name}/{doc_id}")
+        ref.client = self.client
+        return ref
+
+
+class FakeBulkWriter:
+    def __init__(self, failures: dict[str, int]) -> None:
+        self.failures = failures  # path -> number of failed attempts
+        self.queued: list[tuple[str, str, dict | None, bool | list[str]]] = []
+        self.written: list[tuple[str, str, dict | None, bool | list[str]]] = []
+        self.on_error: Callable[[SimpleNamespace, FakeBulkWriter], bool] | None = None
+        self.closed = False
+
+    def on_write_error(self, callback: Callable[[SimpleNamespace, "FakeBulkWriter"], bool]) -> None:
+        self.on_error = callback
+
+    def set(self, ref: str, data: dict, merge: bool | list[str] = False) -> None:
+        self.queued.append(("set", ref, data, merge))
+
+    def delete(self, ref: str) -> None:
+        self.queued.append(("delete", ref, None, False))
+
+    def flush(self) -> None:
+        assert self.on_error is not None
+        queued, self.queued = self.queued, []
+        for op in queued:
+            attempts = 0
+            while self.failures.get(op[1], 0) > attempts:
+                attempts += 1
+                error = SimpleNamespace(
+                    attempts=attempts,
+                    operation=SimpleNamespace(reference=SimpleNamespace(path=op[1])),
+                    message="unavailable",
+                )
+                if not self.on_error(error, self):
+                    break
+            else:
+                self.written.append(op)
+
+    def close(self) -> None:
+        self.flush()
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, failures: int = 0, bulk_failures: dict[str, int] | None = None) -> None:
+        self.failures = failures
+        self.committed: list[tuple[str, dict, bool]] = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.bulk = FakeBulkWriter(bulk_failures or {})
+        self.docs: dict[str, dict] = {}
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def bulk_writer(self, options: object) -> FakeBulkWriter:
+        return self.bulk
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def get_all(self, refs: list[FakeDocument]) -> list[SimpleNamespace]:
+        return [ref.get() for ref in reversed(refs)]
+
+    def begin(self) -> None:
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def end(self) -> None:
+        with self.lock:
+            self.active -= 1
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(firestore_module, "RETRY_BACKOFF", 0)
+
+
+def test_parallel_commits_are_bounded():
+    client = FakeClient()
+    db = AozoraFirestore(client=client, writer=WRITER_PARALLEL, max_in_flight=2)
+    db.BATCH_LIMIT = 2
+    for i in range(20):
+        db.upsert_book(f"{i:06d}", {"title": str(i)})
+    db.close()
+
+    assert len(client.committed) == 20
+    assert client.max_active == 2
+
+
+def test_commit_retries_transient_errors():
+    client = FakeClient(failures=2)
+    db = AozoraFirestore(client=client)
+    db.upsert_person("000001", {"last_name": "夏目"})
+    db.commit()
+
+    assert client.committed == [("persons/000001", {"last_name": "夏目"}, True)]
+
+
+def test_commit_raises_after_retries():
+    client = FakeClient(failures=10)
+    db = AozoraFirestore(client=client, writer=WRITER_PARALLEL, max_retries=1)
+    db.upsert_person("000001", {"last_name": "夏目"})
+
+    with pytest.raises(gexc.ServiceUnavailable):
+        db.close()
+    assert client.committed == []
+
+
+def test_bulk_writer():
+    client = FakeClient(bulk_failures={"persons/000002": 2})
+    db = AozoraFirestore(client=client, writer=WRITER_BULK, max_retries=3)
+    db.upsert_book("000001", {"title": "こころ", "author_name": "夏目"}, fields=["title"])
+    db.upsert_person("000002", {"last_name": "夏目"})
+    db.delete("contributors", "000003")
+    db.close()
+
+    assert client.committed == []
+    assert client.bulk.written == [
+        ("set", "books/000001", {"title": "こころ"}, ["title"]),
+        ("set", "persons/000002", {"last_name": "夏目"}, True),
+        ("delete", "contributors/000003", None, False),
+    ]
+    assert client.bulk.closed
+
+
+def test_bulk_writer_raises_failed_writes():
+    client = FakeClient(bulk_failures={"persons/000002": 10})
+    db = AozoraFirestore(client=client, writer=WRITER_BULK, max_retries=2)
+    db.upsert_person("000001", {"last_name": "森"})
+    db.upsert_person("000002", {"last_name": "夏目"})
+
+    with pytest.raises(RuntimeError, match="1 write"):
+        db.commit()
+    assert [op[1] for op in client.bulk.written] == ["persons/000001"]
+
+    # Failures are reported once; later writes go through
+    db.upsert_person("000003", {"last_name": "芥川"})
+    db.close()
+    assert client.bulk.closed
+    assert [op[1] for op in client.bulk.written] == ["persons/000001", "persons/000003"]
+
+
+def test_catalog_snapshot_parts(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(firestore_module, "SNAPSHOT_PART_BYTES", 4)
+    client = FakeClient()
+    db = AozoraFirestore(client=cast(firestore.Client, client))
+    assert db.load_catalog_snapshot() is None
+
+    db.save_catalog_snapshot(b"first snapshot")
+    assert db.load_catalog_snapshot() == b"first snapshot"
+    assert len(client.docs) == 1 + 4
+
+    db.save_catalog_snapshot(b"second")
+    assert db.load_catalog_snapshot() == b"second"
+    # The parts of the first snapshot are gone
+    assert len(client.docs) == 1 + 2
+
+
+def test_unknown_writer():
+    with pytest.raises(ValueError):
+        AozoraFirestore(client=FakeClient(), writer="serial")
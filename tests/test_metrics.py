@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+from aozora_data.metrics import Histogram, Metrics
+
+
+def test_histogram():
+    h = Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 0.5, 3.0):
+        h.observe(value)
+
+    assert h.quantile(0.5) == 0.1
+    assert h.quantile(1.0) == 3.0
+    summary = h.summary()
+    assert summary["count"] == 5
+    assert summary["max"] == 3.0
+    assert summary["buckets"] == {"le_0.01": 1, "le_0.1": 2, "le_1": 1, "le_inf": 1}
+
+
+def test_metrics_summary():
+    m = Metrics()
+    with m.phase("process"):
+        m.count("rows.processed", 10)
+    with m.phase("process"):
+        m.count("writes.books")
+    m.observe("commit_seconds", 0.02)
+
+    summary = m.summary()
+    assert set(summary["phases_seconds"]) == {"process"}
+    assert summary["counters"] == {"rows.processed": 10, "writes.books": 1}
+    assert summary["rows_per_second"] > 0
+    assert summary["histograms"]["commit_seconds"]["count"] == 1
+
+    m.reset()
+    assert m.summary()["counters"] == {}
+
+
+def test_nested_phases_do_not_overlap(monkeypatch: pytest.MonkeyPatch):
+    # Each clock read is one second later
+    clock = iter(range(100))
+    monkeypatch.setattr(time, "perf_counter", lambda: next(clock))
+    m = Metrics()
+    with m.phase("process"):
+        with m.phase("map"):
+            pass
+        with m.phase("commit"), m.phase("commit"):
+            pass
+
+    assert m.summary()["phases_seconds"] == {"process": 3, "map": 1, "commit": 3}
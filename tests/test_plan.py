@@ -0,0 +1,157 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from aozora_data.catalog import Catalog
+from aozora_data.db.memory import MemoryStorage
+from aozora_data.db.sqlite import SqliteStorage
+from aozora_data.importer.csv_importer import import_catalog
+from aozora_data.importer.main import main
+from aozora_data.importer.plan import WritePlan, apply_plan, load_plan
+
+
+class RecordingIndexer:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, int]] = []
+
+    def index_books(self, records: list[dict]) -> None:
+        self.calls.append(("index_books", len(records)))
+
+    def index_persons(self, records: list[dict]) -> None:
+        self.calls.append(("index_persons", len(records)))
+
+    def update_books(self, records: list[dict]) -> None:
+        self.calls.append(("update_books", len(records)))
+
+    def update_persons(self, records: list[dict]) -> None:
+        self.calls.append(("update_persons", len(records)))
+
+    def delete_books(self, object_ids: list[str]) -> None:
+        self.calls.append(("delete_books", len(object_ids)))
+
+    def delete_persons(self, object_ids: list[str]) -> None:
+        self.calls.append(("delete_persons", len(object_ids)))
+
+    def wait(self) -> None:
+        self.calls.append(("wait", 0))
+
+
+@pytest.fixture
+def catalog() -> Catalog:
+    with open("tests/data/test.csv") as fp:
+        return Catalog.parse(fp)
+
+
+def test_plan_then_apply(catalog: Catalog):
+    db = MemoryStorage()
+    plan = WritePlan(db, batch_limit=5)
+    import_catalog(catalog, plan, indexer=plan)
+
+    assert db.documents == {} and db.import_state == {}
+    summary = plan.summary()
+    for collection in ("books", "persons", "contributors", "person_works"):
+        assert plan.collections[collection]["writes"] == 4
+        assert plan.collections[collection]["known"] == 0
+    assert plan.algolia["books"]["saves"] == 4
+    assert summary["algolia"]["operations"] == 8
+    assert all(batch["operations"] <= 5 for batch in plan.batches)
+    # Everything but the import state goes through batches
+    batched = summary["firestore"]["writes"] - plan.collections["config"]["writes"]
+    assert sum(batch["operations"] for batch in plan.batches) == batched
+    assert summary["estimated_cost_usd"]["firestore"] > 0
+
+    indexer = RecordingIndexer()
+    apply_plan(json.loads(json.dumps(plan.to_dict())), db, indexer)
+    expected = MemoryStorage()
+    import_catalog(catalog, expected)
+    assert db.documents == expected.documents
+    assert db.get_watermark() == expected.get_watermark()
+    assert ("index_books", 4) in indexer.calls
+    assert indexer.calls[-1] == ("wait", 0)
+
+    # Once applied, the same import has nothing left to write
+    plan = WritePlan(db)
+    import_catalog(catalog, plan, full=True, indexer=plan)
+    assert {c: s["writes"] for c, s in plan.collections.items() if c != "config"} == {
+        "books": 0,
+        "persons": 0,
+        "contributors": 0,
+        "person_works": 0,
+        "algolia_books": 0,
+        "algolia_persons": 0,
+    }
+    assert plan.collections["books"]["known"] == 4
+    assert plan.collections["algolia_books"]["known"] == 4
+
+
+def test_apply_without_indexer_leaves_algolia_unsent(catalog: Catalog):
+    db = MemoryStorage()
+    plan = WritePlan(db)
+    import_catalog(catalog, plan, indexer=plan)
+
+    apply_plan(plan.to_dict(), db)
+    assert len(db.load_fingerprints("books")) == 4
+    assert db.load_fingerprints("algolia_books") == {}
+    assert db.load_fingerprints("algolia_persons") == {}
+
+
+def test_stale_plan_is_refused(catalog: Catalog):
+    db = MemoryStorage()
+    plan = WritePlan(db)
+    import_catalog(catalog, plan, indexer=plan)
+    db.save_import_state({"catalog_sha256": "other"})
+
+    with pytest.raises(ValueError, match="changed since the plan"):
+        apply_plan(plan.to_dict(), db)
+
+
+def test_main_plan(tmp_path: Path):
+    path = tmp_path / "aozora.db"
+    csv_path = tmp_path / "test.csv.zip"
+    csv_path.write_bytes(Path("tests/data/test.csv.zip").read_bytes())
+    snapshot = tmp_path / "snapshot.json.gz"
+    plan_path = tmp_path / "plan.json"
+    backend = ("--backend", "sqlite", "--path", str(path))
+
+    main([*backend, "--csv", str(csv_path), "--snapshot", str(snapshot), "--plan", str(plan_path)])
+
+    db = SqliteStorage(path)
+    assert db.get_document("books", "10001") is None
+    assert db.get_import_state() == {}
+    db.close()
+    assert not snapshot.exists()
+    assert load_plan(plan_path)["summary"]["firestore"]["writes"] > 12
+
+    main([*backend, "--snapshot", str(snapshot), "--apply-plan", str(plan_path)])
+
+    db = SqliteStorage(path)
+    book = db.get_document("books", "10001")
+    assert book is not None and book["book_id"] == 10001
+    assert db.get_watermark() is not None
+    db.close()
+    assert snapshot.exists()
+
+
+def test_main_plan_snapshot_in_storage(tmp_path: Path):
+    path = tmp_path / "aozora.db"
+    csv_path = tmp_path / "test.csv"
+    csv_path.write_bytes(Path("tests/data/test.csv").read_bytes())
+    plan_path = tmp_path / "plan.json"
+    backend = ("--backend", "sqlite", "--path", str(path), "--snapshot", "storage")
+
+    main([*backend, "--csv", str(csv_path), "--plan", str(plan_path)])
+
+    db = SqliteStorage(path)
+    assert db.load_catalog_snapshot() is None
+    db.close()
+    snapshot = load_plan(plan_path)["snapshot"]
+    assert snapshot["path"] == "storage"
+    planned = Path(snapshot["planned"]).read_bytes()
+
+    main([*backend, "--apply-plan", str(plan_path)])
+
+    db = SqliteStorage(path)
+    assert db.load_catalog_snapshot() == planned
+    db.close()
+    assert not Path(snapshot["planned"]).exists()
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import pytest
+
+from aozora_data.catalog import Catalog
+from aozora_data.importer.csv_importer import algolia_records
+from aozora_data.search_index import SearchIndex, build_index, normalize, write_index
+
+BOOKS = [
+    {
+        "objectID": "789",
+        "title": "吾輩は猫である",
+        "title_yomi": "わがはいはねこである",
+        "author_name": "夏目 漱石",
+    },
+    {
+        "objectID": "752",
+        "title": "坊っちゃん",
+        "title_yomi": "ぼっちゃん",
+        "author_name": "夏目 漱石",
+    },
+    {
+        "objectID": "1567",
+        "title": "走れメロス",
+        "title_yomi": "はしれめろす",
+        "author_name": "太宰 治",
+    },
+]
+PERSONS = [
+    {
+        "objectID": "148",
+        "last_name": "夏目",
+        "first_name": "漱石",
+        "last_name_yomi": "なつめ",
+        "first_name_yomi": "そうせき",
+    },
+]
+
+
+@pytest.fixture
+def index() -> SearchIndex:
+    return SearchIndex(build_index(BOOKS, PERSONS))
+
+
+def _ids(hits: list) -> list[tuple[str, str]]:
+    return [(hit.index_name, hit.record["objectID"]) for hit in hits]
+
+
+def test_normalize():
+    assert normalize("ワガハイ") == "わがはい"
+    assert normalize("ﾒﾛｽ") == "めろす"
+    assert normalize("夏目　漱石") == "夏目漱石"
+    assert normalize("\uff21\uff22\uff23") == "abc"
+
+
+def test_search(index: SearchIndex):
+    assert len(index) == 4
+    assert _ids(index.search("ネコ")) == [("books", "789")]
+    assert _ids(index.search("メロス")) == [("books", "1567")]
+    # Equally good matches come in build order
+    assert _ids(index.search("夏目漱石")) == [("books", "789"), ("books", "752"), ("persons", "148")]
+    assert _ids(index.search("なつめ")) == [("persons", "148")]
+    # A match at the start of a field first
+    assert _ids(index.search("は", limit=1)) == [("books", "1567")]
+    assert index.search("") == []
+    assert index.search("存在しない") == []
+
+
+def test_prefix_search(index: SearchIndex):
+    assert _ids(index.search("わがはい", prefix=True)) == [("books", "789")]
+    assert index.search("ねこ", prefix=True) == []
+    assert _ids(index.search("は", prefix=True)) == [("books", "1567")]
+    assert len(index.search("は")) == 2
+
+
+def test_file_is_mapped(tmp_path: Path):
+    with open("tests/data/test.csv") as fp:
+        catalog = Catalog.parse(fp)
+    books, persons = algolia_records(catalog, catalog.book_ids(), catalog.person_rows)
+    path = tmp_path / "search_index.bin"
+    write_index(path, books.values(), persons.values())
+
+    with SearchIndex.open(path) as index:
+        assert len(index) == 8
+        hits = index.search("TITLE_YOMI_01")
+        assert _ids(hits) == [("books", "10001")]
+        assert hits[0].record == books["10001"]
+        assert len(index.search("title_", prefix=True)) == 4
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+from aozora_data.db.memory import MemoryStorage
+from aozora_data.importer.snapshot import (
+    Snapshot,
+    SnapshotBuffer,
+    diff_snapshots,
+    load_snapshot,
+    save_snapshot,
+)
+
+
+def test_diff_snapshots():
+    old = Snapshot.build(
+        [("1", "a"), ("2", "b"), ("3", "c")],
+        [("10", "x"), ("11", "y")],
+        [("1", "10", 0), ("2", "11", 1), ("3", "11", 0)],
+    )
+    new = Snapshot.build(
+        [("4", "d"), ("1", "a"), ("3", "c2")],
+        [("11", "y"), ("12", "z")],
+        [("1", "10", 0), ("3", "11", 0), ("4", "12", 0)],
+    )
+
+    diff = diff_snapshots(old, new)
+    assert diff.books.added == ["4"]
+    assert diff.books.changed == ["3"]
+    assert diff.books.removed == ["2"]
+    assert diff.persons.added == ["12"]
+    assert diff.persons.removed == ["10"]
+    assert not diff.persons.changed
+    assert diff.contributors.added == ["4-12-0"]
+    assert diff.contributors.removed == ["2-11-1"]
+    assert diff.summary() == "books +1 ~1 -1, persons +1 ~0 -1, contributors +1 ~0 -1"
+    assert not diff_snapshots(new, new).books
+
+
+def test_save_and_load(tmp_path: Path):
+    path = tmp_path / "snapshot.json.gz"
+    assert load_snapshot(path) is None
+
+    snapshot = Snapshot.build([("1", "a")], [("10", "x")], [("1", "10", 0)])
+    save_snapshot(path, snapshot)
+    assert load_snapshot(path) == snapshot
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+
+def test_save_and_load_in_storage():
+    db = MemoryStorage()
+    assert load_snapshot(db) is None
+
+    snapshot = Snapshot.build([("1", "a")], [("10", "x")], [("1", "10", 0)])
+    save_snapshot(db, snapshot)
+    assert load_snapshot(db) == snapshot
+
+    buffer = SnapshotBuffer(db.load_catalog_snapshot())
+    assert load_snapshot(buffer) == snapshot and not buffer.changed
+    save_snapshot(buffer, snapshot._replace(books=[]))
+    assert buffer.changed
+    assert load_snapshot(buffer) == snapshot._replace(books=[])
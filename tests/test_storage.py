@@ -0,0 +1,236 @@
+import json
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from aozora_data.catalog import Catalog
+from aozora_data.db.base import DocumentStorage
+from aozora_data.db.jsonl import JsonlStorage
+from aozora_data.db.memory import MemoryStorage
+from aozora_data.db.sqlite import SqliteStorage
+from aozora_data.importer import csv_importer
+from aozora_data.importer.csv_importer import import_from_csv
+from aozora_data.importer.main import main
+from aozora_data.importer.sharding import Shard
+from aozora_data.importer.snapshot import load_snapshot
+
+
+def _documents(db: DocumentStorage, collection: str) -> dict[str, dict]:
+    if isinstance(db, MemoryStorage):
+        return db.documents.get(collection, {})
+    if isinstance(db, JsonlStorage):
+        return db.read_documents(collection)
+    assert isinstance(db, SqliteStorage)
+    rows = db.conn.execute("SELECT id FROM documents WHERE collection = ?", (collection,))
+    documents = {doc_id: db.get_document(collection, doc_id) for (doc_id,) in rows}
+    return {doc_id: doc for doc_id, doc in documents.items() if doc is not None}
+
+
+@pytest.fixture(params=["memory", "sqlite", "jsonl"])
+def storage_factory(request: pytest.FixtureRequest, tmp_path: Path):
+    def factory() -> DocumentStorage:
+        if request.param == "sqlite":
+            return SqliteStorage(tmp_path / "aozora.db")
+        if request.param == "jsonl":
+            return JsonlStorage(tmp_path / "jsonl")
+        return MemoryStorage()
+
+    return factory
+
+
+def test_import(storage_factory: Callable[[], DocumentStorage]):
+    db = storage_factory()
+    with open("tests/data/test.csv") as fp:
+        import_from_csv(fp, db)
+    db.commit()
+
+    books = _documents(db, "books")
+    assert len(books) == 4
+    assert books["10003"]["author_name"] == "last_name_03 first_name_03"
+    assert _documents(db, "persons")["20003"]["person_id"] == 20003
+    assert db.get_watermark() is not None
+    db.close()
+
+
+def test_merge_keeps_fields(storage_factory: Callable[[], DocumentStorage]):
+    db = storage_factory()
+    db.upsert_book("1", {"title": "a", "author_name": "x"})
+    db.update_book_author("1", {"author_name": "y"})
+    db.commit()
+
+    assert _documents(db, "books")["1"] == {"title": "a", "author_name": "y"}
+    db.close()
+
+
+def test_partial_upsert(storage_factory: Callable[[], DocumentStorage]):
+    db = storage_factory()
+    db.upsert_book("1", {"title": "a", "author_name": "x"})
+    db.commit()
+    db.seen_books.clear()  # As in the next run
+    db.upsert_book("1", {"title": "b", "author_name": "ignored"}, fields=["title"])
+    db.commit()
+
+    assert _documents(db, "books")["1"] == {"title": "b", "author_name": "x"}
+    db.close()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "jsonl"])
+def test_state_persists(tmp_path: Path, backend: str):
+    path = tmp_path / backend
+    db = SqliteStorage(path) if backend == "sqlite" else JsonlStorage(path)
+    db.save_import_state({"catalog_sha256": "abc"})
+    db.save_fingerprints("books", {"1": "f1", "2": "f2"})
+    db.save_fingerprints("books", {"2": None})
+    assert db.load_catalog_snapshot() is None
+    db.save_catalog_snapshot(b"old")
+    db.save_catalog_snapshot(b"\x1f\x8bsnapshot")
+    db.close()
+
+    db = SqliteStorage(path) if backend == "sqlite" else JsonlStorage(path)
+    assert db.get_import_state() == {"catalog_sha256": "abc"}
+    assert db.load_fingerprints("books") == {"1": "f1"}
+    assert db.load_catalog_snapshot() == b"\x1f\x8bsnapshot"
+    db.close()
+
+
+def test_main_snapshot_in_storage(tmp_path: Path):
+    path = tmp_path / "aozora.db"
+    csv_path = tmp_path / "test.csv"
+    lines = Path("tests/data/test.csv").read_text(encoding="utf-8").splitlines(keepends=True)
+    csv_path.write_text("".join(lines), encoding="utf-8")
+    args = ["--backend", "sqlite", "--path", str(path), "--snapshot", "storage"]
+
+    main([*args, "--csv", str(csv_path)])
+    db = SqliteStorage(path)
+    assert db.load_catalog_snapshot() is not None
+    assert db.get_document("books", "10002") is not None
+    db.close()
+
+    # Book 10002 (the last row) leaves the catalog: the stored snapshot shows it was removed
+    smaller = tmp_path / "smaller.csv"
+    smaller.write_text("".join(lines[:-1]), encoding="utf-8")
+    main([*args, "--csv", str(smaller)])
+    db = SqliteStorage(path)
+    assert db.get_document("books", "10002") is None
+    assert db.get_document("books", "10003") is not None
+    db.close()
+
+
+def test_main_local_backend(tmp_path: Path):
+    path = tmp_path / "aozora.db"
+    csv_path = tmp_path / "test.csv.zip"
+    csv_path.write_bytes(Path("tests/data/test.csv.zip").read_bytes())
+    metrics_path = tmp_path / "metrics.json"
+    main(
+        [
+            *("--backend", "sqlite", "--path", str(path)),
+            *("--csv", str(csv_path), "--metrics", str(metrics_path)),
+        ]
+    )
+
+    summary = json.loads(metrics_path.read_text())
+    assert summary["counters"]["writes.books"] == 4
+    assert summary["counters"]["rows.processed"] == 4
+    assert {"unzip", "parse", "map", "process", "commit"} <= set(summary["phases_seconds"])
+
+    db = SqliteStorage(path)
+    assert len(db.load_fingerprints("books")) == 4
+    book = db.get_document("books", "10001")
+    assert book is not None and book["book_id"] == 10001
+    db.close()
+
+
+def test_sharded_import(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    synced: list[tuple[dict, dict]] = []
+    monkeypatch.setattr(
+        csv_importer, "_sync_algolia", lambda books, persons, *_: synced.append((books, persons))
+    )
+    path = tmp_path / "aozora.db"
+    count = 3
+
+    results = []
+    for index in range(count):
+        # A separate connection per shard, as separate Cloud Run tasks would have
+        db = SqliteStorage(path)
+        with open("tests/data/test.csv") as fp:
+            results.append(import_from_csv(fp, db, shard=Shard(index, count)))
+        if index < count - 1:
+            assert db.get_watermark() is None
+        db.close()
+
+    assert results == [False] * (count - 1) + [True]
+    db = SqliteStorage(path)
+    assert len(_documents(db, "books")) == 4
+    assert len(_documents(db, "persons")) == 4
+    assert len(_documents(db, "contributors")) == 4
+    assert db.get_watermark() is not None
+    assert all(value is None for key, value in db.get_import_state().items() if "checkpoint" in key)
+    db.close()
+
+    assert len(synced) == 1
+    assert sorted(synced[0][0]) == ["10000", "10001", "10002", "10003"]
+    assert len(synced[0][1]) == 4
+
+
+def test_sharded_import_with_snapshot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(csv_importer, "_sync_algolia", lambda *_: None)
+    path = tmp_path / "aozora.db"
+    lines = Path("tests/data/test.csv").read_text().splitlines()
+    without_10002 = tmp_path / "test.csv"
+    without_10002.write_text("\n".join(line for line in lines if "10002" not in line) + "\n")
+    count = 3
+
+    for csv_path in ("tests/data/test.csv", without_10002):
+        results = []
+        for index in range(count):
+            db = SqliteStorage(path)
+            with open(csv_path) as fp:
+                results.append(import_from_csv(fp, db, snapshot=db, shard=Shard(index, count)))
+            db.close()
+        assert results == [False] * (count - 1) + [True]
+
+    db = SqliteStorage(path)
+    assert sorted(_documents(db, "books")) == ["10000", "10001", "10003"]
+    assert len(_documents(db, "persons")) == 3
+    assert not any(cid.startswith("10002-") for cid in _documents(db, "contributors"))
+    snapshot = load_snapshot(db)
+    assert snapshot is not None and [b for b, _ in snapshot.books] == ["10000", "10001", "10003"]
+    db.close()
+
+
+def test_shards_partition_ids():
+    ids = [str(i) for i in range(1000)]
+    owners = [[Shard(index, 4).owns(i) for index in range(4)].count(True) for i in ids]
+    assert owners == [1] * len(ids)
+
+
+def test_finish_run_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    synced: list[tuple[dict, dict]] = []
+    monkeypatch.setattr(
+        csv_importer, "_sync_algolia", lambda books, persons, *_: synced.append((books, persons))
+    )
+    with open("tests/data/test.csv") as fp:
+        catalog = Catalog.parse(fp)
+    done = {"run_id": "run", "done": True, "books_done": 0, "max_last_modified": None}
+    first = SqliteStorage(tmp_path / "aozora.db")
+    first.save_import_state({f"checkpoint_{i}": done for i in range(2)})
+
+    # The other shard has claimed the run but not completed it yet
+    second = SqliteStorage(tmp_path / "aozora.db")
+    assert second.update_import_state(
+        lambda _: {"finishing": {"run_id": "run", "since": time.time()}}
+    )
+    assert not csv_importer.finish_run(catalog, first, "run", 2)
+    assert synced == []
+
+    # ...until its claim runs out
+    expired = time.time() - csv_importer.FINISH_LEASE_SECONDS - 1
+    second.save_import_state({"finishing": {"run_id": "run", "since": expired}})
+    assert csv_importer.finish_run(catalog, first, "run", 2)
+    assert len(synced) == 1
+    assert not csv_importer.finish_run(catalog, second, "run", 2)
+    assert second.get_import_state()["finishing"] is None
+    first.close()
+    second.close()
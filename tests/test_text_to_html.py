@@ -2,6 +2,7 @@
 import pathlib
 
 from aozora_data.text_to_html.converter import TextToHtmlConverter
+from aozora_data.text_to_html.css import prune_css
 
 
 def test_html5_header_structure(tmp_path: pathlib.Path):
@@ -176,3 +177,82 @@ def test_semantic_footer(tmp_path: pathlib.Path):
     assert '<div class="bibliographical_information">' in output_content
     assert "</footer>" in output_content
     assert output_content.index("<footer>") < output_content.index("</article>")
+
+
+def test_used_classes_recorded(tmp_path: pathlib.Path):
+    input_file = tmp_path / "input.txt"
+    output_file = tmp_path / "output.html"
+
+    input_content = (
+        "タイトル\n著者\n\n［＃ここから２字下げ］本文［＃ここで字下げ終わり］\n［＃改ページ］"
+    )
+    input_file.write_text(input_content, encoding="utf-8")
+
+    converter = TextToHtmlConverter(str(input_file), str(output_file))
+    converter.convert()
+
+    assert {"jisage_2", "page_break", "author", "main_text"} <= converter.used_classes
+    assert "midashi" not in converter.used_classes
+    assert "keigakomi" not in converter.used_classes
+
+
+def test_css_mode_inline(tmp_path: pathlib.Path):
+    input_file = tmp_path / "input.txt"
+    output_file = tmp_path / "output.html"
+
+    input_content = "タイトル\n著者\n\n［＃ここから１字下げ］本文［＃ここで字下げ終わり］"
+    input_file.write_text(input_content, encoding="utf-8")
+
+    converter = TextToHtmlConverter(str(input_file), str(output_file), css_mode="inline")
+    converter.convert()
+
+    output_content = output_file.read_text(encoding="utf-8")
+    head = output_content.split("</head>")[0]
+
+    assert "<style>" in head
+    assert ".jisage_1{" in head
+    assert ".jisage_2{" not in head
+    assert ".page_break{" not in head
+    assert '<link rel="stylesheet" href="./css/aozora.css" />' not in head.split("<noscript>")[0]
+    assert 'rel="preload" href="./css/aozora.css"' in head
+    assert '<div class="jisage_1">' in output_content
+    assert output_content.index("</head>") < output_content.index("<main>")
+
+
+def test_css_mode_inline_only(tmp_path: pathlib.Path):
+    input_file = tmp_path / "input.txt"
+    output_file = tmp_path / "output.html"
+
+    input_file.write_text("タイトル\n著者\n\n本文", encoding="utf-8")
+
+    converter = TextToHtmlConverter(str(input_file), str(output_file), css_mode="inline-only")
+    converter.convert()
+
+    output_content = output_file.read_text(encoding="utf-8")
+
+    assert "<style>" in output_content
+    assert "aozora.css" not in output_content
+    assert "@layer reset, tokens, base, semantics, typography, annotations, themes;" in output_content
+
+
+def test_prune_css():
+    css = """
+    /* comment */
+    @layer a, b;
+    @layer a {
+        p { margin: 0; }
+        .used, .unused { color: red; }
+        .unused { color: blue; }
+        @container (inline-size > 10px) {
+            .unused { color: green; }
+        }
+    }
+    """
+    pruned = prune_css(css, {"used"})
+
+    assert "@layer a, b;" in pruned
+    assert "p{margin: 0;}" in pruned
+    assert ".used{color: red;}" in pruned
+    assert "unused" not in pruned
+    assert "@container" not in pruned
+    assert "comment" not in pruned
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("boto3")
+sys.path.insert(0, str(Path(__file__).parents[1] / "scripts"))
+
+from upload_to_r2 import Md5Cache, select_changed_files
+
+
+def _md5(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+
+def test_partial_upload_keeps_other_cache_entries(tmp_path: Path):
+    html = tmp_path / "1.utf8.html"
+    css = tmp_path / "aozora.css"
+    removed = tmp_path / "2.utf8.html"
+    for path in (html, css, removed):
+        path.write_text(path.name)
+    files = [{"path": p, "key": p.name} for p in (html, css, removed)]
+    etags = {p.name: _md5(p.read_bytes()) for p in (html, css, removed)}
+
+    cache = Md5Cache(tmp_path / "cache.json")
+    assert select_changed_files(files, etags, cache, max_workers=2) == []
+    cache.save()
+
+    # An --html-only run after one of the pages is removed
+    removed.unlink()
+    html.write_text("changed")
+    cache = Md5Cache(tmp_path / "cache.json")
+    changed = select_changed_files(files[:1], etags, cache, max_workers=2)
+    assert [item["key"] for item in changed] == [html.name]
+    cache.save()
+
+    entries = json.loads((tmp_path / "cache.json").read_text())
+    assert sorted(entries) == sorted([str(html), str(css)])
+    assert entries[str(html)][3] == _md5(b"changed")
+
+    # The stylesheet is still known, so the next full run does not hash it again
+    cache = Md5Cache(tmp_path / "cache.json")
+    select_changed_files(files[1:2], etags, cache, max_workers=2)
+    assert cache.hits == 1